@@ -100,11 +100,14 @@ from .targets import (
     PickleTarget,
     KerasTarget,
     DummyTarget,
+    DuckDBTarget,
     JsonTarget,
     PytorchTarget,
+    TensorArchiveTarget,
     ParquetTarget,
     FileTarget,
-    LocalTarget
+    LocalTarget,
+    TargetManifest,
 )
 
 from .tools import (
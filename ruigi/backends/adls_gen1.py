@@ -1,20 +1,54 @@
 import os
+import uuid
+from contextlib import contextmanager
 import pickle
 import gzip
 import pandas as pd
 import joblib
-from io import BytesIO
-import tempfile
 
-from azure.datalake.store import core, lib
+from azure.datalake.store import core, lib, multithread
+from azure.datalake.store.exceptions import (
+    DatalakeRESTException, DatalakeIncompleteTransferException)
+from . import metrics
+from .batch import BatchMixin
+from .clients import ClientMixin
+from .formats import serialize
+from .retries import RetryPolicy, retrying, unless_file
+from .staging import StagingMixin
+from .transfer import TransferSettings
 
-__TEMP_STORAGE__ = os.path.join(tempfile.gettempdir(), 'ruigi')
+_MAX_BLOCK = 4 * 2 ** 20  # largest ADLS append request
+_TMP_SUFFIX = '.ruigi-tmp'  # in-flight streamed uploads
+_RETRY_LIST = (DatalakeRESTException, DatalakeIncompleteTransferException,
+               ConnectionError, TimeoutError)
 
 
-class ADLSStorage:
-    def __init__(self, parent_folder=None, **kwargs):
-        os.makedirs(__TEMP_STORAGE__, exist_ok=True)
+class ADLSStorage(StagingMixin, ClientMixin, BatchMixin):
+    """ Storage backed by Azure Data Lake Storage Gen1.
+
+    Credentials are resolved once, while the file system client is created
+    lazily in each process, so the same storage can be shared by luigi
+    workers. The SDK already keeps one pooled HTTP session per thread.
+
+    Args:
+        parent_folder: `str` default `None`
+            Prefix of every object saved by this storage.
+        transfer_settings: :py:class:`ruigi.backends.transfer.TransferSettings` default `None`
+            Chunk size and number of threads of multithreaded uploads and downloads.
+        retry_policy: :py:class:`ruigi.backends.retries.RetryPolicy` default `None`
+            Retries and hedging of requests. By default, connection and REST
+            errors are retried with jittered backoff.
+        staging: :py:class:`ruigi.backends.staging.StagingArea` default `None`
+            Where local files are staged. Defaults to the shared staging area.
+        **kwargs:
+            token, store_name, resource and creds. See `_init`.
+    """
+    def __init__(self, parent_folder=None, transfer_settings=None, retry_policy=None,
+                 staging=None, **kwargs):
+        self.staging = staging
         self.parent_folder = parent_folder
+        self.transfer_settings = transfer_settings or TransferSettings()
+        self.retry_policy = retry_policy or RetryPolicy(retry_on=_RETRY_LIST)
         self._init(**kwargs)
 
     def _init(self, token=None, store_name=None, resource=None, creds=None):
@@ -26,20 +60,74 @@ class ADLSStorage:
         resource = resource or os.environ.get('ADL_RESOURCE', 'https://datalake.azure.net/')
         self.base_url = f"adl://{self.store_name}.azuredatalakestore.net"
 
+        if self.token is None and creds is None:
+            creds = lib.auth(url_suffix=self.store_name, resource=resource)
+        self.creds = creds
+
+    def _create_clients(self):
         if self.token is None:
-            if creds is None:
-                creds = lib.auth(url_suffix=self.store_name, resource=resource)
-            self.client = core.AzureDLFileSystem(creds, store_name=self.store_name)
+            client = core.AzureDLFileSystem(self.creds, store_name=self.store_name)
         else:
-            self.client = core.AzureDLFileSystem(token=token, store_name=self.store_name)
+            client = core.AzureDLFileSystem(token=self.token, store_name=self.store_name)
+        return {'client': client}
+
+    def _transfer_options(self):
+        # Each thread moves one chunk of `part_size` bytes at a time, with
+        # requests of up to 4 MB, the largest block ADLS accepts.
+        settings = self.transfer_settings
+        block = min(settings.part_size, _MAX_BLOCK)
+        return dict(nthreads=settings.max_concurrency, chunksize=settings.part_size,
+                    buffersize=block, blocksize=block, overwrite=True)
 
     def _upload_local(self, local_file_name, remote_file_name):
-        self.client.put(local_file_name, remote_file_name)
+        settings = self.transfer_settings
+        if settings.is_multipart(os.path.getsize(local_file_name)):
+            _check_transfer(multithread.ADLUploader(
+                self.client, rpath=remote_file_name, lpath=local_file_name,
+                **self._transfer_options()), remote_file_name)
+        else:
+            self.client.put(local_file_name, remote_file_name)
 
-    def _upload_buffer(self, buffer, remote_file_name):
-        with self.client.open(remote_file_name, 'wb') as f:
-            f.write(buffer.getvalue())
+    def _download_local(self, remote_file_name, local_file_name):
+        settings = self.transfer_settings
+        if settings.is_multipart(self.client.info(remote_file_name)['length']):
+            _check_transfer(multithread.ADLDownloader(
+                self.client, rpath=remote_file_name, lpath=local_file_name,
+                **self._transfer_options()), remote_file_name)
+        else:
+            self.client.get(remote_file_name, local_file_name)
+
+    @contextmanager
+    def _open(self, remote_file_name, format):
+        # Remote reads are buffered one part at a time.
+        with self.client.open(remote_file_name, 'rb',
+                              blocksize=self.transfer_settings.part_size) as fr:
+            yield fr
+            metrics.add_bytes(self, 'load', format, fr.tell())
+
+    def _upload_serialized(self, obj, format, remote_file_name):
+        # ADLS files are written block by block as the serializer fills them,
+        # so nothing is staged on disk or fully buffered in memory. The blocks
+        # go to a temporary file that is renamed into place once complete, so
+        # readers never see a partial object and a failed write keeps the
+        # previous version.
+        tmp_file_name = f'{remote_file_name}.{uuid.uuid4().hex}{_TMP_SUFFIX}'
+        try:
+            with self.client.open(tmp_file_name, 'wb',
+                                  blocksize=self.transfer_settings.part_size) as f:
+                serialize(obj, f, format=format)
+                nbytes = f.tell()
+            # RENAME does not replace an existing destination.
+            if self.client.exists(remote_file_name):
+                self.client.remove(remote_file_name)
+            self.client.mv(tmp_file_name, remote_file_name)
+        except BaseException:
+            if self.client.exists(tmp_file_name):
+                self.client.remove(tmp_file_name)
+            raise
+        metrics.add_bytes(self, 'save', format, nbytes)
 
+    @retrying()
     def save(self, name, obj, format='pickle', chunk_size=None):
         """ Save file to cloud
 
@@ -54,45 +142,28 @@ class ADLSStorage:
                     2. `joblib`: It uses `joblib.dump` to save a BytesIO binary file.
                     3. `file`: It saves a local file sending it directly to ADLS.
                     4. `parquet`: It saves a parquet file using pandas.to_parquet.
+                    5. `writer`: It streams the bytes written by the function `obj`.
             chunk_size: `int` default `None`
                 The size of a chunk of data whenever iterating (in bytes).
                 This must be a multiple of 256 KB per the API specification.
         """
         remote_file_name = '/'.join([self.parent_folder, name]) if self.parent_folder else name
-        local_file_name = os.path.join(__TEMP_STORAGE__, remote_file_name.replace("/", "-"))
 
-        if format == 'parquet':
-            if not isinstance(obj, pd.DataFrame):
-                # In case it is a Spark DF
-                obj = obj.toPandas()
-            try:
-                obj.to_parquet(local_file_name)
-                self._upload_local(local_file_name, remote_file_name)
-            finally:
-                os.remove(local_file_name)
+        if format == 'parquet' and not isinstance(obj, pd.DataFrame):
+            # In case it is a Spark DF
+            obj = obj.toPandas()
 
-        elif format == 'joblib':
-            with BytesIO() as buffer:
-                joblib.dump(obj, buffer)
-                buffer.seek(0)
-                self._upload_buffer(buffer, remote_file_name)
-            return
-
-        elif format == 'pickle':
-            try:
-                with gzip.open(local_file_name, 'wb') as f:
-                    pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-                self._upload_local(local_file_name, remote_file_name)
-            finally:
-                os.remove(local_file_name)
+        if format in ('parquet', 'joblib', 'pickle', 'writer'):
+            self._upload_serialized(obj, format, remote_file_name)
 
         elif format == 'file':
             self._upload_local(obj, remote_file_name)
 
         else:
             raise ValueError(
-                "Supported formats are pickle, joblib, file or parquet")
+                "Supported formats are pickle, joblib, file, parquet or writer")
 
+    @retrying(hedge=unless_file)
     def load(self, name, format='pickle', columns=None, chunk_size=None):
         """
         Args:
@@ -111,52 +182,75 @@ class ADLSStorage:
                 This must be a multiple of 256 KB per the API specification.
         """
         remote_file_name = '/'.join([self.parent_folder, name]) if self.parent_folder else name
-        local_file_name = os.path.join(
-            __TEMP_STORAGE__, remote_file_name.replace("/", "-"))
 
         if format == 'file':
-            with self.client.open(remote_file_name, 'rb') as fr:
-                with open(local_file_name, 'wb') as fw:
-                    fw.write(fr)
-                return local_file_name
+            with self.staging.writing(remote_file_name) as local_file_name:
+                self._download_local(remote_file_name, local_file_name)
+            return local_file_name
 
         elif format == 'joblib':
-            with self.client.open(remote_file_name, 'rb') as fr:
+            with self._open(remote_file_name, format) as fr:
                 return joblib.load(fr)
 
         if format == 'parquet':
-            with self.client.open(remote_file_name, 'rb') as fr:
+            with self._open(remote_file_name, format) as fr:
                 return pd.read_parquet(fr, columns=columns)
 
         elif format == 'pickle':
-            with self.client.open(remote_file_name, 'rb') as fr:
-                try:
-                    # Load ZIP
-                    with open(local_file_name, 'wb') as fw:
-                        fw.write(fr.read())
-                    # Unzip
-                    with gzip.open(local_file_name, 'rb') as gr:
-                        obj = pickle.load(gr)
-                        return obj
-                finally:
-                    os.remove(local_file_name)
+            # Decompress while reading, without a local copy.
+            with self._open(remote_file_name, format) as fr, \
+                    gzip.GzipFile(fileobj=fr, mode='rb') as gr:
+                return pickle.load(gr)
         else:
             raise ValueError("Supported formats are pickle, joblib, file or parquet")
 
+    @retrying(hedge=True)
+    def size(self, name):
+        """ Returns the size in bytes of a remote file."""
+        remote_file_name = '/'.join([self.parent_folder, name]) if self.parent_folder else name
+        return self.client.info(remote_file_name)['length']
+
+    @retrying(hedge=True)
+    def read_range(self, name, start, end):
+        """ Returns the bytes [start, end) of a remote file."""
+        remote_file_name = '/'.join([self.parent_folder, name]) if self.parent_folder else name
+        return self.client.read_block(remote_file_name, start, end - start)
+
+    @retrying(hedge=True)
     def exists(self, path):
         path = '/'.join([self.parent_folder, path]) if self.parent_folder else path
         return self.client.exists(path)
 
+    def list(self, prefix=''):
+        """ Yields the names of all remote files starting with `prefix`. The
+        deepest folder in `prefix` is walked recursively."""
+        remote_prefix = '/'.join([self.parent_folder, prefix]) if self.parent_folder else prefix
+        base = self.parent_folder.strip('/') if self.parent_folder else ''
+        strip = len(base) + 1 if base else 0
+        folder = remote_prefix.rsplit('/', 1)[0] if '/' in remote_prefix else ''
+        try:
+            paths = self.client.walk(folder)
+        except FileNotFoundError:
+            return
+        for path in paths:
+            path = path.lstrip('/')
+            if path.endswith(_TMP_SUFFIX):
+                continue
+            if path.startswith(remote_prefix.lstrip('/')):
+                yield path[strip:]
+
     def list_dir(self, path):
         path = '/'.join([self.parent_folder, path]) if self.parent_folder else path
         return self.client.ls(path)
 
+    @retrying()
     def delete(self, name):
         remote_file_name = '/'.join([self.parent_folder, name]) if self.parent_folder else name
         self.client.remove(remote_file_name)
 
-        local_file_name = os.path.join(
-            __TEMP_STORAGE__, remote_file_name.replace("/", "-"))
 
-        if os.path.isfile(local_file_name):
-            os.remove(local_file_name)
+def _check_transfer(transfer, remote_file_name):
+    # The multithreaded transfers report failed chunks instead of raising.
+    if not transfer.successful():
+        raise DatalakeIncompleteTransferException(
+            f"Transfer of {remote_file_name} did not complete")
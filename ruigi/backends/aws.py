@@ -1,28 +1,95 @@
 import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pickle
 import gzip
 import pandas as pd
 import joblib
 from io import BytesIO
-import tempfile
-from retry import retry
 import boto3
 import botocore.exceptions
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from . import metrics
+from .batch import BatchMixin, BatchResult
+from .checkpoints import UploadCheckpoints
+from .clients import ClientMixin, default_max_connections
+from .rangefile import RangeFile
+from .retries import RetryPolicy, retrying, unless_file
+from .staging import StagingMixin
+from .streaming import stream_upload
+from .transfer import TransferSettings, parallel_download
 
-_RETRY_LIST = ()
-__TEMP_STORAGE__ = os.path.join(tempfile.gettempdir(), 'ruigi')
+_MAX_PARTS = 10000
+_MIN_PART_SIZE = 5 * 2 ** 20
+# Throttling and server side errors worth retrying.
+_RETRY_CODES = {'RequestTimeout', 'SlowDown', 'Throttling', 'ThrottlingException',
+                'InternalError', 'ServiceUnavailable', '500', '502', '503', '504'}
 
 
-class S3Storage:
+def _is_retryable(error):
+    if isinstance(error, botocore.exceptions.ClientError):
+        return error.response['Error']['Code'] in _RETRY_CODES
+    return isinstance(error, (botocore.exceptions.ConnectionError,
+                              botocore.exceptions.HTTPClientError,
+                              ConnectionError, TimeoutError))
+
+
+class S3Storage(StagingMixin, ClientMixin, BatchMixin):
+    """ Storage backed by an S3 bucket.
+
+    The boto3 resource is created lazily in each process, so the same storage
+    can be shared by luigi workers. See :py:class:`ruigi.backends.clients.ClientMixin`.
+
+    Args:
+        bucket_name: `str`
+        aws_access_key_id: `str` default `None`
+        aws_secret_access_key: `str` default `None`
+        aws_session_token: `str` default `None`
+        parent_folder: `str` default `''`
+            Prefix of every object saved by this storage.
+        transfer_settings: :py:class:`ruigi.backends.transfer.TransferSettings` default `None`
+            Part size and concurrency of multipart uploads and downloads.
+        endpoint_url: `str` default `None`
+            Alternative S3 endpoint, e.g. a local emulator.
+        max_connections: `int` default `None`
+            Size of the HTTP connection pool of each process. By default, enough
+            for all batch and transfer threads.
+        tcp_keepalive: `bool` default `True`
+            Enable TCP keep-alive on pooled connections.
+        retry_policy: :py:class:`ruigi.backends.retries.RetryPolicy` default `None`
+            Retries and hedging of requests. By default, connection errors,
+            throttling and 5xx responses are retried with jittered backoff.
+        staging: :py:class:`ruigi.backends.staging.StagingArea` default `None`
+            Where local files are staged. Defaults to the shared staging area.
+        resumable_uploads: `bool` default `True`
+            Checkpoint multipart uploads of local files in the staging area, so
+            a failed or interrupted upload continues from its completed parts.
+            Unfinished uploads keep their parts in the bucket until resumed;
+            a lifecycle rule aborting incomplete multipart uploads removes
+            the abandoned ones.
+    """
+    _client_names = ('client', 'bucket')
+
     def __init__(self, bucket_name, aws_access_key_id=None,
-                 aws_secret_access_key=None, aws_session_token=None, parent_folder='', ):
-        os.makedirs(__TEMP_STORAGE__, exist_ok=True)
+                 aws_secret_access_key=None, aws_session_token=None, parent_folder='',
+                 transfer_settings=None, endpoint_url=None, max_connections=None,
+                 tcp_keepalive=True, retry_policy=None, staging=None,
+                 resumable_uploads=True):
+        self.staging = staging
+        self.resumable_uploads = resumable_uploads
 
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.aws_session_token = aws_session_token
         self.bucket_name = bucket_name
         self.parent_folder = parent_folder
+        self.endpoint_url = endpoint_url
+        self.transfer_settings = transfer_settings or TransferSettings()
+        self.max_connections = max_connections or default_max_connections(self)
+        self.tcp_keepalive = tcp_keepalive
+        self.retry_policy = retry_policy or RetryPolicy(retry_on=_is_retryable)
         self._init()
 
     def _init(self,):
@@ -30,16 +97,40 @@ class S3Storage:
         Initialize S3 back-end
 
         """
+        settings = self.transfer_settings
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.multipart_threshold,
+            multipart_chunksize=settings.part_size,
+            max_concurrency=settings.max_concurrency,
+            use_threads=settings.max_concurrency > 1,
+        )
+        # Streaming (non-seekable) uploads keep up to this many parts in
+        # memory: 2 parts of 64MB by default, whatever the object size.
+        self.transfer_config.max_in_memory_upload_chunks = min(
+            settings.stream_parts, settings.max_concurrency)
 
+    def _create_clients(self):
         # TODO: USe envs variables.
-        self.client = boto3.resource(
-            's3',
+        session = boto3.session.Session(
             aws_access_key_id=self.aws_access_key_id,
             aws_secret_access_key=self.aws_secret_access_key,
-            aws_session_token=self.aws_session_token
+            aws_session_token=self.aws_session_token,
+        )
+        client = session.resource(
+            's3',
+            endpoint_url=self.endpoint_url,
+            config=Config(max_pool_connections=self.max_connections,
+                          tcp_keepalive=self.tcp_keepalive),
         )
-        self.bucket = self.client.Bucket(self.bucket_name)
+        return {'client': client, 'bucket': client.Bucket(self.bucket_name)}
 
+    @property
+    def _s3(self):
+        # boto3 resources and their objects are not thread-safe, but the
+        # low-level client is: batch and transfer threads only use the latter.
+        return self.client.meta.client
+
+    @retrying()
     def save(self, name, obj, format='pickle', chunk_size=None):
         """
         Args:
@@ -50,41 +141,103 @@ class S3Storage:
             format: `str`
                 Possible values:
                     1. `pickle`: It uses `pickle.dump` to save a gzip binary file.
-                    2. `joblib`: It uses `joblib.dump` to save a BytesIO binary file.
-                    3. `file`: It saves a local file sending it directly to GCS.
+                    2. `joblib`: It uses `joblib.dump` to save a binary file.
+                    3. `file`: It saves a local file sending it directly to S3.
                     4. `parquet`: It saves a parquet file using pandas.to_parquet.
+                    5. `writer`: It streams the bytes written by the function `obj`.
             chunk_size: `int` default `None`
-                The size of a chunk of data whenever iterating (in bytes).
-                This must be a multiple of 256 KB per the API specification.
+                Not used. Part size is set by `transfer_settings`.
         """
 
         remote_file_name = os.path.join(self.parent_folder, name)
-        local_file_name = os.path.join(
-            __TEMP_STORAGE__, remote_file_name.replace("/", "-"))
-
-        if format == 'parquet':
-            if not isinstance(obj, pd.DataFrame):
-                raise ValueError(f"Object to be saved as parquet must be a "
-                                 f"DataFrame. Received a {type(obj)}")
-            obj.to_parquet(local_file_name)
-        elif format == 'joblib':
-            with BytesIO() as buffer:
-                joblib.dump(obj, buffer)
-                buffer.seek(0)
-                self.bucket.upload_fileobj(buffer, remote_file_name)
-            return
-        elif format == 'pickle':
-            with gzip.open(local_file_name, 'wb') as f:
-                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-        elif format == 'file':
-            local_file_name = obj
+
+        if format == 'file':
+            if self.resumable_uploads and \
+                    os.path.getsize(obj) >= self.transfer_settings.multipart_threshold:
+                self._upload_resumable(obj, remote_file_name)
+            else:
+                self._s3.upload_file(obj, self.bucket_name, remote_file_name,
+                                     Config=self.transfer_config)
+        elif format in ('parquet', 'joblib', 'pickle', 'writer'):
+            # The serializer streams into a multipart upload, so nothing is
+            # staged on disk and memory holds up to `stream_parts` parts.
+            def upload(stream):
+                self._s3.upload_fileobj(stream, self.bucket_name, remote_file_name,
+                                        Config=self.transfer_config)
+                return stream.tell()
+            metrics.add_bytes(self, 'save', format, stream_upload(obj, format, upload))
         else:
             raise ValueError(
-                "Supported formats are pickle, joblib, file or parquet")
+                "Supported formats are pickle, joblib, file, parquet or writer")
+
+    def _upload_resumable(self, local_file_name, remote_file_name):
+        """ Multipart upload of a local file that can be resumed.
+
+        The upload id is checkpointed in the staging area, along with the
+        ETag of each completed part. When a file of the same size is saved
+        again to the same key, e.g. by a retry or by a rerun after a crash,
+        the pending upload is reused: parts already in S3 whose ETag matches
+        the MD5 of the local part are skipped, and the rest are uploaded.
+        """
+        client = self._s3
+        size = os.path.getsize(local_file_name)
+        part_size = _part_size(size, self.transfer_settings.part_size)
+        checkpoints = UploadCheckpoints(self.staging)
+        key = ['s3', self.endpoint_url, self.bucket_name, remote_file_name, size, part_size]
+        state = checkpoints.load(key)
+        uploaded = None
+        if state is not None:
+            uploaded = self._uploaded_parts(state['upload_id'], remote_file_name)
+        if uploaded is None:
+            response = client.create_multipart_upload(Bucket=self.bucket_name,
+                                                      Key=remote_file_name)
+            state = {'upload_id': response['UploadId'], 'parts': {}}
+            checkpoints.save(key, state)
+            uploaded = {}
+        lock = threading.Lock()
+
+        def upload_part(number):
+            with open(local_file_name, 'rb') as f:
+                f.seek((number - 1) * part_size)
+                data = f.read(part_size)
+            etag = hashlib.md5(data).hexdigest()
+            if uploaded.get(number) == etag:
+                metrics.increment(self, 'save', 'resumed_parts')
+                return etag
+            response = self.retry_policy.call(
+                client.upload_part, Bucket=self.bucket_name, Key=remote_file_name,
+                UploadId=state['upload_id'], PartNumber=number, Body=data)
+            with lock:
+                state['parts'][str(number)] = response['ETag'].strip('"')
+                checkpoints.save(key, state)
+            return response['ETag'].strip('"')
+
+        numbers = range(1, max(-(-size // part_size), 1) + 1)
+        with ThreadPoolExecutor(self.transfer_settings.max_concurrency) as pool:
+            etags = list(pool.map(metrics.bind(upload_part), numbers))
+        client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=remote_file_name, UploadId=state['upload_id'],
+            MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': f'"{etag}"'}
+                                       for n, etag in zip(numbers, etags)]})
+        checkpoints.remove(key)
 
-        self.bucket.upload_file(local_file_name, remote_file_name)
+    def _uploaded_parts(self, upload_id, remote_file_name):
+        """ Returns {part number: ETag} of a pending multipart upload, or None
+        if the upload no longer exists."""
+        paginator = self._s3.get_paginator('list_parts')
+        parts = {}
+        try:
+            for page in paginator.paginate(Bucket=self.bucket_name, Key=remote_file_name,
+                                           UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    parts[part['PartNumber']] = part['ETag'].strip('"')
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchUpload', '404'):
+                return None
+            raise
+        return parts
 
-    @retry(_RETRY_LIST, tries=5)
+    @retrying(hedge=unless_file)
     def load(self, name, format='pickle', columns=None, chunk_size=None):
         """
         Args:
@@ -97,59 +250,142 @@ class S3Storage:
                     3. `file`: It saves a local file sending it directly to GCS.
                     4. `parquet`: It saves a parquet file using pandas.read_parquet.
             columns: `list` default `None`
-                Columns to fetch when using `parquet=True`
+                Columns to fetch when using `parquet=True`. Only those
+                columns are downloaded, using range requests.
             chunk_size: `int` default `None`
                 The size of a chunk of data whenever iterating (in bytes).
                 This must be a multiple of 256 KB per the API specification.
         """
 
         remote_file_name = os.path.join(self.parent_folder, name)
-        obj = self.bucket.Object(remote_file_name, )
-        local_file_name = os.path.join(
-            __TEMP_STORAGE__, remote_file_name.replace("/", "-"))
-
-        if obj is None:
-            raise FileNotFoundError(
-                f'Remote file {remote_file_name} not found')
 
         if format == 'file':
-            self.bucket.download_file(remote_file_name, local_file_name)
+            with self.staging.writing(remote_file_name) as local_file_name:
+                with open(local_file_name, 'wb') as f:
+                    self._download(remote_file_name, f)
             return local_file_name
+        elif format not in ('joblib', 'parquet', 'pickle'):
+            raise ValueError(
+                "Supported formats are pickle, joblib, file or parquet")
+        elif format == 'parquet' and columns is not None:
+            # Only the footer and the chunks of the requested columns are fetched.
+            return pd.read_parquet(RangeFile(self, name), columns=columns)
 
-        else:
-            buffer = BytesIO()
-            self.bucket.download_fileobj(remote_file_name, buffer)
+        buffer = BytesIO()
+        self._download(remote_file_name, buffer)
+        metrics.add_bytes(self, 'load', format, buffer.tell())
+        buffer.seek(0)
 
         if format == 'joblib':
             return joblib.load(buffer)
         elif format == 'parquet':
             return pd.read_parquet(buffer, columns=columns)
         elif format == 'pickle':
-            self.bucket.download_file(remote_file_name, local_file_name)
-            with gzip.open(local_file_name, 'rb') as f:
+            with gzip.GzipFile(fileobj=buffer, mode='rb') as f:
                 return pickle.load(f)
-        else:
-            raise ValueError(
-                "Supported formats are pickle, joblib, file or parquet")
 
+    def _download(self, remote_file_name, fileobj):
+        """ Download an object into fileobj.
+
+        The first part is fetched with a single ranged GET, which is the whole
+        object for anything smaller than the part size. Larger objects are
+        completed with concurrent range requests.
+        """
+        part_size = self.transfer_settings.part_size
+        try:
+            response = self._s3.get_object(Bucket=self.bucket_name, Key=remote_file_name,
+                                           Range=f'bytes=0-{part_size - 1}')
+        except botocore.exceptions.ClientError as e:
+            code = e.response['Error']['Code']
+            if code in ('NoSuchKey', '404'):
+                raise FileNotFoundError(
+                    f'Remote file {remote_file_name} not found') from e
+            if code == 'InvalidRange':
+                return  # empty object
+            raise
+        first = response['Body'].read()
+        fileobj.write(first)
+        content_range = response.get('ContentRange')
+        total = int(content_range.rsplit('/', 1)[1]) if content_range else len(first)
+        offset = len(first)
+        if total > offset:
+            parallel_download(
+                lambda start, end: self.retry_policy.call(
+                    self._read_range, remote_file_name, offset + start, offset + end),
+                total - offset, fileobj, self.transfer_settings)
+
+    @retrying(hedge=True)
+    def size(self, name):
+        """ Returns the size in bytes of a remote file."""
+        remote_file_name = os.path.join(self.parent_folder, name)
+        try:
+            return self._s3.head_object(Bucket=self.bucket_name,
+                                        Key=remote_file_name)['ContentLength']
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                raise FileNotFoundError(
+                    f'Remote file {remote_file_name} not found') from e
+            raise
+
+    @retrying(hedge=True)
+    def read_range(self, name, start, end):
+        """ Returns the bytes [start, end) of a remote file using a single range request."""
+        remote_file_name = os.path.join(self.parent_folder, name)
+        return self._read_range(remote_file_name, start, end)
+
+    def _read_range(self, remote_file_name, start, end):
+        response = self._s3.get_object(Bucket=self.bucket_name, Key=remote_file_name,
+                                       Range=f'bytes={start}-{end - 1}')
+        return response['Body'].read()
+
+    def list(self, prefix=''):
+        """ Yields the names of all remote files starting with `prefix`.
+        Results are fetched page by page, up to 1000 names per request."""
+        remote_prefix = os.path.join(self.parent_folder, prefix)
+        strip = len(os.path.join(self.parent_folder, ''))
+        paginator = self._s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=remote_prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][strip:]
+
+    @retrying(hedge=True)
     def exists(self, name):
 
         remote_file_name = os.path.join(self.parent_folder, name)
-        obj = self.bucket.Object(remote_file_name)
         try:
-            obj.load()
-        except botocore.exceptions.ClientError:
+            self._s3.head_object(Bucket=self.bucket_name, Key=remote_file_name)
+        except botocore.exceptions.ClientError as e:
+            if _is_retryable(e):
+                raise
             return False
         else:
             return True
 
+    @retrying()
     def delete(self, name):
         remote_file_name = os.path.join(self.parent_folder, name)
-        obj = self.bucket.Object(remote_file_name)
-        if obj is not None:
-            obj.delete()
-
-        local_file_name = os.path.join(
-            __TEMP_STORAGE__, remote_file_name.replace("/", "-"))
-        if os.path.isfile(local_file_name):
-            os.remove(local_file_name)
+        self._s3.delete_object(Bucket=self.bucket_name, Key=remote_file_name)
+
+    def delete_many(self, names):
+        """ Delete many objects with S3 batch deletes, up to 1000 objects per request."""
+        names = list(names)
+        errors = {}
+        for i in range(0, len(names), 1000):
+            chunk = {os.path.join(self.parent_folder, name): name for name in names[i:i + 1000]}
+            try:
+                response = self._s3.delete_objects(Bucket=self.bucket_name, Delete={
+                    'Objects': [{'Key': key} for key in chunk], 'Quiet': True})
+            except botocore.exceptions.ClientError as e:
+                errors.update({name: e for name in chunk.values()})
+                continue
+            for error in response.get('Errors', []):
+                errors[chunk[error['Key']]] = OSError(
+                    f"{error['Code']}: {error['Message']} ({error['Key']})")
+        return [BatchResult(name, None, errors.get(name)) for name in names]
+
+
+def _part_size(size, part_size):
+    """ Part size of a multipart upload: at least 5 MB, and large enough to
+    need at most 10000 parts."""
+    part_size = max(part_size, _MIN_PART_SIZE, -(-size // _MAX_PARTS))
+    return -(-part_size // 2 ** 20) * 2 ** 20
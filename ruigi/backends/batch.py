@@ -0,0 +1,71 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+BatchResult = namedtuple('BatchResult', ['name', 'value', 'error'])
+BatchResult.__doc__ = """ Result of one item of a batch operation.
+
+`value` is what the single object operation returned and `error` the
+exception it raised, if any. Use `result.error is None` to check success."""
+
+
+class BatchMixin:
+    """ Concurrent batch versions of save, load, exists and delete.
+
+    Items are processed by a thread pool owned by the storage, created lazily
+    and re-created in forked processes. Every method returns a list of
+    :py:class:`BatchResult`, in the same order as the given names, and never
+    raises because of a single item.
+    """
+    max_workers = 16
+
+    def _batch_executor(self):
+        pid = os.getpid()
+        if getattr(self, '_batch_pool_pid', None) != pid:
+            self._batch_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+            self._batch_pool_pid = pid
+        return self._batch_pool
+
+    def _batch(self, function, names, *args, **kwargs):
+        pool = self._batch_executor()
+        futures = [(name, pool.submit(function, name, *args, **kwargs)) for name in names]
+        results = []
+        for name, future in futures:
+            try:
+                results.append(BatchResult(name, future.result(), None))
+            except Exception as e:
+                results.append(BatchResult(name, None, e))
+        return results
+
+    def save_many(self, items, format='pickle', **kwargs):
+        """ Save many objects concurrently.
+
+        Args:
+            items: `dict` or `list`
+                A dict {name: obj} or a list of (name, obj) tuples.
+            format: `str`
+                Format used for all objects. See `save`.
+        """
+        objects = dict(items)
+        return self._batch(lambda name: self.save(name, objects[name], format=format, **kwargs),
+                           objects)
+
+    def load_many(self, names, format='pickle', **kwargs):
+        """ Load many objects concurrently. See `load` for the arguments."""
+        return self._batch(self.load, names, format=format, **kwargs)
+
+    def exists_many(self, names):
+        """ Check the existence of many objects concurrently."""
+        return self._batch(self.exists, names)
+
+    def delete_many(self, names):
+        """ Delete many objects concurrently."""
+        return self._batch(self.delete, names)
+
+
+def raise_first_error(results, ignore=()):
+    """ Raise the first error found in a list of :py:class:`BatchResult`,
+    except errors of the types in `ignore`."""
+    for result in results:
+        if result.error is not None and not isinstance(result.error, ignore):
+            raise result.error
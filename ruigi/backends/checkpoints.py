@@ -0,0 +1,63 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+class UploadCheckpoints:
+    """ State of resumable uploads, kept in the `uploads` folder of a staging area.
+
+    Storages record the upload session of large files, e.g. a S3 multipart
+    upload id and its completed parts, so an upload interrupted by an error or
+    a crash continues where it stopped the next time the same file is saved,
+    in this or another process. Checkpoints are small JSON files, one per
+    upload, removed once the upload completes. They are not subject to the
+    staging quota.
+
+    Args:
+        staging: :py:class:`ruigi.backends.staging.StagingArea`
+    """
+
+    def __init__(self, staging):
+        self.path = os.path.join(staging.path, 'uploads')
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return os.path.join(self.path, f"{digest}.json")
+
+    def load(self, key):
+        """ Returns the state saved for `key`, or None."""
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)['state']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def save(self, key, state):
+        """ Atomically replace the state of `key`. `state` must be JSON serializable."""
+        path = self._file(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': key, 'updated_at': time.time(), 'state': state}, f)
+            os.replace(tmp_path, path)
+
+    def remove(self, key):
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+
+    def __iter__(self):
+        """ Yields (key, state) of every pending upload."""
+        for entry in sorted(os.listdir(self.path)):
+            if entry.endswith('.json'):
+                try:
+                    with open(os.path.join(self.path, entry)) as f:
+                        data = json.load(f)
+                    yield data['key'], data['state']
+                except (FileNotFoundError, ValueError, KeyError):
+                    continue
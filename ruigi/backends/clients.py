@@ -0,0 +1,59 @@
+import os
+import threading
+
+
+class ClientMixin:
+    """ Per-process, lazily created SDK clients.
+
+    Storages are usually assigned as class attributes (`Task._storage`), so
+    the same instance is used by every luigi worker process. SDK clients hold
+    sockets and locks that must not be shared across a fork, so they are
+    created on first use and re-created whenever the process id changes.
+
+    Subclasses implement `_create_clients`, returning a dict of clients that
+    become available as attributes, e.g. `self.client` and `self.bucket`.
+    """
+    _client_names = ('client',)
+
+    def _create_clients(self):
+        raise NotImplementedError
+
+    def _clients(self):
+        state = self.__dict__.get('_client_state')
+        pid = os.getpid()
+        if state is None or state[0] != pid:
+            lock = self.__dict__.get('_client_lock')
+            if lock is None or lock[0] != pid:
+                lock = (pid, threading.Lock())
+                self._client_lock = lock
+            with lock[1]:
+                state = self.__dict__.get('_client_state')
+                if state is None or state[0] != pid:
+                    state = (pid, self._create_clients())
+                    self._client_state = state
+        return state[1]
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails, i.e. for the client names.
+        if name in type(self)._client_names:
+            return self._clients()[name]
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+
+    def reset_clients(self):
+        """ Drop the clients of this process. They are re-created on next use."""
+        self.__dict__.pop('_client_state', None)
+
+    def __getstate__(self):
+        # Clients, locks and thread pools are process-local and not picklable.
+        state = self.__dict__.copy()
+        for key in ('_client_state', '_client_lock', '_batch_pool', '_batch_pool_pid'):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+def default_max_connections(storage):
+    """ Connections needed to keep every batch and transfer thread busy."""
+    return max(storage.max_workers, storage.transfer_settings.max_concurrency)
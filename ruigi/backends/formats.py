@@ -0,0 +1,63 @@
+"""
+Serialization formats shared by storages that work on file objects.
+
+The bytes written for each format are the same the cloud storages upload, so
+objects can be copied between any two storages as plain files.
+"""
+import gzip
+import pickle
+import shutil
+import joblib
+import pandas as pd
+
+FORMATS = ('pickle', 'joblib', 'file', 'parquet', 'writer')
+
+
+def check_format(format):
+    if format not in FORMATS:
+        raise ValueError("Supported formats are pickle, joblib, file, parquet or writer")
+
+
+def serialize(obj, fileobj, format='pickle'):
+    """ Write `obj` to a binary file object.
+
+    Args:
+        obj: `obj`
+            It depends on the `format` parameter. For `file`, a local file
+            path. For `writer`, a function writing the object to the binary
+            file object it receives, e.g. in a custom file format; such
+            objects are loaded back with the `file` format.
+        fileobj: binary file object opened for writing.
+        format: `str`
+            One of pickle, joblib, file, parquet or writer.
+    """
+    check_format(format)
+    if format == 'parquet':
+        if not isinstance(obj, pd.DataFrame):
+            raise ValueError(f"Object to be saved as parquet must be a "
+                             f"DataFrame. Received a {type(obj)}")
+        obj.to_parquet(fileobj)
+    elif format == 'joblib':
+        joblib.dump(obj, fileobj)
+    elif format == 'pickle':
+        with gzip.GzipFile(fileobj=fileobj, mode='wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    elif format == 'file':
+        with open(obj, 'rb') as f:
+            shutil.copyfileobj(f, fileobj)
+    elif format == 'writer':
+        obj(fileobj)
+
+
+def deserialize(fileobj, format='pickle', columns=None):
+    """ Read an object from a seekable binary file object. `file` is not
+    handled here, since it must return a local path."""
+    check_format(format)
+    if format == 'joblib':
+        return joblib.load(fileobj)
+    elif format == 'parquet':
+        return pd.read_parquet(fileobj, columns=columns)
+    elif format == 'pickle':
+        with gzip.GzipFile(fileobj=fileobj, mode='rb') as f:
+            return pickle.load(f)
+    raise ValueError(f"Format {format} cannot be deserialized from a file object")
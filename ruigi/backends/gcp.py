@@ -1,26 +1,82 @@
 import os
+import base64
+import hashlib
 import pickle
 import gzip
 import pandas as pd
 import joblib
 from io import BytesIO
-import tempfile
-from retry import retry
 from google.resumable_media import DataCorruption
-from google.api_core.exceptions import GatewayTimeout, ServiceUnavailable
+from google.api_core.exceptions import (
+    GatewayTimeout, ServiceUnavailable, NotFound, RequestRangeNotSatisfiable,
+    InternalServerError, TooManyRequests, from_http_response)
 from google.oauth2 import service_account
 from google.cloud import storage
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .batch import BatchMixin
+from .checkpoints import UploadCheckpoints
+from .clients import ClientMixin, default_max_connections
+from .rangefile import RangeFile
+from .retries import RetryPolicy, retrying, unless_file
+from .staging import StagingMixin
+from .streaming import stream_upload
+from .transfer import TransferSettings, parallel_download
 
-_RETRY_LIST = (GatewayTimeout, DataCorruption, ServiceUnavailable)
-__TEMP_STORAGE__ = os.path.join(tempfile.gettempdir(), 'ruigi')
+try:
+    from google.cloud.storage import transfer_manager
+except ImportError:  # google-cloud-storage < 2.7
+    transfer_manager = None
 
-class GoogleStorage:
-    def __init__(self, service_account_path, project, bucket_name, parent_folder='', ):
-        os.makedirs(__TEMP_STORAGE__, exist_ok=True)
+_RETRY_LIST = (GatewayTimeout, DataCorruption, ServiceUnavailable, InternalServerError,
+               TooManyRequests, ConnectionError, TimeoutError)
+_CHUNK_ALIGN = 256 * 1024  # resumable upload chunks must be multiples of 256 KB
+
+class GoogleStorage(StagingMixin, ClientMixin, BatchMixin):
+    """ Storage backed by a Google Cloud Storage bucket.
+
+    The client is created lazily in each process, so the same storage can be
+    shared by luigi workers. See :py:class:`ruigi.backends.clients.ClientMixin`.
+
+    Args:
+        service_account_path: `str`
+            Path to a service account json file. If None, default credentials
+            are used (or none when `STORAGE_EMULATOR_HOST` is set).
+        project: `str`
+        bucket_name: `str`
+        parent_folder: `str` default `''`
+            Prefix of every object saved by this storage.
+        transfer_settings: :py:class:`ruigi.backends.transfer.TransferSettings` default `None`
+            Part size and concurrency of multipart uploads and downloads.
+        max_connections: `int` default `None`
+            Size of the HTTP connection pool of each process. By default, enough
+            for all batch and transfer threads.
+        retry_policy: :py:class:`ruigi.backends.retries.RetryPolicy` default `None`
+            Retries and hedging of requests. By default, connection errors,
+            throttling and 5xx responses are retried with jittered backoff.
+        staging: :py:class:`ruigi.backends.staging.StagingArea` default `None`
+            Where local files are staged. Defaults to the shared staging area.
+        resumable_uploads: `bool` default `True`
+            Upload local files of at least `multipart_threshold` bytes through
+            resumable sessions checkpointed in the staging area, so a failed or
+            interrupted upload continues from the bytes already sent. Chunks of
+            a session are sent one at a time; set it to False to use concurrent
+            chunk uploads instead.
+    """
+    _client_names = ('client', 'bucket')
+
+    def __init__(self, service_account_path, project, bucket_name, parent_folder='',
+                 transfer_settings=None, max_connections=None, retry_policy=None,
+                 staging=None, resumable_uploads=True):
+        self.staging = staging
+        self.resumable_uploads = resumable_uploads
 
         self.project = project
         self.bucket_name = bucket_name
         self.parent_folder = parent_folder
+        self.transfer_settings = transfer_settings or TransferSettings()
+        self.max_connections = max_connections or default_max_connections(self)
+        self.retry_policy = retry_policy or RetryPolicy(retry_on=_RETRY_LIST)
         self._init_gcp( project, service_account_path)
 
     def _init_gcp(self,  project, service_account_path):
@@ -30,11 +86,117 @@ class GoogleStorage:
         """
 
         #TODO: USe envs variables.
-        gcp_credentials = service_account.Credentials.from_service_account_file(service_account_path)
-        self.client = storage.Client(credentials=gcp_credentials, project=project)
-        self.bucket = self.client.bucket(self.bucket_name)
+        self.service_account_path = service_account_path
+
+    def _create_clients(self):
+        gcp_credentials = None
+        if self.service_account_path is not None:
+            gcp_credentials = service_account.Credentials.from_service_account_file(
+                self.service_account_path)
+        client = storage.Client(credentials=gcp_credentials, project=self.project)
+        # requests keeps connections alive; the default pool only keeps 10 per host.
+        adapter = HTTPAdapter(pool_connections=self.max_connections,
+                              pool_maxsize=self.max_connections)
+        client._http.mount('https://', adapter)
+        client._http.mount('http://', adapter)
+        return {'client': client, 'bucket': client.bucket(self.bucket_name)}
+
+    def _upload_filename(self, blob, local_file_name):
+        settings = self.transfer_settings
+        size = os.path.getsize(local_file_name)
+        if self.resumable_uploads and size >= settings.multipart_threshold:
+            self._upload_resumable(blob, local_file_name)
+        elif transfer_manager is not None and settings.is_multipart(size):
+            transfer_manager.upload_chunks_concurrently(
+                local_file_name, blob, chunk_size=settings.part_size,
+                max_workers=settings.max_concurrency,
+                worker_type=transfer_manager.THREAD)
+        else:
+            blob.upload_from_filename(filename=local_file_name)
+
+    def _upload_resumable(self, blob, local_file_name):
+        """ Upload a local file through a resumable session.
+
+        The session URL and the MD5 of every range the session confirmed are
+        checkpointed in the staging area, keyed by object name and size. When
+        a file of the same size is saved again to the same name, e.g. by a
+        retry or a rerun after a crash, from any local path, the session is
+        asked which bytes it holds. If they match the local file, the upload
+        continues from there; otherwise, or if the session expired after a
+        week, it starts over. The MD5 of the resulting object is checked
+        against the local file.
+        """
+        size = os.path.getsize(local_file_name)
+        chunk_size = max(self.transfer_settings.part_size // _CHUNK_ALIGN, 1) * _CHUNK_ALIGN
+        checkpoints = UploadCheckpoints(self.staging)
+        key = ['gcs', self.bucket_name, blob.name, size]
+        transport = self.client._http
+        state = checkpoints.load(key)
+
+        with open(local_file_name, 'rb') as f:
+            offset, resource = None, None
+            if state is not None:
+                offset, resource = self.retry_policy.call(
+                    _session_status, transport, state['url'], size)
+                if offset is not None and not _ranges_match(f, state['ranges'], offset):
+                    offset, resource = None, None
+            if offset is None:
+                state = {'url': blob.create_resumable_upload_session(size=size), 'ranges': []}
+                checkpoints.save(key, state)
+                offset = 0
+            elif offset:
+                metrics.increment(self, 'save', 'resumed_bytes', offset)
+
+            while offset < size:
+                f.seek(offset)
+                data = f.read(chunk_size)
+                try:
+                    confirmed, resource = self.retry_policy.call(
+                        _put_chunk, transport, state['url'], data, offset, size)
+                except NotFound:
+                    checkpoints.remove(key)  # expired session
+                    raise
+                if confirmed > offset:
+                    state['ranges'].append(
+                        [offset, confirmed, hashlib.md5(data[:confirmed - offset]).hexdigest()])
+                    checkpoints.save(key, state)
+                offset = confirmed
+        checkpoints.remove(key)
+
+        remote_md5 = (resource or {}).get('md5Hash')
+        if remote_md5 is not None and remote_md5 != _file_md5(local_file_name):
+            blob.delete()
+            raise IOError(f"Uploaded object {blob.name} does not match {local_file_name}")
 
+    def _download(self, blob, fileobj):
+        """ Download a blob into fileobj.
 
+        The first part is fetched with a single range request, which is the
+        whole object for anything smaller than the part size. Larger objects
+        are completed with concurrent range requests.
+        """
+        settings = self.transfer_settings
+        try:
+            first = blob.download_as_bytes(start=0, end=settings.part_size - 1)
+        except RequestRangeNotSatisfiable:
+            return  # empty object
+        except NotFound as e:
+            raise FileNotFoundError(f'Remote file {blob.name} not found') from e
+        fileobj.write(first)
+        if len(first) < settings.part_size:
+            return
+        blob.reload()
+        offset = len(first)
+        read_range = _blob_range_reader(blob)
+        parallel_download(lambda start, end: self.retry_policy.call(
+                              read_range, offset + start, offset + end),
+                          blob.size - offset, fileobj, settings)
+
+    def _download_to_filename(self, blob, local_file_name):
+        with open(local_file_name, 'wb') as f:
+            self._download(blob, f)
+
+    @retrying()
     def save(self, name, obj, format='pickle', chunk_size=None):
         """
         Args:
@@ -48,6 +210,7 @@ class GoogleStorage:
                     2. `joblib`: It uses `joblib.dump` to save a BytesIO binary file.
                     3. `file`: It saves a local file sending it directly to GCS.
                     4. `parquet`: It saves a parquet file using pandas.to_parquet.
+                    5. `writer`: It streams the bytes written by the function `obj`.
             chunk_size: `int` default `None`
                 The size of a chunk of data whenever iterating (in bytes).
                 This must be a multiple of 256 KB per the API specification.
@@ -55,30 +218,35 @@ class GoogleStorage:
 
         remote_file_name = os.path.join(self.parent_folder, name)
         blob = self.bucket.blob(remote_file_name, chunk_size=chunk_size)
-        local_file_name = os.path.join(__TEMP_STORAGE__, remote_file_name.replace("/", "-"))
-
-        if format=='parquet':
-            if not isinstance(obj, pd.DataFrame):
-                raise ValueError(f"Object to be saved as parquet must be a "
-                                 f"DataFrame. Received a {type(obj)}")
-            obj.to_parquet(local_file_name)
-        elif format == 'joblib':
-            with BytesIO() as buffer:
-                joblib.dump(obj, buffer)
-                buffer.seek(0)
-                blob.upload_from_file(buffer)
-            return
-        elif format == 'pickle':
-            with gzip.open(local_file_name, 'wb') as f:
-                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
-        elif format == 'file':
-            local_file_name = obj
+
+        if format == 'file':
+            self._upload_filename(blob, obj)
+        elif format in ('parquet', 'joblib', 'pickle', 'writer'):
+            # The serializer streams into a resumable upload, so memory is
+            # bounded by a few chunks and nothing is staged on disk.
+            metrics.add_bytes(self, 'save', format, stream_upload(
+                obj, format, lambda stream: self._upload_stream(blob, stream)))
         else:
-            raise ValueError("Supported formats are pickle, joblib, file or parquet")
+            raise ValueError("Supported formats are pickle, joblib, file, parquet or writer")
 
-        blob.upload_from_filename(filename=local_file_name)
+    def _upload_stream(self, blob, stream):
+        """ Upload a non-seekable stream of unknown size.
+
+        Objects that fit in one chunk are sent in a single multipart request.
+        Larger ones use a resumable upload of `chunk_size` bytes per request.
+        """
+        if blob.chunk_size is None:
+            blob.chunk_size = max(self.transfer_settings.part_size // _CHUNK_ALIGN, 1) * _CHUNK_ALIGN
+        head = stream.read(blob.chunk_size)
+        if len(head) < blob.chunk_size:
+            blob.upload_from_file(BytesIO(head), size=len(head))
+        else:
+            stream.unread(head)
+            del head
+            blob.upload_from_file(stream)
+        return stream.tell()
 
-    @retry(_RETRY_LIST, tries=5)
+    @retrying(hedge=unless_file)
     def load(self, name, format='pickle', columns=None, chunk_size=None):
         """
         Args:
@@ -91,7 +259,8 @@ class GoogleStorage:
                     3. `file`: It saves a local file sending it directly to GCS.
                     4. `parquet`: It saves a parquet file using pandas.read_parquet.
             columns: `list` default `None`
-                Columns to fetch when using `parquet=True`
+                Columns to fetch when using `parquet=True`. Only those
+                columns are downloaded, using range requests.
             chunk_size: `int` default `None`
                 The size of a chunk of data whenever iterating (in bytes).
                 This must be a multiple of 256 KB per the API specification.
@@ -99,46 +268,126 @@ class GoogleStorage:
 
         remote_file_name = os.path.join(self.parent_folder, name)
         blob = self.bucket.blob(remote_file_name, chunk_size=chunk_size)
-        local_file_name = os.path.join(__TEMP_STORAGE__, remote_file_name.replace("/", "-"))
-
-        if not blob.exists():
-            raise FileNotFoundError(f'Remote file {remote_file_name} not found')
-
-        blob.reload()
-        remote_ts = blob.updated.timestamp()
 
         if format == 'file':
-            blob.download_to_filename(local_file_name)
+            with self.staging.writing(remote_file_name) as local_file_name:
+                self._download_to_filename(blob, local_file_name)
             return local_file_name
+        elif format not in ('joblib', 'parquet', 'pickle'):
+            raise ValueError("Supported formats are pickle, joblib, file or parquet")
+        elif format == 'parquet' and columns is not None:
+            # Only the footer and the chunks of the requested columns are fetched.
+            return pd.read_parquet(RangeFile(self, name), columns=columns)
+
+        buffer = BytesIO()
+        self._download(blob, buffer)
+        metrics.add_bytes(self, 'load', format, buffer.tell())
+        buffer.seek(0)
 
-        else:
-            buffer = BytesIO()
-            blob.download_to_file(buffer)
-        
         if format == 'joblib':
             return joblib.load(buffer)
         elif format == 'parquet':
             return pd.read_parquet(buffer, columns=columns)
         elif format == 'pickle':
-            blob.download_to_filename(local_file_name)
-            with gzip.open(local_file_name, 'rb') as f:
+            with gzip.GzipFile(fileobj=buffer, mode='rb') as f:
                 return pickle.load(f)
-        else:
-            raise ValueError("Supported formats are pickle, joblib, file or parquet")
 
+    @retrying(hedge=True)
+    def size(self, name):
+        """ Returns the size in bytes of a remote file."""
+        remote_file_name = os.path.join(self.parent_folder, name)
+        blob = self.bucket.get_blob(remote_file_name)
+        if blob is None:
+            raise FileNotFoundError(f'Remote file {remote_file_name} not found')
+        return blob.size
+
+    @retrying(hedge=True)
+    def read_range(self, name, start, end):
+        """ Returns the bytes [start, end) of a remote file using a single range request."""
+        remote_file_name = os.path.join(self.parent_folder, name)
+        blob = self.bucket.blob(remote_file_name)
+        # GCS end is inclusive.
+        return blob.download_as_bytes(start=start, end=end - 1)
+
+    def list(self, prefix=''):
+        """ Yields the names of all remote files starting with `prefix`.
+        Results are fetched page by page."""
+        remote_prefix = os.path.join(self.parent_folder, prefix)
+        strip = len(os.path.join(self.parent_folder, ''))
+        for blob in self.client.list_blobs(self.bucket, prefix=remote_prefix):
+            yield blob.name[strip:]
 
+    @retrying(hedge=True)
     def exists(self, name):
 
         remote_file_name = os.path.join(self.parent_folder, name)
         blob = self.bucket.blob(remote_file_name)
         return blob.exists()
 
+    @retrying()
     def delete(self, name):
         remote_file_name = os.path.join(self.parent_folder, name)
         blob = self.bucket.blob(remote_file_name)
         if blob.exists():
             blob.delete()
 
-        local_file_name = os.path.join(__TEMP_STORAGE__, remote_file_name.replace("/", "-"))
-        if os.path.isfile(local_file_name):
-            os.remove(local_file_name)
\ No newline at end of file
+
+def _blob_range_reader(blob):
+    # GCS end is inclusive.
+    return lambda start, end: blob.download_as_bytes(start=start, end=end - 1)
+
+
+def _confirmed_bytes(response):
+    # A 308 response reports the bytes persisted so far as `Range: bytes=0-N`.
+    persisted = response.headers.get('Range')
+    return int(persisted.rsplit('-', 1)[1]) + 1 if persisted else 0
+
+
+def _session_status(transport, url, size):
+    """ Returns (bytes persisted, object resource if complete) of a resumable
+    session, or (None, None) if it expired."""
+    response = transport.put(url, headers={'Content-Range': f'bytes */{size}'})
+    if response.status_code in (200, 201):
+        return size, response.json()
+    if response.status_code == 308:
+        return _confirmed_bytes(response), None
+    if response.status_code in (404, 410):
+        return None, None
+    raise from_http_response(response)
+
+
+def _put_chunk(transport, url, data, offset, size):
+    """ Sends `data` at `offset` of a resumable session. Returns the bytes
+    persisted and the object resource once complete."""
+    end = offset + len(data) - 1
+    response = transport.put(url, data=data,
+                             headers={'Content-Range': f'bytes {offset}-{end}/{size}'})
+    if response.status_code in (200, 201):
+        return size, response.json()
+    if response.status_code == 308:
+        return _confirmed_bytes(response), None
+    if response.status_code == 410:
+        raise NotFound(f"Resumable session expired ({response.status_code})")
+    raise from_http_response(response)
+
+
+def _ranges_match(f, ranges, offset):
+    """ Returns True if `ranges`, a list of [start, end, MD5 hex digest],
+    cover the bytes [0, offset) and match the content of the file `f`."""
+    position = 0
+    for start, end, md5 in ranges:
+        if start != position or end > offset:
+            return False
+        f.seek(start)
+        if hashlib.md5(f.read(end - start)).hexdigest() != md5:
+            return False
+        position = end
+    return position == offset
+
+
+def _file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2 ** 20), b''):
+            md5.update(chunk)
+    return base64.b64encode(md5.digest()).decode()
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from . import metrics
+from .batch import BatchMixin
+from .formats import serialize, deserialize, check_format
+from .retries import retrying, unless_file
+from .staging import StagingMixin
+
+_TMP_DIR = '.ruigi-tmp'
+
+
+class LocalStorage(StagingMixin, BatchMixin):
+    """ Storage backed by a directory on the local disk.
+
+    It implements the same interface as the cloud storages, so tasks can run
+    against it without network, e.g. `Task._storage = LocalStorage('/data')`.
+    Files are first written to a temporary file in the same file system and
+    then renamed, so readers never see partially written objects.
+
+    Args:
+        root: `str`
+            Directory where objects are kept. It is created if needed.
+        parent_folder: `str` default `''`
+            Prefix of every object saved by this storage.
+        retry_policy: :py:class:`ruigi.backends.retries.RetryPolicy` default `None`
+            Retries and hedging of requests. Nothing is retried by default.
+        staging: :py:class:`ruigi.backends.staging.StagingArea` default `None`
+            Where local files are staged. Defaults to the shared staging area.
+    """
+
+    def __init__(self, root, parent_folder='', retry_policy=None, staging=None):
+        self.staging = staging
+        self.root = os.path.abspath(root)
+        self.parent_folder = parent_folder
+        self.retry_policy = retry_policy
+        os.makedirs(os.path.join(self.root, _TMP_DIR), exist_ok=True)
+
+    def _base(self):
+        return os.path.normpath(os.path.join(self.root, self.parent_folder))
+
+    def _path(self, name):
+        """ Returns the path of object `name`. Names are relative to the
+        storage: leading separators are ignored, so absolute names, e.g. under
+        an absolute TARGET_DIR, stay under root too. Names escaping the
+        storage with `..` raise ValueError."""
+        base = self._base()
+        path = os.path.normpath(os.path.join(base, name.lstrip('/' + os.sep)))
+        if path == base or os.path.commonpath([base, path]) != base:
+            raise ValueError(f"{name} is not a valid object name in {base}")
+        return path
+
+    @contextmanager
+    def linked(self, name):
+        """ Yields the path of a file holding object `name`, without copying it.
+        Saves replace objects with a new file, so the hard link keeps this
+        version intact while it is read. It is copied where hard links are
+        not supported."""
+        path = self._path(name)
+        fd, link_path = tempfile.mkstemp(dir=os.path.join(self.root, _TMP_DIR))
+        os.close(fd)
+        os.remove(link_path)
+        try:
+            try:
+                os.link(path, link_path)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(path, link_path)
+            yield link_path
+        finally:
+            if os.path.exists(link_path):
+                os.remove(link_path)
+
+    @retrying()
+    def save(self, name, obj, format='pickle', chunk_size=None):
+        """
+        Args:
+            name: `str`.
+                Filename to be used when saving the `obj`
+            obj: `obj`
+                It depends on the `format` parameter.
+            format: `str`
+                Possible values:
+                    1. `pickle`: It uses `pickle.dump` to save a gzip binary file.
+                    2. `joblib`: It uses `joblib.dump` to save a binary file.
+                    3. `file`: It copies a local file.
+                    4. `parquet`: It saves a parquet file using pandas.to_parquet.
+                    5. `writer`: It streams the bytes written by the function `obj`.
+            chunk_size: `int` default `None`
+                Not used. Kept for compatibility with other storages.
+        """
+        check_format(format)
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.join(self.root, _TMP_DIR))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                serialize(obj, f, format=format)
+                nbytes = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        if format != 'file':
+            metrics.add_bytes(self, 'save', format, nbytes)
+
+    @retrying(hedge=unless_file)
+    def load(self, name, format='pickle', columns=None, chunk_size=None):
+        """
+        Args:
+            name: `str`.
+                Filename to be load
+            format: `str`
+                Possible values:
+                    1. `pickle`: It uses `pickle.load` to load a gzip binary file.
+                    2. `joblib`: It uses `joblib.load` to load a binary file.
+                    3. `file`: It copies the file to a local temporary path and returns it.
+                    4. `parquet`: It loads a parquet file using pandas.read_parquet.
+            columns: `list` default `None`
+                Columns to fetch when using `parquet=True`
+            chunk_size: `int` default `None`
+                Not used. Kept for compatibility with other storages.
+        """
+        check_format(format)
+        path = self._path(name)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f'File {path} not found')
+        if format == 'file':
+            remote_file_name = os.path.join(self.parent_folder, name)
+            with self.staging.writing(remote_file_name) as local_file_name:
+                shutil.copyfile(path, local_file_name)
+            return local_file_name
+        metrics.add_bytes(self, 'load', format, os.path.getsize(path))
+        with open(path, 'rb') as f:
+            return deserialize(f, format=format, columns=columns)
+
+    @retrying(hedge=True)
+    def size(self, name):
+        """ Returns the size in bytes of a file."""
+        return os.path.getsize(self._path(name))
+
+    @retrying(hedge=True)
+    def read_range(self, name, start, end):
+        """ Returns the bytes [start, end) of a file."""
+        with open(self._path(name), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def list(self, prefix=''):
+        """ Yields the names of all files starting with `prefix`."""
+        base = self._base()
+        # names are listed as given: absolute if the prefix is absolute
+        root_name = os.sep if prefix.startswith(os.sep) else ''
+        relative_prefix = prefix.lstrip('/' + os.sep)
+        remote_prefix = os.path.normpath(relative_prefix) if relative_prefix else ''
+        folder = os.path.join(base, os.path.dirname(remote_prefix)) \
+            if not prefix.endswith('/') else os.path.join(base, remote_prefix)
+        folder = os.path.normpath(folder)
+        if os.path.commonpath([base, folder]) != base:
+            raise ValueError(f"{prefix} is not a valid prefix in {base}")
+        for dirpath, dirnames, filenames in os.walk(folder):
+            if dirpath == self.root and _TMP_DIR in dirnames:
+                dirnames.remove(_TMP_DIR)
+            for filename in filenames:
+                if filename.startswith('.ruigi-'):
+                    continue  # e.g. the replication queue of TieredStorage
+                name = os.path.relpath(os.path.join(dirpath, filename), base)
+                if name.startswith(remote_prefix):
+                    yield root_name + name
+
+    @retrying(hedge=True)
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    @retrying()
+    def delete(self, name):
+        path = self._path(name)
+        if os.path.isfile(path):
+            os.remove(path)
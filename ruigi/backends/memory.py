@@ -0,0 +1,102 @@
+import os
+import threading
+from io import BytesIO
+from .batch import BatchMixin
+from .formats import serialize, deserialize, check_format
+from . import metrics
+from .retries import retrying, unless_file
+from .staging import StagingMixin
+
+
+
+class MemoryStorage(StagingMixin, BatchMixin):
+    """ Storage keeping serialized objects as bytes in a dict.
+
+    It implements the same interface as the cloud storages and is safe to use
+    from many threads. Objects are serialized exactly as in other storages,
+    which makes it useful to test pipelines and to measure ruigi's own
+    overhead without network. Data is not shared between processes, so use it
+    with a single luigi worker.
+
+    Args:
+        parent_folder: `str` default `''`
+            Prefix of every object saved by this storage.
+        retry_policy: :py:class:`ruigi.backends.retries.RetryPolicy` default `None`
+            Retries and hedging of requests. Nothing is retried by default.
+        staging: :py:class:`ruigi.backends.staging.StagingArea` default `None`
+            Where local files are staged. Defaults to the shared staging area.
+    """
+
+    def __init__(self, parent_folder='', retry_policy=None, staging=None):
+        self.staging = staging
+        self.parent_folder = parent_folder
+        self.retry_policy = retry_policy
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def _key(self, name):
+        return os.path.join(self.parent_folder, name)
+
+    def _get(self, name):
+        with self._lock:
+            try:
+                return self._objects[self._key(name)]
+            except KeyError:
+                raise FileNotFoundError(f'Object {self._key(name)} not found') from None
+
+    def _put(self, name, data):
+        with self._lock:
+            self._objects[self._key(name)] = data
+
+    @retrying()
+    def save(self, name, obj, format='pickle', chunk_size=None):
+        """ Serialize `obj` as in the other storages. See `S3Storage.save`."""
+        check_format(format)
+        with BytesIO() as buffer:
+            serialize(obj, buffer, format=format)
+            data = buffer.getvalue()
+        self._put(name, data)
+        if format != 'file':
+            metrics.add_bytes(self, 'save', format, len(data))
+
+    @retrying(hedge=unless_file)
+    def load(self, name, format='pickle', columns=None, chunk_size=None):
+        """ Deserialize an object as in the other storages. See `S3Storage.load`."""
+        check_format(format)
+        data = self._get(name)
+        if format == 'file':
+            with self.staging.writing(self._key(name)) as local_file_name:
+                with open(local_file_name, 'wb') as f:
+                    f.write(data)
+            return local_file_name
+        metrics.add_bytes(self, 'load', format, len(data))
+        return deserialize(BytesIO(data), format=format, columns=columns)
+
+    @retrying(hedge=True)
+    def size(self, name):
+        """ Returns the size in bytes of an object."""
+        return len(self._get(name))
+
+    @retrying(hedge=True)
+    def read_range(self, name, start, end):
+        """ Returns the bytes [start, end) of an object."""
+        return self._get(name)[start:end]
+
+    def list(self, prefix=''):
+        """ Yields the names of all objects starting with `prefix`."""
+        remote_prefix = self._key(prefix)
+        strip = len(os.path.join(self.parent_folder, ''))
+        with self._lock:
+            keys = [k for k in self._objects if k.startswith(remote_prefix)]
+        for key in keys:
+            yield key[strip:]
+
+    @retrying(hedge=True)
+    def exists(self, name):
+        with self._lock:
+            return self._key(name) in self._objects
+
+    @retrying()
+    def delete(self, name):
+        with self._lock:
+            self._objects.pop(self._key(name), None)
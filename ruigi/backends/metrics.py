@@ -0,0 +1,330 @@
+"""
+Storage I/O metrics.
+
+Every storage operation decorated with :py:func:`ruigi.backends.retries.retrying`
+is timed and counted here, labelled by storage class, operation and format:
+number of calls, errors, bytes transferred and a latency histogram. Retries,
+hedged requests, range-read cache hits and skipped uploads are counted as
+events.
+
+Metrics are kept per process in :py:func:`default_registry`. They can be
+queried with :py:meth:`MetricsRegistry.totals`, dumped as JSON, e.g. by
+`Pipe.run(metrics_path=...)`, or exposed in the Prometheus text format.
+Worker processes can write theirs to a directory with :py:func:`spool_to`,
+to be merged into the parent's registry with :py:func:`collect`.
+"""
+import os
+import json
+import time
+import functools
+import threading
+import multiprocessing.util
+from collections import defaultdict
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60.)
+
+
+class _Operation:
+    __slots__ = ('count', 'errors', 'seconds', 'bytes', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.
+        self.bytes = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+
+class MetricsRegistry:
+    """ Thread-safe store of storage metrics.
+
+    Args:
+        buckets: `tuple` default :py:data:`LATENCY_BUCKETS`
+            Upper bounds, in seconds, of the latency histogram buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._operations = defaultdict(_Operation)
+        self._events = defaultdict(int)
+
+    def observe(self, storage, operation, format, seconds, error=False):
+        """ Record one call of `operation` that took `seconds`."""
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound),
+                     len(self.buckets))
+        with self._lock:
+            op = self._operations[(storage, operation, format)]
+            op.count += 1
+            op.errors += bool(error)
+            op.seconds += seconds
+            op.buckets[index] += 1
+
+    def add_bytes(self, storage, operation, format, nbytes):
+        """ Record `nbytes` transferred by `operation`."""
+        with self._lock:
+            self._operations[(storage, operation, format)].bytes += nbytes
+
+    def increment(self, storage, operation, event, n=1):
+        """ Count an event, e.g. `retries` or `cache_hits`, of `operation`."""
+        with self._lock:
+            self._events[(storage, operation, event)] += n
+
+    def merge(self, snapshot):
+        """ Add the metrics of a :py:meth:`snapshot`, e.g. of another process."""
+        with self._lock:
+            for item in snapshot['operations']:
+                buckets = _differences(list(item['latency_buckets'].values()))
+                if len(buckets) != len(self.buckets) + 1:
+                    raise ValueError("Cannot merge metrics with different latency buckets")
+                op = self._operations[(item['storage'], item['operation'], item['format'])]
+                op.count += item['count']
+                op.errors += item['errors']
+                op.seconds += item['seconds']
+                op.bytes += item['bytes']
+                op.buckets = [a + b for a, b in zip(op.buckets, buckets)]
+            for item in snapshot['events']:
+                self._events[(item['storage'], item['operation'], item['event'])] += item['count']
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+            self._events.clear()
+
+    def totals(self, storage=None, operation=None, format=None, event=None):
+        """ Returns a dict with count, errors, seconds, bytes and events,
+        summed over the metrics matching the given labels."""
+        result = dict(count=0, errors=0, seconds=0., bytes=0, events=0)
+        with self._lock:
+            for (s, o, f), op in self._operations.items():
+                if _matches((s, o, f), (storage, operation, format)):
+                    result['count'] += op.count
+                    result['errors'] += op.errors
+                    result['seconds'] += op.seconds
+                    result['bytes'] += op.bytes
+            for (s, o, e), n in self._events.items():
+                if _matches((s, o), (storage, operation)) and (event is None or e == event):
+                    result['events'] += n
+        return result
+
+    def snapshot(self):
+        """ Returns all metrics as a JSON serializable dict."""
+        with self._lock:
+            operations = [
+                dict(storage=s, operation=o, format=f, count=op.count, errors=op.errors,
+                     seconds=op.seconds, bytes=op.bytes,
+                     latency_buckets=dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+                                              _cumulative(op.buckets))))
+                for (s, o, f), op in sorted(self._operations.items())]
+            events = [dict(storage=s, operation=o, event=e, count=n)
+                      for (s, o, e), n in sorted(self._events.items())]
+        return dict(pid=os.getpid(), time=time.time(), operations=operations, events=events)
+
+    def to_json(self, path=None):
+        """ Returns the snapshot as JSON, writing it to `path` if given."""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            _write(path, text)
+        return text
+
+    def to_prometheus(self, path=None):
+        """ Returns the metrics in the Prometheus text exposition format,
+        writing them to `path` if given, e.g. for the node exporter textfile
+        collector."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, key, kind, help in (
+                ('ruigi_storage_operations_total', 'count', 'counter', 'Storage operations.'),
+                ('ruigi_storage_errors_total', 'errors', 'counter', 'Failed storage operations.'),
+                ('ruigi_storage_bytes_total', 'bytes', 'counter', 'Bytes transferred.')):
+            lines += [f'# HELP {name} {help}', f'# TYPE {name} {kind}']
+            lines += [f'{name}{{{_labels(op)}}} {op[key]}' for op in snapshot['operations']]
+
+        name = 'ruigi_storage_latency_seconds'
+        lines += [f'# HELP {name} Latency of storage operations, retries included.',
+                  f'# TYPE {name} histogram']
+        for op in snapshot['operations']:
+            labels = _labels(op)
+            for bound, n in op['latency_buckets'].items():
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {n}')
+            lines.append(f'{name}_sum{{{labels}}} {op["seconds"]}')
+            lines.append(f'{name}_count{{{labels}}} {op["count"]}')
+
+        name = 'ruigi_storage_events_total'
+        lines += [f'# HELP {name} Retries, hedged requests, cache hits and skipped uploads.',
+                  f'# TYPE {name} counter']
+        lines += [f'{name}{{{_labels(ev, ("storage", "operation", "event"))}}} {ev["count"]}'
+                  for ev in snapshot['events']]
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            _write(path, text)
+        return text
+
+
+def _matches(values, filters):
+    return all(f is None or v == f for v, f in zip(values, filters))
+
+
+def _cumulative(counts):
+    total, result = 0, []
+    for n in counts:
+        total += n
+        result.append(total)
+    return result
+
+
+def _differences(cumulative):
+    return [n - previous for previous, n in zip([0] + cumulative, cumulative)]
+
+
+def _labels(item, names=('storage', 'operation', 'format')):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(item[name])}"' for name in names)
+
+
+def _write(path, text):
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+_default = MetricsRegistry()
+_current = threading.local()
+
+
+def default_registry():
+    """ Returns the registry storages of this process record into."""
+    return _default
+
+
+def set_default_registry(registry):
+    """ Replace the registry storages record into."""
+    global _default
+    _default = registry
+
+
+class _Spool:
+    """ Directory worker processes write their metrics to, see :py:func:`spool_to`."""
+
+    def __init__(self):
+        self.directory = None
+
+    def after_fork(self):
+        if self.directory is None:
+            return
+        # The parent reports its own metrics, so the worker starts afresh.
+        set_default_registry(MetricsRegistry(_default.buckets))
+        multiprocessing.util.Finalize(self, self.write, exitpriority=100)
+
+    def write(self):
+        _default.to_json(os.path.join(self.directory, f'{os.getpid()}.json'))
+
+
+_spool = _Spool()
+multiprocessing.util.register_after_fork(_spool, _Spool.after_fork)
+
+
+def spool_to(directory):
+    """ Have worker processes forked from this one with :py:mod:`multiprocessing`,
+    e.g. by luigi when `workers > 1`, write their metrics to `directory` when
+    they exit, one JSON file per process. Merge them with :py:func:`collect`.
+
+    Args:
+        directory: `str`
+            Existing directory, or `None` to stop spooling.
+    """
+    _spool.directory = directory
+
+
+def collect(directory, registry=None):
+    """ Merge the metrics spooled to `directory` into `registry`, by default
+    the :py:func:`default_registry`, and remove their files."""
+    registry = registry if registry is not None else _default
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        with open(path) as f:
+            registry.merge(json.load(f))
+        os.remove(path)
+    return registry
+
+
+def storage_label(storage):
+    return type(storage).__name__
+
+
+@contextmanager
+def measure(storage, operation, format=''):
+    """ Time the block as one call of `operation`. Events recorded with
+    :py:func:`record_event` inside the block, in the same thread, are
+    attributed to it."""
+    label = (storage_label(storage), operation)
+    stack = _current.__dict__.setdefault('stack', [])
+    stack.append(label)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        stack.pop()
+        _default.observe(label[0], operation, format, time.perf_counter() - start, error)
+
+
+def current_operation():
+    """ Returns the (storage, operation) labels measured in this thread, or None."""
+    stack = getattr(_current, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def bind(function, operation=None):
+    """ Returns `function` attributing the events it records to `operation`,
+    by default the one measured in the calling thread. Work handed to other
+    threads, e.g. the parts of a transfer, is bound so that its retries are
+    counted against the operation that started it.
+
+    Args:
+        function: `function`
+        operation: `tuple` default `None`
+            (storage, operation) labels, as returned by :py:func:`current_operation`.
+    """
+    operation = operation or current_operation()
+    if operation is None:
+        return function
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        stack = _current.__dict__.setdefault('stack', [])
+        stack.append(operation)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            stack.pop()
+    return bound
+
+
+def record_event(event, n=1):
+    """ Count `event` for the operation measured in this thread, if any. Use
+    :py:func:`bind` for work run in other threads."""
+    operation = current_operation()
+    if operation is not None:
+        _default.increment(*operation, event, n)
+
+
+def add_bytes(storage, operation, format, nbytes):
+    """ Record bytes transferred by an operation of `storage`."""
+    _default.add_bytes(storage_label(storage), operation, format, nbytes)
+
+
+def increment(storage, operation, event, n=1):
+    """ Count an event of an operation of `storage`."""
+    _default.increment(storage_label(storage), operation, event, n)
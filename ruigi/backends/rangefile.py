@@ -0,0 +1,153 @@
+import io
+import threading
+from collections import OrderedDict
+from . import metrics
+
+KB = 2 ** 10
+MB = 2 ** 20
+
+
+class RangeFile(io.RawIOBase):
+    """ Read-only, seekable file object over a remote object.
+
+    Every read is served with a byte-range request through
+    `storage.read_range`, so libraries that seek, like pyarrow, only transfer
+    the parts of the object they need. Ranges known in advance can be fetched
+    with :py:meth:`prefetch`.
+
+    Small reads are extended to `read_ahead` bytes and kept in a LRU cache of
+    up to `cache_size` bytes, so the many small sequential reads of a parquet
+    footer or page headers cost a single request. Prefetched ranges are kept
+    apart, whatever their size, until :py:meth:`release` is called.
+
+    Args:
+        storage: `obj`
+            A storage implementing `read_range(name, start, end)` and `size(name)`.
+        name: `str`
+            Object name, as given to `storage.load`.
+        size: `int` default `None`
+            Object size in bytes. Fetched from storage if not given.
+        read_ahead: `int` default 64 KB
+            Minimum number of bytes fetched by each range request.
+        cache_size: `int` default 64 MB
+            Maximum number of bytes kept in memory.
+    """
+
+    def __init__(self, storage, name, size=None, read_ahead=64 * KB, cache_size=64 * MB):
+        super().__init__()
+        self.storage = storage
+        self.name = name
+        self._size = storage.size(name) if size is None else size
+        self._pos = 0
+        self.read_ahead = read_ahead
+        self.cache_size = cache_size
+        self._spans = OrderedDict()  # start -> bytes already fetched, in LRU order
+        self._cached_bytes = 0
+        self._prefetched = {}  # start -> bytes, not subject to cache_size
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = pos
+        return self._pos
+
+    def size(self):
+        return self._size
+
+    def prefetch(self, ranges):
+        """ Fetch the given list of (start, end) byte ranges into memory, with
+        one request each. They are kept until :py:meth:`release`."""
+        for start, end in ranges:
+            end = min(end, self._size)
+            if start < end and self._cached(start, end) is None:
+                data = self._request(start, end)
+                with self._lock:
+                    self._prefetched[start] = data
+
+    def release(self):
+        """ Drop the prefetched ranges."""
+        with self._lock:
+            self._prefetched.clear()
+
+    def _request(self, start, end):
+        data = self.storage.read_range(self.name, start, end)
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += len(data)
+        return data
+
+    def _cached(self, start, end):
+        with self._lock:
+            for span_start, data in self._prefetched.items():
+                if span_start <= start and end <= span_start + len(data):
+                    return data[start - span_start:end - span_start]
+            for span_start, data in self._spans.items():
+                if span_start <= start and end <= span_start + len(data):
+                    self._spans.move_to_end(span_start)
+                    return data[start - span_start:end - span_start]
+        return None
+
+    def _store(self, start, data):
+        if len(data) > self.cache_size:
+            return
+        with self._lock:
+            old = self._spans.pop(start, None)
+            if old is not None:
+                self._cached_bytes -= len(old)
+            self._spans[start] = data
+            self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_size:
+                _, evicted = self._spans.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def _fetch(self, start, end):
+        data = self._cached(start, end)
+        if data is not None:
+            metrics.increment(self.storage, 'read_range', 'cache_hits')
+            return data
+        if end - start >= self.read_ahead:
+            # Large reads, e.g. whole column chunks, are not worth caching.
+            return self._request(start, end)
+        fetch_end = min(start + self.read_ahead, self._size)
+        # Near the end of the file, read ahead backwards instead, which
+        # covers the parquet footer and metadata length in one request.
+        fetch_start = max(min(start, fetch_end - self.read_ahead), 0)
+        data = self._request(fetch_start, fetch_end)
+        self._store(fetch_start, data)
+        return data[start - fetch_start:end - fetch_start]
+
+    def read(self, size=-1):
+        if self._pos >= self._size:
+            return b''
+        end = self._size if size is None or size < 0 else min(self._pos + size, self._size)
+        data = self._fetch(self._pos, end)
+        self._pos += len(data)
+        return data
+
+    def readall(self):
+        return self.read(-1)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
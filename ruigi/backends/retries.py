@@ -0,0 +1,227 @@
+import os
+import time
+import random
+import logging
+import inspect
+import functools
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """ Retries with exponential backoff and jitter, and optional hedging.
+
+    Failed calls raising a retryable error are retried up to `tries` times,
+    sleeping a random time between 0 and `base_delay * 2 ** attempt` seconds
+    (full jitter), capped at `max_delay`. Missing objects
+    (`FileNotFoundError`) are never retried. Calls are retried at one level
+    only: an error that exhausted the retries of a nested call, e.g. of one
+    part of a multipart transfer, is not retried again by the enclosing
+    storage operation, so a request is attempted `tries` times at most.
+
+    Reads can also be hedged: if a call has not finished after `hedge_after`
+    seconds, or after the `hedge_percentile` of the latencies seen so far for
+    the same operation, a duplicate call is started and the first one to
+    succeed wins. This cuts tail latency caused by slow requests, at the cost
+    of some duplicate requests. Only idempotent calls are hedged.
+
+    Args:
+        retry_on: `tuple` default `(ConnectionError, TimeoutError)`
+            Exception types to retry. A function taking the exception and
+            returning a `bool` is also accepted.
+        tries: `int` default 5
+            Maximum number of attempts, including the first one.
+        base_delay: `float` default 0.1
+            Backoff of the first retry, in seconds.
+        max_delay: `float` default 10
+            Maximum backoff, in seconds.
+        hedge_after: `float` default `None`
+            Start a duplicate read after this many seconds.
+        hedge_percentile: `float` default `None`
+            Start a duplicate read when it takes longer than this percentile,
+            e.g. 95, of the latencies observed for the same operation.
+        min_samples: `int` default 20
+            Latencies needed before `hedge_percentile` is used.
+    """
+
+    def __init__(self, retry_on=(ConnectionError, TimeoutError), tries=5, base_delay=0.1,
+                 max_delay=10., hedge_after=None, hedge_percentile=None, min_samples=20):
+        if tries < 1:
+            raise ValueError("tries must be at least 1")
+        self.retry_on = retry_on
+        self.tries = tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=1000))
+        self.hedges = 0
+
+    @property
+    def hedging(self):
+        return self.hedge_after is not None or self.hedge_percentile is not None
+
+    def is_retryable(self, error):
+        if isinstance(error, FileNotFoundError) or getattr(error, _EXHAUSTED, False):
+            return False
+        if callable(self.retry_on) and not isinstance(self.retry_on, type):
+            return bool(self.retry_on(error))
+        return isinstance(error, self.retry_on)
+
+    def backoff(self, attempt):
+        """ Seconds to sleep before retry number `attempt` (starting at 0)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, function, *args, **kwargs):
+        """ Call `function` retrying retryable errors."""
+        for attempt in range(self.tries):
+            try:
+                return function(*args, **kwargs)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    raise
+                if attempt + 1 >= self.tries:
+                    _mark_exhausted(e)
+                    raise
+                delay = self.backoff(attempt)
+                metrics.record_event('retries')
+                logger.debug(f"Retrying {getattr(function, '__name__', function)} "
+                             f"in {delay:.2f}s after {e!r}")
+                time.sleep(delay)
+
+    def hedge_threshold(self, operation):
+        """ Seconds after which a call of `operation` is hedged, or None."""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        samples = self._latencies[operation]
+        if self.hedge_percentile is None or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(int(len(ordered) * self.hedge_percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def call_hedged(self, operation, function, *args, **kwargs):
+        """ Same as :py:meth:`call`, hedging each attempt."""
+        return self.call(self._hedged, operation, function, *args, **kwargs)
+
+    def _hedged(self, operation, function, *args, **kwargs):
+        threshold = self.hedge_threshold(operation)
+        start = time.perf_counter()
+        if threshold is None:
+            result = function(*args, **kwargs)
+            self._latencies[operation].append(time.perf_counter() - start)
+            return result
+
+        primary = _spawn(function, *args, **kwargs)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            result = primary.result()
+            self._latencies[operation].append(time.perf_counter() - start)
+            return result
+
+        self.hedges += 1
+        metrics.record_event('hedges')
+        pending = {primary, _spawn(function, *args, **kwargs)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # The slower call keeps running; its result is discarded.
+                    self._latencies[operation].append(time.perf_counter() - start)
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_latencies'] = dict(state['_latencies'])
+        return state
+
+    def __setstate__(self, state):
+        latencies = state.pop('_latencies')
+        self.__dict__.update(state)
+        self._latencies = defaultdict(lambda: deque(maxlen=1000), latencies)
+
+    def __repr__(self):
+        return (f"RetryPolicy(tries={self.tries}, base_delay={self.base_delay}, "
+                f"max_delay={self.max_delay}, hedge_after={self.hedge_after}, "
+                f"hedge_percentile={self.hedge_percentile})")
+
+
+_EXHAUSTED = '_ruigi_retries_exhausted'
+
+
+def _mark_exhausted(error):
+    try:
+        setattr(error, _EXHAUSTED, True)
+    except AttributeError:
+        pass
+
+
+def _spawn(function, *args, **kwargs):
+    # A thread per hedged call, rather than a shared pool, so hedged calls
+    # nested in other hedged or batch calls can never exhaust the workers.
+    future = Future()
+    function = metrics.bind(function)
+
+    def run():
+        try:
+            future.set_result(function(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='ruigi-hedge', daemon=True).start()
+    return future
+
+
+def retrying(hedge=False):
+    """ Decorator applying the storage's `retry_policy` to a method, and
+    recording its metrics in :py:mod:`ruigi.backends.metrics`.
+
+    Args:
+        hedge: `bool` or `function` default `False`
+            Whether calls may be hedged. A function receiving the method
+            arguments can decide per call, e.g. :py:func:`unless_file`.
+    """
+    def decorator(method):
+        name = method.__name__
+        parameters = list(inspect.signature(method).parameters.values())[1:]
+        format_param = next((p for p in parameters if p.name == 'format'), None)
+        format_index = parameters.index(format_param) if format_param else None
+
+        def call(self, args, kwargs):
+            policy = self.retry_policy
+            if policy is None:
+                return method(self, *args, **kwargs)
+            if policy.hedging and (hedge(*args, **kwargs) if callable(hedge) else hedge):
+                operation = f"{type(self).__name__}.{name}"
+                return policy.call_hedged(operation, method, self, *args, **kwargs)
+            return policy.call(method, self, *args, **kwargs)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            format = ''
+            if format_param is not None:
+                format = kwargs.get('format', args[format_index] if len(args) > format_index
+                                    else format_param.default)
+            with metrics.measure(self, name, format):
+                result = call(self, args, kwargs)
+            if format == 'file':
+                path = (args[1] if len(args) > 1 else kwargs['obj']) if name == 'save' else result
+                metrics.add_bytes(self, name, format, os.path.getsize(path))
+            elif name == 'read_range':
+                metrics.add_bytes(self, name, format, len(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def unless_file(name, format='pickle', *args, **kwargs):
+    """ Loads with `format='file'` write to a local path, so they are not hedged."""
+    return format != 'file'
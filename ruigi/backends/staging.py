@@ -0,0 +1,266 @@
+import os
+import time
+import uuid
+import tempfile
+import weakref
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from .transfer import MB
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+__TEMP_STORAGE__ = os.path.join(tempfile.gettempdir(), 'ruigi')
+_LOCK_SUFFIX = '.ruigi-lock'
+
+
+class StagingArea:
+    """ Local directory where storages stage files.
+
+    Every staged file gets a unique name, made of the process id, a random
+    token and the remote name, so concurrent workers never overwrite each
+    other's files, even for the same remote object.
+
+    Files handed to callers, e.g. by `load(format='file')`, are registered
+    and evicted in least recently used order whenever the directory grows
+    over `quota` bytes. Files in use, i.e. inside `staged` or `writing`, or
+    pinned with :py:meth:`pin` by an object reading them lazily, and files
+    younger than `min_age` seconds, are never evicted. Files in use are
+    protected from every process sharing the directory: their process holds
+    a shared `flock` on a `<file>.ruigi-lock` file, which the system releases
+    if the process dies. Without `fcntl`, e.g. on Windows, only files in use
+    by the same process are protected.
+
+    The directory can be placed on a fast disk, e.g. a tmpfs or NVMe mount,
+    with `path` or the `RUIGI_STAGING_DIR` environment variable.
+
+    Args:
+        path: `str` default `None`
+            Staging directory. Defaults to `RUIGI_STAGING_DIR` or `<tmp>/ruigi`.
+        quota: `int` default `None`
+            Maximum bytes kept in the directory. Defaults to
+            `RUIGI_STAGING_QUOTA_MB` megabytes, or no limit.
+        min_age: `float` default 60
+            Seconds a file is protected from eviction after its last use.
+    """
+
+    def __init__(self, path=None, quota=None, min_age=60.):
+        self.path = path or os.environ.get('RUIGI_STAGING_DIR') or __TEMP_STORAGE__
+        if quota is None and os.environ.get('RUIGI_STAGING_QUOTA_MB'):
+            quota = int(float(os.environ['RUIGI_STAGING_QUOTA_MB']) * MB)
+        self.quota = quota
+        self.min_age = min_age
+        self._active = Counter()
+        self._lock = threading.Lock()
+        self._counters = dict(staged=0, evicted=0, evicted_bytes=0, peak_bytes=0)
+        os.makedirs(self.path, exist_ok=True)
+
+    def path_for(self, name='', suffix=''):
+        """ Returns a new unique path for a local copy of the remote `name`."""
+        safe = name.replace('/', '-').replace('\\', '-')[-100:]
+        file_name = f"{os.getpid()}-{uuid.uuid4().hex[:12]}-{safe}{suffix}"
+        with self._lock:
+            self._counters['staged'] += 1
+        return os.path.join(self.path, file_name)
+
+    @contextmanager
+    def staged(self, name='', suffix=''):
+        """ Context manager yielding a unique path that is removed on exit.
+        The file is protected from eviction while the context is open."""
+        path = self.path_for(name, suffix)
+        try:
+            with self._in_use(path):
+                yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            self.enforce_quota()
+
+    @contextmanager
+    def writing(self, name='', suffix=''):
+        """ Context manager yielding a unique path to be handed to the caller
+        once written. The file is kept, and evicted later by the quota, but is
+        removed if the block raises."""
+        path = self.path_for(name, suffix)
+        with self._in_use(path):
+            try:
+                yield path
+            except BaseException:
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+        self.enforce_quota(keep=path)
+
+    def pin(self, path, owner):
+        """ Protect `path` from eviction while `owner` is alive, e.g. a lazy
+        object that reads the file on access.
+
+        Returns a `weakref.finalize` that releases the file when `owner` is
+        garbage collected, or earlier when called.
+        """
+        lock_file = self._acquire(path)
+        return weakref.finalize(owner, self._release, path, lock_file)
+
+    @contextmanager
+    def _in_use(self, path):
+        """ Protect `path` from eviction, by this and other processes."""
+        lock_file = self._acquire(path)
+        try:
+            yield
+        finally:
+            self._release(path, lock_file)
+
+    def _acquire(self, path):
+        with self._lock:
+            self._active[path] += 1
+        if fcntl is None:
+            return None
+        lock_file = open(path + _LOCK_SUFFIX, 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        return lock_file
+
+    def _release(self, path, lock_file):
+        with self._lock:
+            self._active[path] -= 1
+            last = self._active[path] <= 0
+            if last:
+                del self._active[path]
+        if lock_file is not None:
+            if last:
+                _remove(path + _LOCK_SUFFIX)
+            lock_file.close()
+        # A file just released counts as recently used.
+        self.touch(path)
+
+    def _used_by_other_process(self, path):
+        """ Returns True if a process holds the lock of `path`. Locks left by
+        processes that died are removed."""
+        if fcntl is None:
+            return False
+        try:
+            with open(path + _LOCK_SUFFIX) as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return True
+                _remove(path + _LOCK_SUFFIX)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def touch(self, path):
+        """ Mark a staged file as recently used."""
+        if os.path.exists(path):
+            os.utime(path)
+
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.path):
+            try:
+                if entry.is_file(follow_symlinks=False) and not entry.name.endswith(_LOCK_SUFFIX):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+            except FileNotFoundError:
+                pass  # removed by another worker meanwhile
+        return files
+
+    def usage(self):
+        """ Bytes currently used by the staging directory."""
+        return sum(size for _, size, _ in self._files())
+
+    def enforce_quota(self, keep=None):
+        """ Evict least recently used files until usage is within the quota."""
+        files = self._files()
+        used = sum(size for _, size, _ in files)
+        with self._lock:
+            self._counters['peak_bytes'] = max(self._counters['peak_bytes'], used)
+            active = set(self._active)
+        if self.quota is None or used <= self.quota:
+            return
+        now = time.time()
+        for last_used, size, path in sorted(files):
+            if used <= self.quota:
+                break
+            if path == keep or path in active or now - last_used < self.min_age \
+                    or self._used_by_other_process(path):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            used -= size
+            with self._lock:
+                self._counters['evicted'] += 1
+                self._counters['evicted_bytes'] += size
+
+    def cleanup(self, max_age=0.):
+        """ Remove staged files not used in the last `max_age` seconds,
+        except the ones in use."""
+        now = time.time()
+        with self._lock:
+            active = set(self._active)
+        for last_used, _, path in self._files():
+            if path not in active and now - last_used >= max_age \
+                    and not self._used_by_other_process(path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        """ Returns usage metrics: files, bytes, quota, staged, evicted,
+        evicted_bytes and peak_bytes. Counters are per process."""
+        files = self._files()
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(files=len(files), bytes=sum(size for _, size, _ in files),
+                     quota=self.quota, path=self.path)
+        return stats
+
+    def __repr__(self):
+        return f"StagingArea(path={self.path!r}, quota={self.quota})"
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_staging():
+    """ Returns the staging area shared by storages created without one."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = StagingArea()
+        return _default
+
+
+def set_default_staging(staging):
+    """ Replace the staging area shared by storages, e.g. to move it to a
+    tmpfs or set a quota for all storages."""
+    global _default
+    with _default_lock:
+        _default = staging
+
+
+class StagingMixin:
+    """ Gives storages a `staging` attribute, which is the shared default
+    staging area unless one is assigned."""
+    _staging = None
+
+    @property
+    def staging(self):
+        return self._staging or default_staging()
+
+    @staging.setter
+    def staging(self, staging):
+        self._staging = staging
@@ -0,0 +1,184 @@
+import io
+import threading
+from collections import deque
+from .formats import serialize
+from .transfer import MB
+
+
+class BoundedPipe:
+    """ In-memory pipe between a writer thread and a reader thread.
+
+    At most `capacity` bytes are buffered: writers block until the reader
+    catches up. Reads return exactly the requested number of bytes unless the
+    writer is done, which is what multipart uploaders expect from a stream of
+    unknown size.
+
+    If the writer fails, the reader gets the error instead of a short read, so
+    an upload never commits a truncated object. If the reader closes the pipe
+    early, blocked writers raise `BrokenPipeError`.
+
+    Args:
+        capacity: `int` default 8 MB
+            Maximum number of bytes buffered between writer and reader.
+    """
+
+    def __init__(self, capacity=8 * MB):
+        self.capacity = capacity
+        self._chunks = deque()
+        self._buffered = 0
+        self._read_pos = 0
+        self._write_pos = 0
+        self._eof = False
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self.reader = _PipeReader(self)
+        self.writer = _PipeWriter(self)
+
+    def _write(self, data):
+        view = memoryview(data).cast('B')
+        with self._cond:
+            while view:
+                while self._buffered >= self.capacity and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    raise BrokenPipeError("Pipe reader was closed")
+                piece = view[:max(self.capacity - self._buffered, 1)]
+                self._chunks.append(bytes(piece))
+                self._buffered += len(piece)
+                self._write_pos += len(piece)
+                view = view[len(piece):]
+                self._cond.notify_all()
+        return len(data)
+
+    def _finish(self, error=None):
+        with self._cond:
+            self._eof = True
+            self._error = error
+            self._cond.notify_all()
+
+    def _read(self, size=-1):
+        out = []
+        wanted = size if size is not None and size >= 0 else float('inf')
+        with self._cond:
+            while wanted > 0:
+                while not self._chunks and not self._eof:
+                    self._cond.wait()
+                if self._error is not None:
+                    raise IOError("Serialization failed while streaming") from self._error
+                if not self._chunks:
+                    break
+                chunk = self._chunks.popleft()
+                if len(chunk) > wanted:
+                    self._chunks.appendleft(chunk[wanted:])
+                    chunk = chunk[:wanted]
+                out.append(chunk)
+                self._buffered -= len(chunk)
+                wanted -= len(chunk)
+                self._cond.notify_all()
+        data = b''.join(out)
+        self._read_pos += len(data)
+        return data
+
+    def _unread(self, data):
+        with self._cond:
+            if data:
+                self._chunks.appendleft(bytes(data))
+                self._buffered += len(data)
+                self._read_pos -= len(data)
+
+    def _close(self):
+        with self._cond:
+            self._closed = True
+            self._chunks.clear()
+            self._buffered = 0
+            self._cond.notify_all()
+
+
+class _PipeReader(io.RawIOBase):
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._pipe._read(size)
+
+    def readinto(self, b):
+        data = self._pipe._read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def tell(self):
+        return self._pipe._read_pos
+
+    def unread(self, data):
+        """ Push `data` back to the front of the stream, e.g. after peeking."""
+        self._pipe._unread(data)
+
+    def close(self):
+        self._pipe._close()
+        super().close()
+
+
+class _PipeWriter(io.RawIOBase):
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self._pipe._write(data)
+
+    def tell(self):
+        return self._pipe._write_pos
+
+
+def stream_upload(obj, format, upload, capacity=8 * MB):
+    """ Serialize `obj` in a background thread while `upload` consumes it.
+
+    Args:
+        obj: `obj`
+            Object to be serialized. See :py:func:`ruigi.backends.formats.serialize`.
+        format: `str`
+            One of pickle, joblib or parquet.
+        upload: `function`
+            upload(fileobj) reads the non-seekable stream until EOF and stores it.
+        capacity: `int` default 8 MB
+            Bytes buffered between the serializer and the upload.
+
+    Returns:
+        The return value of `upload`.
+    """
+    pipe = BoundedPipe(capacity)
+    errors = []
+
+    def produce():
+        try:
+            serialize(obj, pipe.writer, format=format)
+        except BaseException as e:
+            errors.append(e)
+            pipe._finish(e)
+        else:
+            pipe._finish()
+
+    producer = threading.Thread(target=produce, name='ruigi-serialize', daemon=True)
+    producer.start()
+    try:
+        result = upload(pipe.reader)
+    except BaseException:
+        pipe.reader.close()
+        producer.join()
+        if errors and not isinstance(errors[0], BrokenPipeError):
+            raise errors[0]
+        raise
+    finally:
+        pipe.reader.close()
+    producer.join()
+    if errors:
+        raise errors[0]
+    return result
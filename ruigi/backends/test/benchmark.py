@@ -0,0 +1,359 @@
+"""
+Throughput benchmark of storage backends against local emulators.
+
+    python -m ruigi.backends.test.benchmark --sizes 1KB,1MB,64MB --concurrency 1,8
+
+Every backend saves and loads objects of each format and size, with each
+concurrency level, and reports MB/s, operations per second and the peak
+resident memory of the process while the case ran. Small objects are
+transferred many at a time, up to `--budget-mb` per case, so ops/s measure
+per-request overhead; large objects measure multipart throughput.
+
+S3 runs against an in-process moto server (pip install "moto[server]").
+ADLS runs against the local fake file system used by its tests.
+The local and memory backends always run and measure ruigi overhead alone.
+GCS runs against fake-gcs-server when STORAGE_EMULATOR_HOST is set, e.g.
+`docker run -p 4443:4443 fsouza/fake-gcs-server -scheme http` and
+`STORAGE_EMULATOR_HOST=http://localhost:4443`.
+
+Objects of the pickle, joblib and parquet formats are built in memory, so
+sizes in the GB range should be run with `--formats file` only.
+
+Results can be written with `--output` and compared with a previous run with
+`--baseline`. The process exits with status 1 if a throughput dropped, or the
+memory allocated by a case grew, by more than `--tolerance`. `make benchmark`
+does it against `benchmark_baseline.json`, which `make benchmark_baseline`
+writes on the machine running the benchmark.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from ..transfer import TransferSettings, MB
+
+KB = 2 ** 10
+GB = 2 ** 30
+FORMATS = ('file', 'pickle', 'joblib', 'parquet')
+
+
+@contextmanager
+def s3_storage(transfer_settings):
+    """ Yields a S3Storage backed by a moto server running in this process."""
+    import boto3
+    import logging
+    from moto.server import ThreadedMotoServer
+    from ..aws import S3Storage
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        endpoint_url = f"http://{host}:{port}"
+        bucket_name = 'ruigi-benchmark'
+        boto3.resource('s3', endpoint_url=endpoint_url, region_name='us-east-1',
+                       aws_access_key_id='test', aws_secret_access_key='test',
+                       ).create_bucket(Bucket=bucket_name)
+        yield S3Storage(bucket_name, aws_access_key_id='test',
+                        aws_secret_access_key='test', endpoint_url=endpoint_url,
+                        transfer_settings=transfer_settings)
+    finally:
+        server.stop()
+
+
+@contextmanager
+def gcs_storage(transfer_settings):
+    """ Yields a GoogleStorage backed by the emulator at STORAGE_EMULATOR_HOST."""
+    from google.cloud import storage as gcs
+    from ..gcp import GoogleStorage
+    bucket_name = 'ruigi-benchmark'
+    client = gcs.Client(project='test')
+    if client.lookup_bucket(bucket_name) is None:
+        client.create_bucket(bucket_name)
+    yield GoogleStorage(None, 'test', bucket_name, transfer_settings=transfer_settings)
+
+
+@contextmanager
+def adls_storage(transfer_settings):
+    """ Yields an ADLSStorage backed by the fake file system of its tests."""
+    from unittest import mock
+    from . import fake_adls
+    from .. import adls_gen1
+    with tempfile.TemporaryDirectory() as root:
+        fs = fake_adls.FakeAzureDLFileSystem(root)
+        with mock.patch.object(adls_gen1.core, 'AzureDLFileSystem', lambda *a, **kw: fs), \
+                mock.patch.object(adls_gen1, 'multithread', fake_adls):
+            yield adls_gen1.ADLSStorage(token='fake', store_name='fake',
+                                        transfer_settings=transfer_settings)
+
+
+@contextmanager
+def local_storage(transfer_settings):
+    """ Yields a LocalStorage in a temporary directory. Transfer settings are not used."""
+    from ..local import LocalStorage
+    with tempfile.TemporaryDirectory() as root:
+        yield LocalStorage(root)
+
+
+@contextmanager
+def memory_storage(transfer_settings):
+    """ Yields a MemoryStorage. Transfer settings are not used."""
+    from ..memory import MemoryStorage
+    yield MemoryStorage()
+
+
+def available_backends():
+    backends = {'local': local_storage, 'memory': memory_storage}
+    try:
+        import moto.server  # noqa: F401
+        backends['s3'] = s3_storage
+    except ImportError:
+        pass
+    if os.environ.get('STORAGE_EMULATOR_HOST'):
+        backends['gcs'] = gcs_storage
+    try:
+        import azure.datalake.store  # noqa: F401
+        backends['adls'] = adls_storage
+    except ImportError:
+        pass
+    return backends
+
+
+def parse_size(text):
+    """ Parses sizes like `512`, `1KB`, `64MB` or `5GB` into bytes."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMG]?B?)\s*', text.upper())
+    if match is None:
+        raise ValueError(f"Invalid size {text!r}")
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'B': 1, 'K': KB, 'KB': KB, 'M': MB, 'MB': MB,
+                                'G': GB, 'GB': GB}[unit])
+
+
+def format_size(size):
+    for unit, factor in (('GB', GB), ('MB', MB), ('KB', KB)):
+        if size >= factor and size % factor == 0:
+            return f"{size // factor}{unit}"
+    return f"{size}B"
+
+
+def rss_bytes():
+    """ Current resident memory of this process, or its peak where the
+    current value is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * KB
+
+
+class PeakRSS:
+    """ Context manager sampling the resident memory every `interval` seconds
+    in a background thread. `peak` holds the maximum seen and `start` the
+    value on entry, in bytes."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._done = threading.Event()
+
+    def _sample(self):
+        while not self._done.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            self._done.wait(self.interval)
+
+    def __enter__(self):
+        self.start = self.peak = rss_bytes()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def make_payload(format, size, directory):
+    """ Returns an object of roughly `size` serialized bytes for `format`."""
+    if format == 'file':
+        path = os.path.join(directory, f"payload-{size}")
+        with open(path, 'wb') as f:
+            for start in range(0, size, 64 * MB):
+                f.write(os.urandom(min(64 * MB, size - start)))
+        return path
+    if format == 'parquet':
+        import numpy as np
+        import pandas as pd
+        return pd.DataFrame({'x': np.random.rand(max(size // 8, 1))})
+    # Random bytes do not compress, so pickle objects keep their size.
+    return os.urandom(size)
+
+
+def bench_case(storage, format, size, concurrency=1, count=1, repeat=1, directory=None):
+    """ Saves and loads `count` objects of `size` bytes with `concurrency`
+    threads. Returns MB/s and ops/s of the fastest repetition, the peak
+    resident memory of the process and its growth during the case, in MB."""
+    with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        payload = make_payload(format, size, tmp_dir)
+        prefix = f"benchmark/{uuid.uuid4().hex}"
+        names = [f"{prefix}/{i}" for i in range(count)]
+
+        def save(name):
+            storage.save(name, payload, format=format)
+
+        def load(name):
+            obj = storage.load(name, format=format)
+            if format == 'file':
+                os.remove(obj)
+
+        timings = {'save': [], 'load': []}
+        with PeakRSS() as rss, ThreadPoolExecutor(concurrency) as pool:
+            try:
+                for _ in range(repeat):
+                    for operation, function in (('save', save), ('load', load)):
+                        start = time.perf_counter()
+                        list(pool.map(function, names))
+                        timings[operation].append(time.perf_counter() - start)
+            finally:
+                list(pool.map(storage.delete, names))
+
+    result = {}
+    for operation, seconds in timings.items():
+        best = max(min(seconds), 1e-9)
+        result[f'{operation}_mb_s'] = size * count / MB / best
+        result[f'{operation}_ops_s'] = count / best
+    result['peak_rss_mb'] = rss.peak / MB
+    result['rss_growth_mb'] = (rss.peak - rss.start) / MB
+    return result
+
+
+def case_key(backend, format, size, concurrency):
+    return f"{backend}/{format}/{format_size(size)}/c{concurrency}"
+
+
+def run_suite(backends, formats, sizes, concurrency_levels, repeat=1, part_size=8 * MB,
+              budget=64 * MB, max_objects=100, directory=None, report=print):
+    """ Runs every combination and returns a dict {case key: result}.
+
+    Args:
+        backends: `dict`
+            {name: function(transfer_settings) returning a storage context manager}.
+        formats, sizes, concurrency_levels: `list`
+            Values to combine. Sizes are in bytes.
+        budget: `int` default 64 MB
+            Bytes transferred per case: `budget // size` objects, at least one
+            and at most `max_objects`.
+    """
+    results = {}
+    for backend, make_storage in backends.items():
+        for concurrency in concurrency_levels:
+            settings = TransferSettings(part_size=part_size, max_concurrency=concurrency,
+                                        multipart_threshold=part_size)
+            with make_storage(settings) as storage:
+                for format in formats:
+                    for size in sizes:
+                        count = max(1, min(max_objects, budget // size))
+                        result = bench_case(storage, format, size, concurrency=concurrency,
+                                            count=count, repeat=repeat, directory=directory)
+                        key = case_key(backend, format, size, concurrency)
+                        results[key] = result
+                        if report is not None:
+                            report(_row(key, result))
+    return results
+
+
+def _row(key, result):
+    return (f"{key:<32} {result['save_mb_s']:>10.1f} {result['load_mb_s']:>10.1f} "
+            f"{result['save_ops_s']:>10.1f} {result['load_ops_s']:>10.1f} "
+            f"{result['peak_rss_mb']:>9.0f}")
+
+
+def _header():
+    return (f"{'case':<32} {'save MB/s':>10} {'load MB/s':>10} "
+            f"{'save op/s':>10} {'load op/s':>10} {'RSS MB':>9}")
+
+
+def compare(results, baseline, tolerance=0.3, rss_slack_mb=32):
+    """ Returns a list of regressions of `results` against `baseline`.
+
+    A case regresses if a throughput is below `1 - tolerance` times its
+    baseline, or if the memory it allocated, `rss_growth_mb`, is over
+    `1 + tolerance` times the baseline plus `rss_slack_mb`. The absolute peak
+    is not compared, since it depends on the cases run before. Cases missing
+    from either side are ignored.
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in ('save_mb_s', 'load_mb_s'):
+            if base.get(metric) and result[metric] < base[metric] * (1 - tolerance):
+                regressions.append(f"{key} {metric}: {result[metric]:.1f} "
+                                   f"< baseline {base[metric]:.1f}")
+        if 'rss_growth_mb' in base and \
+                result['rss_growth_mb'] > base['rss_growth_mb'] * (1 + tolerance) + rss_slack_mb:
+            regressions.append(f"{key} rss_growth_mb: {result['rss_growth_mb']:.0f} "
+                               f"> baseline {base['rss_growth_mb']:.0f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1].strip())
+    parser.add_argument('--backends', default=None,
+                        help="Comma separated backends. Defaults to all available.")
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--sizes', default='1KB,1MB,64MB',
+                        help="Comma separated object sizes, e.g. 1KB,1MB,5GB.")
+    parser.add_argument('--concurrency', default='1,8',
+                        help="Comma separated concurrency levels.")
+    parser.add_argument('--part-size-mb', type=int, default=8)
+    parser.add_argument('--budget-mb', type=int, default=64)
+    parser.add_argument('--max-objects', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=2)
+    parser.add_argument('--output', help="Write the results as JSON to this path.")
+    parser.add_argument('--baseline', help="Compare with the results stored at this path.")
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    args = parser.parse_args(argv)
+
+    backends = available_backends()
+    if args.backends:
+        wanted = args.backends.split(',')
+        missing = set(wanted) - set(backends)
+        if missing:
+            parser.error(f"Unavailable backends: {', '.join(sorted(missing))}")
+        backends = {name: backends[name] for name in wanted}
+
+    print(_header())
+    results = run_suite(backends, formats=args.formats.split(','),
+                        sizes=[parse_size(s) for s in args.sizes.split(',')],
+                        concurrency_levels=[int(c) for c in args.concurrency.split(',')],
+                        repeat=args.repeat, part_size=args.part_size_mb * MB,
+                        budget=args.budget_mb * MB, max_objects=args.max_objects)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+""" Local fake of the parts of the azure-datalake-store API used by
+:py:class:`ruigi.backends.adls_gen1.ADLSStorage`, backed by a directory."""
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FakeAzureDLFileSystem:
+    """ `AzureDLFileSystem` storing files under `root`.
+
+    Calls are recorded in `opens`, `puts`, `gets` and `transfers`, so tests
+    can check how the storage moves data. Setting `fail_transfers` makes
+    multithreaded transfers report failure, as the SDK does on failed chunks.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.opens = []
+        self.puts = []
+        self.gets = []
+        self.transfers = []
+        self.fail_transfers = False
+        self._lock = threading.Lock()
+
+    def _local(self, path):
+        return os.path.join(self.root, str(path).lstrip('/'))
+
+    def open(self, path, mode='rb', blocksize=2 ** 25, delimiter=None):
+        with self._lock:
+            self.opens.append((path, mode, blocksize))
+        local = self._local(path)
+        if 'w' in mode:
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+        elif not os.path.isfile(local):
+            raise FileNotFoundError(path)
+        return open(local, mode)
+
+    def exists(self, path, invalidate_cache=True):
+        return os.path.exists(self._local(path))
+
+    def info(self, path, invalidate_cache=True, expected_error_code=None):
+        local = self._local(path)
+        if not os.path.exists(local):
+            raise FileNotFoundError(path)
+        return {'name': path, 'length': os.path.getsize(local),
+                'type': 'DIRECTORY' if os.path.isdir(local) else 'FILE'}
+
+    def put(self, filename, path, delimiter=None):
+        with self._lock:
+            self.puts.append(path)
+        local = self._local(path)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        shutil.copyfile(filename, local)
+
+    def get(self, path, filename):
+        with self._lock:
+            self.gets.append(path)
+        shutil.copyfile(self._local(path), filename)
+
+    def read_block(self, fn, offset, length, delimiter=None):
+        with open(self._local(fn), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def remove(self, path, recursive=False):
+        local = self._local(path)
+        if not os.path.exists(local):
+            raise FileNotFoundError(path)
+        if os.path.isdir(local):
+            shutil.rmtree(local)
+        else:
+            os.remove(local)
+
+    def mv(self, path1, path2):
+        # Like RENAME, an existing destination is left untouched.
+        src, dst = self._local(path1), self._local(path2)
+        if not os.path.exists(src):
+            raise FileNotFoundError(path1)
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+
+    def ls(self, path='', detail=False, invalidate_cache=True):
+        local = self._local(path)
+        if not os.path.isdir(local):
+            raise FileNotFoundError(path)
+        return ['/'.join([str(path).strip('/'), entry]).lstrip('/')
+                for entry in sorted(os.listdir(local))]
+
+    def walk(self, path='', details=False, invalidate_cache=True):
+        local = self._local(path)
+        if not os.path.isdir(local):
+            raise FileNotFoundError(path)
+        files = []
+        for folder, _, names in os.walk(local):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(folder, name), self.root)
+                             .replace(os.sep, '/'))
+        return sorted(files)
+
+
+class _FakeTransfer:
+    """ Copies a file in `chunksize` pieces with `nthreads` threads."""
+
+    def __init__(self, adlfs, rpath, lpath, nthreads=None, chunksize=2 ** 28,
+                 buffersize=2 ** 22, blocksize=2 ** 22, client=None, run=True,
+                 overwrite=False, verbose=False, progress_callback=None, timeout=0):
+        self.adlfs = adlfs
+        self.rpath = rpath
+        self.lpath = lpath
+        self.nthreads = nthreads or os.cpu_count()
+        self.chunksize = chunksize
+        self.buffersize = buffersize
+        self.blocksize = blocksize
+        self.chunks = 0
+        self._success = False
+        with adlfs._lock:
+            adlfs.transfers.append(self)
+        if run:
+            self.run()
+
+    def _paths(self):
+        raise NotImplementedError
+
+    def run(self):
+        source, target = self._paths()
+        size = os.path.getsize(source)
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        with open(target, 'wb') as f:
+            f.truncate(size)
+
+        def copy(offset):
+            with open(source, 'rb') as src, open(target, 'r+b') as dst:
+                src.seek(offset)
+                dst.seek(offset)
+                dst.write(src.read(self.chunksize))
+
+        offsets = range(0, size, self.chunksize)
+        with ThreadPoolExecutor(self.nthreads) as pool:
+            list(pool.map(copy, offsets))
+        self.chunks = len(offsets)
+        self._success = not self.adlfs.fail_transfers
+
+    def successful(self):
+        return self._success
+
+
+class ADLUploader(_FakeTransfer):
+
+    def _paths(self):
+        return self.lpath, self.adlfs._local(self.rpath)
+
+
+class ADLDownloader(_FakeTransfer):
+
+    def _paths(self):
+        return self.adlfs._local(self.rpath), self.lpath
@@ -1,14 +1,131 @@
-from .utils import StorageTest
+import os
+import tempfile
 import unittest
+from unittest import mock
+from pandas import testing as pd_test
+from .utils import StorageTest, make_dataframe
+from . import fake_adls
+from .. import adls_gen1
 from ..adls_gen1 import ADLSStorage
+from ..staging import StagingArea
+from ..transfer import TransferSettings
+from azure.datalake.store.exceptions import DatalakeIncompleteTransferException
 
-stg = ADLSStorage()
+MB = 2 ** 20
 
 
+class TestADLSStorageFake(StorageTest, unittest.TestCase):
+    """ Runs the storage against a local fake of the ADLS Gen1 file system."""
+
+    def setUp(self):
+        self.remote_dir = tempfile.TemporaryDirectory()
+        self.staging_dir = tempfile.TemporaryDirectory()
+        self.fs = fake_adls.FakeAzureDLFileSystem(self.remote_dir.name)
+        self.patches = [
+            mock.patch.object(adls_gen1.core, 'AzureDLFileSystem', lambda *a, **kw: self.fs),
+            mock.patch.object(adls_gen1, 'multithread', fake_adls),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.stg = ADLSStorage(parent_folder='ruigi', token='fake', store_name='fake',
+                               transfer_settings=TransferSettings(
+                                   part_size=1 * MB, multipart_threshold=1 * MB,
+                                   max_concurrency=4),
+                               staging=StagingArea(self.staging_dir.name))
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.remote_dir.cleanup()
+        self.staging_dir.cleanup()
+
+    def get_base_test_path(self):
+        return 'test'
+
+    def get_storage(self):
+        return self.stg
+
+    def _write_local(self, size):
+        path = os.path.join(self.staging_dir.name, 'big.bin')
+        data = os.urandom(size)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path, data
+
+    def test_multithreaded_file_transfer(self):
+        local_file_path, data = self._write_local(3 * MB + 10)
+        self.stg.save('test/big.bin', local_file_path, format='file')
+        downloaded = self.stg.load('test/big.bin', format='file')
+        with open(downloaded, 'rb') as f:
+            self.assertEqual(f.read(), data)
+
+        upload, download = self.fs.transfers
+        self.assertIsInstance(upload, fake_adls.ADLUploader)
+        self.assertIsInstance(download, fake_adls.ADLDownloader)
+        for transfer in (upload, download):
+            self.assertEqual(transfer.nthreads, 4)
+            self.assertEqual(transfer.chunksize, 1 * MB)
+            self.assertEqual(transfer.blocksize, 1 * MB)
+            self.assertEqual(transfer.chunks, 4)
+        self.assertEqual(self.fs.puts + self.fs.gets, [])
+
+    def test_small_file_transfer_is_single_request(self):
+        local_file_path, _ = self._write_local(1000)
+        self.stg.save('test/small.bin', local_file_path, format='file')
+        self.stg.load('test/small.bin', format='file')
+        self.assertEqual(self.fs.transfers, [])
+        self.assertEqual(self.fs.puts, ['ruigi/test/small.bin'])
+        self.assertEqual(self.fs.gets, ['ruigi/test/small.bin'])
+
+    def test_incomplete_transfer_raises(self):
+        local_file_path, _ = self._write_local(2 * MB)
+        self.fs.fail_transfers = True
+        with self.assertRaises(DatalakeIncompleteTransferException):
+            self.stg.save('test/big.bin', local_file_path, format='file')
+        # Retried by the default policy before giving up.
+        self.assertEqual(len(self.fs.transfers), self.stg.retry_policy.tries)
+
+    def test_pickle_load_streams_from_remote(self):
+        df = make_dataframe(1000)
+        self.stg.save('test/df.pkl', df, format='pickle')
+        del self.fs.opens[:]
+        pd_test.assert_frame_equal(self.stg.load('test/df.pkl', format='pickle'), df)
+        self.assertEqual(self.fs.opens, [('ruigi/test/df.pkl', 'rb', 1 * MB)])
+        self.assertEqual(self.fs.gets, [])
+        self.assertEqual(os.listdir(self.staging_dir.name), [])
+
+    def test_failed_streamed_save_keeps_previous_version(self):
+        self.stg.save('test/obj.pkl', {'version': 1}, format='pickle')
+
+        def write(fileobj):
+            fileobj.write(b'partial')
+            # Nothing is visible under the final name while streaming.
+            self.assertEqual(list(self.stg.list('test/')), ['test/obj.pkl'])
+            raise ValueError('serialization failed')
+
+        with self.assertRaises(ValueError):
+            self.stg.save('test/obj.pkl', write, format='writer')
+        self.assertEqual(self.stg.load('test/obj.pkl', format='pickle'), {'version': 1})
+        self.assertEqual(self.fs.walk(), ['ruigi/test/obj.pkl'])
+
+        self.stg.save('test/obj.pkl', {'version': 2}, format='pickle')
+        self.assertEqual(self.stg.load('test/obj.pkl', format='pickle'), {'version': 2})
+        self.assertEqual(self.fs.walk(), ['ruigi/test/obj.pkl'])
+
+
+@unittest.skipUnless(os.environ.get('ADL_STORE'), "ADL_STORE is not set")
 class TestADLGen1Storage(StorageTest, unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.stg = ADLSStorage()
+
     def get_base_test_path(self):
         return 'test'
 
     def get_storage(self):
-        return stg
\ No newline at end of file
+        return self.stg
+
+
+if __name__ == '__main__':
+    unittest.main()
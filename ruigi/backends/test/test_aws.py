@@ -0,0 +1,155 @@
+import os
+import unittest
+import boto3
+import numpy as np
+import pandas as pd
+from .utils import StorageTest, make_dataframe
+import tempfile
+from unittest import mock
+from ..aws import S3Storage
+from ..checkpoints import UploadCheckpoints
+from ..retries import RetryPolicy
+from ..staging import StagingArea
+from ..transfer import TransferSettings
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+BUCKET_NAME = 'ruigi-test'
+
+
+@unittest.skipIf(mock_aws is None, "moto is not installed")
+class TestS3Storage(StorageTest, unittest.TestCase):
+
+    def setUp(self):
+        self.mock = mock_aws()
+        self.mock.start()
+        boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET_NAME)
+        self.staging_dir = tempfile.TemporaryDirectory()
+        self.stg = S3Storage(BUCKET_NAME, parent_folder='ruigi',
+                             transfer_settings=TransferSettings(
+                                 part_size=5 * 2 ** 20, multipart_threshold=5 * 2 ** 20),
+                             staging=StagingArea(self.staging_dir.name))
+        self.requests = []
+        self.stg.client.meta.client.meta.events.register(
+            'before-send.s3', lambda request, **kwargs: self.requests.append(request.method))
+
+    def tearDown(self):
+        self.mock.stop()
+        self.staging_dir.cleanup()
+
+    def get_base_test_path(self):
+        return 'test'
+
+    def get_storage(self):
+        return self.stg
+
+    def test_connection_pool(self):
+        config = self.stg.client.meta.client.meta.config
+        self.assertEqual(config.max_pool_connections, self.stg.max_workers)
+        self.assertTrue(config.tcp_keepalive)
+        stg = S3Storage(BUCKET_NAME, max_connections=64)
+        self.assertEqual(stg.client.meta.client.meta.config.max_pool_connections, 64)
+
+    def test_small_load_is_a_single_request(self):
+        df = make_dataframe()
+        self.stg.save('small', df, format='pickle')
+        self.requests.clear()
+        self.assertTrue(self.stg.load('small', format='pickle').equals(df))
+        self.assertEqual(self.requests, ['GET'])
+
+    def test_multipart_load(self):
+        data = bytes(range(256)) * (2 ** 15)  # 8 MB, two parts
+        self.stg.save('large', data, format='joblib')
+        self.assertEqual(self.stg.load('large', format='joblib'), data)
+
+    def test_streaming_save(self):
+        self.requests.clear()
+        data = os.urandom(12 * 2 ** 20)
+        self.stg.save('streamed', data, format='joblib')
+        self.assertEqual(self.requests.count('PUT'), 3)  # three parts
+        self.assertEqual(self.stg.load('streamed', format='joblib'), data)
+        self.assertEqual(os.listdir(self.staging_dir.name), [])
+        # at most two parts are buffered, whatever the concurrency
+        self.assertEqual(S3Storage(BUCKET_NAME).transfer_config.max_in_memory_upload_chunks, 2)
+
+    def test_failed_serialization_creates_no_object(self):
+        with self.assertRaises(ValueError):
+            self.stg.save('not_a_df', 'not a DataFrame', format='parquet')
+        self.assertFalse(self.stg.exists('not_a_df'))
+
+    def test_column_projected_load_fetches_only_those_columns(self):
+        df = pd.DataFrame(np.random.rand(20000, 20), columns=[f'c{i}' for i in range(20)])
+        self.stg.save('wide', df, format='parquet')
+        size = self.stg.size('wide')
+        fetched = []
+        read_range = self.stg.read_range
+        self.stg.read_range = lambda name, start, end: fetched.append(end - start) \
+            or read_range(name, start, end)
+        result = self.stg.load('wide', format='parquet', columns=['c3', 'c7'])
+        pd.testing.assert_frame_equal(result, df[['c3', 'c7']])
+        self.assertLess(sum(fetched), size / 4)
+
+    def _interrupted_upload(self, data):
+        """ Starts a resumable upload of `data` that fails on its third part."""
+        local_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(local_dir.cleanup)
+        local_file = os.path.join(local_dir.name, 'big.bin')
+        with open(local_file, 'wb') as f:
+            f.write(data)
+        stg = S3Storage(BUCKET_NAME, parent_folder='ruigi',
+                        transfer_settings=TransferSettings(
+                            part_size=5 * 2 ** 20, multipart_threshold=5 * 2 ** 20,
+                            max_concurrency=1),
+                        retry_policy=RetryPolicy(tries=1),
+                        staging=StagingArea(self.staging_dir.name))
+        client = stg.client.meta.client
+        upload_part = client.upload_part
+        parts = []
+
+        def flaky_upload_part(**kwargs):
+            parts.append(kwargs['PartNumber'])
+            if len(parts) == 3:
+                raise ConnectionError("Connection lost")
+            return upload_part(**kwargs)
+
+        patch = mock.patch.object(client, 'upload_part', flaky_upload_part)
+        patch.start()
+        self.addCleanup(patch.stop)
+        with self.assertRaises(ConnectionError):
+            stg.save('big', local_file, format='file')
+        self.assertFalse(stg.exists('big'))
+        self.assertEqual(len(list(UploadCheckpoints(stg.staging))), 1)
+        parts.clear()
+        return stg, local_file, parts
+
+    def test_resumable_upload_continues_from_completed_parts(self):
+        data = os.urandom(15 * 2 ** 20 + 100)  # four parts
+        stg, local_file, parts = self._interrupted_upload(data)
+        stg.save('big', local_file, format='file')
+        # Parts queued after the failure were still uploaded and checkpointed.
+        self.assertEqual(parts, [3])
+        with open(stg.load('big', format='file'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        self.assertEqual(list(UploadCheckpoints(stg.staging)), [])
+
+    def test_resumed_upload_reuploads_changed_parts(self):
+        data = os.urandom(15 * 2 ** 20 + 100)
+        stg, local_file, parts = self._interrupted_upload(data)
+        changed = data[:10] + os.urandom(10) + data[20:]
+        with open(local_file, 'wb') as f:
+            f.write(changed)
+        stg.save('big', local_file, format='file')
+        self.assertEqual(parts, [1, 3])
+        with open(stg.load('big', format='file'), 'rb') as f:
+            self.assertEqual(f.read(), changed)
+
+    def test_load_missing_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            self.stg.load('missing', format='joblib')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import json
+import tempfile
+import unittest
+from . import benchmark
+from ..transfer import MB
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(benchmark.parse_size('1KB'), 1024)
+        self.assertEqual(benchmark.parse_size('64mb'), 64 * MB)
+        self.assertEqual(benchmark.parse_size('5GB'), 5 * 2 ** 30)
+        self.assertEqual(benchmark.format_size(5 * 2 ** 30), '5GB')
+        with self.assertRaises(ValueError):
+            benchmark.parse_size('big')
+
+    def test_suite_and_baseline(self):
+        results = benchmark.run_suite({'memory': benchmark.memory_storage},
+                                      formats=['pickle', 'file'], sizes=[1024],
+                                      concurrency_levels=[1, 2], budget=8192, report=None)
+        self.assertEqual(sorted(results), ['memory/file/1KB/c1', 'memory/file/1KB/c2',
+                                           'memory/pickle/1KB/c1', 'memory/pickle/1KB/c2'])
+        for result in results.values():
+            self.assertGreater(result['save_ops_s'], 0)
+            self.assertGreater(result['load_mb_s'], 0)
+            self.assertGreater(result['peak_rss_mb'], 0)
+        self.assertEqual(benchmark.compare(results, results), [])
+
+        faster = {key: dict(result, save_mb_s=result['save_mb_s'] * 10)
+                  for key, result in results.items()}
+        regressions = benchmark.compare(results, faster)
+        self.assertEqual(len(regressions), 4)
+        self.assertIn('save_mb_s', regressions[0])
+
+    def test_main_exit_code(self):
+        args = ['--backends', 'memory', '--formats', 'joblib', '--sizes', '1KB',
+                '--concurrency', '1', '--repeat', '1', '--budget-mb', '0']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            baseline = os.path.join(tmp_dir, 'baseline.json')
+            self.assertEqual(benchmark.main(args + ['--output', baseline]), 0)
+            with open(baseline) as f:
+                stored = json.load(f)
+            for result in stored['results'].values():
+                result['load_mb_s'] *= 1000
+            with open(baseline, 'w') as f:
+                json.dump(stored, f)
+            self.assertEqual(benchmark.main(args + ['--baseline', baseline]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
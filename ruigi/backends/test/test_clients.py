@@ -0,0 +1,68 @@
+import os
+import pickle
+import unittest
+import multiprocessing
+from ..batch import BatchMixin
+from ..clients import ClientMixin
+
+
+class CountingStorage(ClientMixin, BatchMixin):
+    _client_names = ('client', 'bucket')
+
+    def __init__(self):
+        self.created = 0
+
+    def _create_clients(self):
+        self.created += 1
+        return {'client': (os.getpid(), self.created), 'bucket': 'bucket'}
+
+    def exists(self, name):
+        return False
+
+
+def _client_pid(storage, queue):
+    queue.put(storage.client[0])
+
+
+class TestClientMixin(unittest.TestCase):
+
+    def test_clients_are_lazy_and_reused(self):
+        stg = CountingStorage()
+        self.assertEqual(stg.created, 0)
+        self.assertIs(stg.client, stg.client)
+        self.assertEqual(stg.bucket, 'bucket')
+        self.assertEqual(stg.created, 1)
+        with self.assertRaises(AttributeError):
+            stg.missing
+
+    def test_reset_clients(self):
+        stg = CountingStorage()
+        stg.client
+        stg.reset_clients()
+        stg.client
+        self.assertEqual(stg.created, 2)
+
+    def test_pickle_drops_clients(self):
+        stg = CountingStorage()
+        stg.client
+        stg.exists_many(['a'])
+        copy = pickle.loads(pickle.dumps(stg))
+        self.assertNotIn('_client_state', copy.__dict__)
+        self.assertEqual(copy.client[1], 2)
+
+    @unittest.skipIf(not hasattr(os, 'fork'), "fork is not available")
+    def test_forked_process_creates_its_own_client(self):
+        stg = CountingStorage()
+        self.assertEqual(stg.client[0], os.getpid())
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        process = ctx.Process(target=_client_pid, args=(stg, queue))
+        process.start()
+        child_pid = queue.get(timeout=10)
+        process.join()
+        self.assertEqual(child_pid, process.pid)
+        self.assertEqual(stg.client[0], os.getpid())
+
+
+if __name__ == '__main__':
+    unittest.main()
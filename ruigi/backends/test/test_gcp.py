@@ -0,0 +1,193 @@
+import os
+import base64
+import hashlib
+import tempfile
+import unittest
+from ..staging import StagingArea
+from ..transfer import TransferSettings
+
+try:
+    from .. import gcp
+except ImportError:
+    gcp = None
+
+CHUNK = 256 * 1024
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, headers=None, resource=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.resource = resource
+
+    def json(self):
+        return self.resource
+
+
+class FakeSession:
+    """ Transport faking a GCS resumable session. It persists at most
+    `persist` bytes of each chunk, like a server that confirms fewer bytes
+    than it received, and answers 410 once `expired`."""
+
+    def __init__(self, size, persist=None):
+        self.size = size
+        self.persist = persist
+        self.data = b''
+        self.expired = False
+        self.resource = None
+        self.requests = []
+
+    def put(self, url, data=None, headers=None):
+        content_range = headers['Content-Range']
+        self.requests.append(content_range)
+        if self.expired:
+            return FakeResponse(410)
+        if data is not None:
+            start = int(content_range.split()[1].split('-')[0])
+            assert start == len(self.data), "chunks must follow the persisted bytes"
+            self.data += data[:self.persist]
+        if len(self.data) == self.size:
+            md5 = base64.b64encode(hashlib.md5(self.data).digest()).decode()
+            self.resource = {'size': str(self.size), 'md5Hash': md5}
+            return FakeResponse(200, resource=self.resource)
+        headers = {'Range': f'bytes=0-{len(self.data) - 1}'} if self.data else {}
+        return FakeResponse(308, headers=headers)
+
+
+class Crash(Exception):
+    pass
+
+
+class FakeTransport:
+    """ Routes requests to the FakeSession of their URL. Raises Crash, like a
+    killed process, on the request number `crash_at`."""
+
+    def __init__(self):
+        self.sessions = {}
+        self.crash_at = None
+        self.requests = 0
+
+    def put(self, url, **kwargs):
+        self.requests += 1
+        if self.requests == self.crash_at:
+            raise Crash()
+        return self.sessions[url].put(url, **kwargs)
+
+
+class FakeBlob:
+
+    def __init__(self, name, transport):
+        self.name = name
+        self.transport = transport
+
+    def create_resumable_upload_session(self, size):
+        url = f"session-{len(self.transport.sessions)}"
+        self.transport.sessions[url] = FakeSession(size)
+        return url
+
+
+if gcp is not None:
+    class FakeGoogleStorage(gcp.GoogleStorage):
+
+        def __init__(self, transport, **kwargs):
+            self.transport = transport
+            super().__init__(None, 'project', 'bucket', **kwargs)
+
+        def _create_clients(self):
+            transport = self.transport
+
+            class Client:
+                _http = transport
+
+            class Bucket:
+                def blob(self, name, chunk_size=None):
+                    return FakeBlob(name, transport)
+
+            return {'client': Client(), 'bucket': Bucket()}
+
+
+@unittest.skipIf(gcp is None, "google-cloud-storage is not installed")
+class TestResumableSession(unittest.TestCase):
+
+    def test_put_chunk(self):
+        session = FakeSession(10)
+        self.assertEqual(gcp._put_chunk(session, 'url', b'01234', 0, 10), (5, None))
+        self.assertEqual(session.requests, ['bytes 0-4/10'])
+        self.assertEqual(gcp._put_chunk(session, 'url', b'56789', 5, 10),
+                         (10, session.resource))
+        self.assertEqual(session.data, b'0123456789')
+
+    def test_put_chunk_partially_persisted(self):
+        # the upload continues from the bytes the 308 response confirms
+        session = FakeSession(10, persist=3)
+        self.assertEqual(gcp._put_chunk(session, 'url', b'01234', 0, 10), (3, None))
+        self.assertEqual(gcp._put_chunk(session, 'url', b'34567', 3, 10), (6, None))
+
+    def test_session_status(self):
+        session = FakeSession(10)
+        self.assertEqual(gcp._session_status(session, 'url', 10), (0, None))
+        self.assertEqual(session.requests, ['bytes */10'])
+        gcp._put_chunk(session, 'url', b'0123', 0, 10)
+        self.assertEqual(gcp._session_status(session, 'url', 10), (4, None))
+        gcp._put_chunk(session, 'url', b'456789', 4, 10)
+        self.assertEqual(gcp._session_status(session, 'url', 10), (10, session.resource))
+
+    def test_expired_session(self):
+        session = FakeSession(10)
+        session.expired = True
+        self.assertEqual(gcp._session_status(session, 'url', 10), (None, None))
+        with self.assertRaises(gcp.NotFound):
+            gcp._put_chunk(session, 'url', b'01234', 0, 10)
+
+
+@unittest.skipIf(gcp is None, "google-cloud-storage is not installed")
+class TestResumableUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.transport = FakeTransport()
+        self.storage = FakeGoogleStorage(
+            self.transport, staging=StagingArea(os.path.join(self.tmp_dir.name, 'staging')),
+            transfer_settings=TransferSettings(part_size=CHUNK, multipart_threshold=CHUNK))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _file(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _crashed_upload(self, data):
+        self.transport.crash_at = 3
+        with self.assertRaises(Crash):
+            self.storage.save('model.bin', self._file('first', data), format='file')
+        self.transport.crash_at = None
+        session, = self.transport.sessions.values()
+        self.assertEqual(len(session.data), 2 * CHUNK)
+
+    def test_resume_from_another_path(self):
+        data = os.urandom(3 * CHUNK + 10)
+        self._crashed_upload(data)
+        # a rerun stages the same content at a new path
+        self.storage.save('model.bin', self._file('second', data), format='file')
+        session, = self.transport.sessions.values()
+        self.assertEqual(session.data, data)
+        self.assertEqual(session.requests[-3:], [
+            f'bytes */{len(data)}',
+            f'bytes {2 * CHUNK}-{3 * CHUNK - 1}/{len(data)}',
+            f'bytes {3 * CHUNK}-{len(data) - 1}/{len(data)}'])
+
+    def test_changed_content_starts_over(self):
+        data = os.urandom(3 * CHUNK + 10)
+        self._crashed_upload(data)
+        changed = os.urandom(len(data))
+        self.storage.save('model.bin', self._file('second', changed), format='file')
+        self.assertEqual(len(self.transport.sessions), 2)
+        self.assertEqual(self.transport.sessions['session-1'].data, changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from .utils import StorageTest
+from ..local import LocalStorage
+
+
+class TestLocalStorage(StorageTest, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.stg = LocalStorage(self.tmp_dir.name, parent_folder='ruigi')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_base_test_path(self):
+        return 'test'
+
+    def get_storage(self):
+        return self.stg
+
+    def test_failed_save_leaves_no_file(self):
+        with self.assertRaises(ValueError):
+            self.stg.save('test/not_a_df', 'not a DataFrame', format='parquet')
+        self.assertFalse(self.stg.exists('test/not_a_df'))
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir.name, '.ruigi-tmp')), [])
+
+    def test_names_stay_under_root(self):
+        self.stg.save('/abs/x.pkl', {'a': 1})
+        self.assertTrue(os.path.isfile(os.path.join(self.tmp_dir.name, 'ruigi', 'abs', 'x.pkl')))
+        self.assertEqual(self.stg.load('/abs/x.pkl'), {'a': 1})
+        self.assertEqual(list(self.stg.list('/abs/')), ['/abs/x.pkl'])
+        self.assertEqual(list(self.stg.list('abs/')), ['abs/x.pkl'])
+        for name in ('../escaped.pkl', 'test/../../escaped.pkl', '/../escaped.pkl'):
+            with self.assertRaises(ValueError):
+                self.stg.save(name, {'a': 1})
+        with self.assertRaises(ValueError):
+            list(self.stg.list('../'))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, 'escaped.pkl')))
+
+
+if __name__ == '__main__':
+    unittest.main()
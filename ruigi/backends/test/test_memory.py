@@ -0,0 +1,26 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from .utils import StorageTest
+from ..memory import MemoryStorage
+
+
+class TestMemoryStorage(StorageTest, unittest.TestCase):
+
+    def setUp(self):
+        self.stg = MemoryStorage(parent_folder='ruigi')
+
+    def get_base_test_path(self):
+        return 'test'
+
+    def get_storage(self):
+        return self.stg
+
+    def test_concurrent_saves(self):
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: self.stg.save(f'test/{i}', i, format='joblib'), range(100)))
+        self.assertEqual(len(list(self.stg.list('test/'))), 100)
+        self.assertEqual(self.stg.load('test/42', format='joblib'), 42)
+
+
+if __name__ == '__main__':
+    unittest.main()
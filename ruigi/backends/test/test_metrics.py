@@ -0,0 +1,127 @@
+import io
+import os
+import tempfile
+import unittest
+from .utils import FaultyStorage, make_dataframe
+from .. import metrics
+from ..memory import MemoryStorage
+from ..local import LocalStorage
+from ..rangefile import RangeFile
+from ..retries import RetryPolicy
+from ..transfer import TransferSettings, parallel_download
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+        self.previous = metrics.default_registry()
+        metrics.set_default_registry(self.registry)
+
+    def tearDown(self):
+        metrics.set_default_registry(self.previous)
+
+    def test_operations_are_counted_by_format(self):
+        stg = MemoryStorage()
+        stg.save('a', make_dataframe(), format='parquet')
+        stg.save('b', [1, 2, 3])
+        stg.load('a', format='parquet')
+        stg.exists('a')
+        with self.assertRaises(FileNotFoundError):
+            stg.load('missing', format='joblib')
+
+        saves = self.registry.totals(storage='MemoryStorage', operation='save')
+        self.assertEqual(saves['count'], 2)
+        self.assertEqual(saves['bytes'], len(stg._get('a')) + len(stg._get('b')))
+        loads = self.registry.totals(operation='load', format='parquet')
+        self.assertEqual((loads['count'], loads['bytes']), (1, len(stg._get('a'))))
+        self.assertEqual(self.registry.totals(operation='load', format='joblib')['errors'], 1)
+        self.assertEqual(self.registry.totals(operation='exists')['count'], 1)
+
+    def test_file_and_range_bytes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stg = LocalStorage(tmp_dir)
+            local_file = os.path.join(tmp_dir, 'data.bin')
+            with open(local_file, 'wb') as f:
+                f.write(b'x' * 1000)
+            stg.save('data.bin', local_file, format='file')
+            os.remove(stg.load('data.bin', format='file'))
+            stg.read_range('data.bin', 0, 10)
+        self.assertEqual(self.registry.totals(operation='save', format='file')['bytes'], 1000)
+        self.assertEqual(self.registry.totals(operation='load', format='file')['bytes'], 1000)
+        self.assertEqual(self.registry.totals(operation='read_range')['bytes'], 10)
+
+    def test_retries_and_cache_hits(self):
+        stg = FaultyStorage(failure_rate=0.5, seed=1,
+                            retry_policy=RetryPolicy(tries=20, base_delay=0))
+        for i in range(10):
+            stg.save(f'obj_{i}', i)
+        retries = self.registry.totals(storage='FaultyStorage', event='retries')['events']
+        self.assertGreater(retries, 0)
+        self.assertEqual(self.registry.totals(operation='save')['errors'], 0)
+
+        stg = MemoryStorage()
+        stg.save('bytes', b'0123456789' * 100, format='joblib')
+        f = RangeFile(stg, 'bytes', read_ahead=4096)
+        f.read(10)
+        f.seek(0)
+        f.read(10)
+        self.assertEqual(self.registry.totals(event='cache_hits')['events'], 1)
+
+    def test_exports(self):
+        self.registry.observe('S3Storage', 'load', 'pickle', 0.03)
+        self.registry.observe('S3Storage', 'load', 'pickle', 7, error=True)
+        self.registry.add_bytes('S3Storage', 'load', 'pickle', 2048)
+        self.registry.increment('S3Storage', 'load', 'retries', 3)
+
+        snapshot = self.registry.snapshot()
+        op, = snapshot['operations']
+        self.assertEqual((op['count'], op['errors'], op['bytes']), (2, 1, 2048))
+        self.assertEqual(op['latency_buckets']['0.05'], 1)
+        self.assertEqual(op['latency_buckets']['+Inf'], 2)
+        self.assertEqual(snapshot['events'][0]['count'], 3)
+
+        text = self.registry.to_prometheus()
+        labels = 'storage="S3Storage",operation="load",format="pickle"'
+        self.assertIn(f'ruigi_storage_operations_total{{{labels}}} 2', text)
+        self.assertIn(f'ruigi_storage_latency_seconds_bucket{{{labels},le="10.0"}} 2', text)
+        self.assertIn(f'ruigi_storage_latency_seconds_count{{{labels}}} 2', text)
+        self.assertIn('ruigi_storage_events_total{storage="S3Storage",operation="load",'
+                      'event="retries"} 3', text)
+
+    def test_retries_of_transfer_parts_count_against_the_operation(self):
+        policy = RetryPolicy(tries=3, base_delay=0)
+        failed = set()
+
+        def read_range(start, end):
+            if start not in failed:
+                failed.add(start)
+                raise ConnectionError("part failed")
+            return b'x' * (end - start)
+
+        with metrics.measure(MemoryStorage(), 'load', 'file'):
+            parallel_download(lambda start, end: policy.call(read_range, start, end),
+                              40, io.BytesIO(), TransferSettings(part_size=10, max_concurrency=4))
+        retries = self.registry.totals(storage='MemoryStorage', operation='load', event='retries')
+        self.assertEqual(retries['events'], 4)
+
+    def test_spooled_metrics_are_merged(self):
+        worker = metrics.MetricsRegistry()
+        worker.observe('S3Storage', 'save', 'pickle', 0.03)
+        worker.add_bytes('S3Storage', 'save', 'pickle', 100)
+        worker.increment('S3Storage', 'save', 'retries', 2)
+        self.registry.observe('S3Storage', 'save', 'pickle', 7)
+
+        with tempfile.TemporaryDirectory() as spool:
+            worker.to_json(os.path.join(spool, '123.json'))
+            metrics.collect(spool)
+            self.assertEqual(os.listdir(spool), [])
+
+        totals = self.registry.totals(storage='S3Storage', operation='save')
+        self.assertEqual((totals['count'], totals['bytes'], totals['events']), (2, 100, 2))
+        op, = self.registry.snapshot()['operations']
+        self.assertEqual((op['latency_buckets']['0.05'], op['latency_buckets']['+Inf']), (1, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
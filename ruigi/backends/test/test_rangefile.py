@@ -0,0 +1,60 @@
+import os
+import unittest
+from ..memory import MemoryStorage
+from ..rangefile import RangeFile
+
+
+class TestRangeFile(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(10000)
+        self.stg = MemoryStorage()
+        with open('TEST_RANGE_FILE', 'wb') as f:
+            f.write(self.data)
+        self.stg.save('data', 'TEST_RANGE_FILE', format='file')
+        os.remove('TEST_RANGE_FILE')
+
+    def test_small_reads_are_served_from_read_ahead(self):
+        f = RangeFile(self.stg, 'data', read_ahead=1000)
+        self.assertEqual(f.read(10), self.data[:10])
+        self.assertEqual(f.read(100), self.data[10:110])
+        self.assertEqual(f.requests, 1)
+        f.seek(-8, os.SEEK_END)
+        self.assertEqual(f.read(), self.data[-8:])
+        f.seek(-500, os.SEEK_END)
+        self.assertEqual(f.read(100), self.data[-500:-400])
+        self.assertEqual(f.requests, 2)
+
+    def test_cache_is_bounded(self):
+        f = RangeFile(self.stg, 'data', read_ahead=1000, cache_size=2000)
+        for start in range(0, 5000, 1000):
+            f.seek(start)
+            self.assertEqual(f.read(10), self.data[start:start + 10])
+        self.assertLessEqual(f._cached_bytes, 2000)
+        f.seek(0)
+        f.read(10)
+        self.assertEqual(f.requests, 6)
+
+    def test_large_reads_are_not_cached(self):
+        f = RangeFile(self.stg, 'data', read_ahead=1000)
+        self.assertEqual(f.read(5000), self.data[:5000])
+        self.assertEqual(f._cached_bytes, 0)
+        self.assertEqual(f.bytes_fetched, 5000)
+
+    def test_prefetched_ranges_ignore_cache_size(self):
+        f = RangeFile(self.stg, 'data', read_ahead=1000, cache_size=2000)
+        f.prefetch([(0, 5000), (6000, 9000)])
+        self.assertEqual(f.requests, 2)
+        f.seek(1000)
+        self.assertEqual(f.read(4000), self.data[1000:5000])
+        f.seek(6500)
+        self.assertEqual(f.read(10), self.data[6500:6510])
+        self.assertEqual(f.requests, 2)
+        f.release()
+        f.seek(0)
+        self.assertEqual(f.read(5000), self.data[:5000])
+        self.assertEqual(f.requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import threading
+from .utils import FaultyStorage
+from ..retries import RetryPolicy
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_backoff_has_full_jitter_and_cap(self):
+        policy = RetryPolicy(base_delay=1, max_delay=4)
+        delays = [policy.backoff(5) for _ in range(200)]
+        self.assertTrue(all(0 <= d <= 4 for d in delays))
+        self.assertGreater(len(set(delays)), 100)
+
+    def test_only_retryable_errors_are_retried(self):
+        policy = RetryPolicy(retry_on=(ConnectionError,), tries=3, base_delay=0)
+        calls = []
+
+        def fail(error):
+            calls.append(error)
+            raise error
+
+        with self.assertRaises(ConnectionError):
+            policy.call(fail, ConnectionError())
+        self.assertEqual(len(calls), 3)
+        for error in (ValueError(), FileNotFoundError()):
+            calls.clear()
+            with self.assertRaises(type(error)):
+                policy.call(fail, error)
+            self.assertEqual(len(calls), 1)
+
+    def test_nested_calls_retry_once(self):
+        policy = RetryPolicy(retry_on=(ConnectionError,), tries=5, base_delay=0)
+        calls = []
+
+        def fail():
+            calls.append(1)
+            raise ConnectionError()
+
+        with self.assertRaises(ConnectionError):
+            policy.call(lambda: policy.call(fail))
+        self.assertEqual(len(calls), 5)
+
+    def test_predicate(self):
+        policy = RetryPolicy(retry_on=lambda e: 'throttled' in str(e))
+        self.assertTrue(policy.is_retryable(IOError('throttled')))
+        self.assertFalse(policy.is_retryable(IOError('denied')))
+
+    def test_percentile_threshold(self):
+        policy = RetryPolicy(hedge_percentile=90, min_samples=10)
+        self.assertIsNone(policy.hedge_threshold('op'))
+        policy._latencies['op'].extend(range(1, 11))
+        self.assertEqual(policy.hedge_threshold('op'), 10)
+
+
+class TestFaultInjection(unittest.TestCase):
+
+    def test_loads_survive_flaky_network(self):
+        stg = FaultyStorage(retry_policy=RetryPolicy(base_delay=0, tries=10))
+        stg.save('obj', list(range(100)), format='joblib')
+        stg.failure_rate = 0.3
+        for _ in range(100):
+            self.assertEqual(stg.load('obj', format='joblib'), list(range(100)))
+        self.assertGreater(stg.requests, 110)
+
+    def test_hedged_read_does_not_wait_for_slow_request(self):
+        release = threading.Event()
+        slow_finished = []
+
+        class OneSlowRequest(FaultyStorage):
+            slow = True
+
+            def _get(self, name):
+                if self.slow:
+                    # the first request hangs until released, no clock involved
+                    self.slow = False
+                    release.wait(timeout=30)
+                    slow_finished.append(True)
+                return super()._get(name)
+
+        policy = RetryPolicy(hedge_after=0.001)
+        stg = OneSlowRequest(retry_policy=policy)
+        stg.save('obj', 1, format='joblib')
+        try:
+            self.assertEqual(stg.load('obj', format='joblib'), 1)
+            self.assertEqual(slow_finished, [])
+            self.assertEqual(policy.hedges, 1)
+        finally:
+            release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import gc
+import time
+import tempfile
+import unittest
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from ..checkpoints import UploadCheckpoints
+from ..memory import MemoryStorage
+from ..staging import StagingArea
+
+
+class TestStagingArea(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.staging = StagingArea(self.tmp_dir.name, quota=2500, min_age=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, size):
+        with self.staging.writing(name) as path:
+            with open(path, 'wb') as f:
+                f.write(b'x' * size)
+        return path
+
+    def test_names_are_unique(self):
+        paths = {self.staging.path_for('a/b.pkl') for _ in range(100)}
+        self.assertEqual(len(paths), 100)
+        self.assertTrue(all(p.endswith('a-b.pkl') for p in paths))
+
+    def test_staged_files_are_removed(self):
+        with self.staging.staged('a') as path:
+            open(path, 'wb').close()
+        self.assertFalse(os.path.exists(path))
+
+    def test_failed_writes_are_removed(self):
+        with self.assertRaises(ValueError):
+            with self.staging.writing('a') as path:
+                open(path, 'wb').close()
+                raise ValueError
+        self.assertFalse(os.path.exists(path))
+
+    def test_quota_evicts_least_recently_used(self):
+        first = self.write('first', 1000)
+        second = self.write('second', 1000)
+        past = time.time() - 100
+        os.utime(first, (past, past))
+        os.utime(second, (past + 1, past + 1))
+        self.staging.touch(first)
+        third = self.write('third', 1000)
+        self.assertTrue(os.path.exists(first))
+        self.assertFalse(os.path.exists(second))
+        self.assertTrue(os.path.exists(third))
+        stats = self.staging.stats()
+        self.assertEqual(stats['evicted'], 1)
+        self.assertEqual(stats['evicted_bytes'], 1000)
+        self.assertEqual(stats['bytes'], 2000)
+
+    def test_recent_files_are_not_evicted(self):
+        self.staging.min_age = 60
+        paths = [self.write(str(i), 1000) for i in range(4)]
+        self.assertTrue(all(os.path.exists(p) for p in paths))
+        self.staging.cleanup(max_age=60)
+        self.assertEqual(self.staging.stats()['files'], 4)
+        self.staging.cleanup()
+        self.assertEqual(self.staging.stats()['files'], 0)
+
+    def test_concurrent_file_loads_do_not_collide(self):
+        stg = MemoryStorage(staging=self.staging)
+        with self.staging.staged('src') as src:
+            with open(src, 'wb') as f:
+                f.write(b'data')
+            stg.save('same/name', src, format='file')
+        with ThreadPoolExecutor(8) as pool:
+            paths = list(pool.map(lambda _: stg.load('same/name', format='file'), range(16)))
+        self.assertEqual(len(set(paths)), 16)
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'data')
+
+    @unittest.skipIf(os.name != 'posix', "requires fcntl and fork")
+    def test_files_in_use_by_other_processes_are_not_evicted(self):
+        context = multiprocessing.get_context('fork')
+        ready, done = context.Event(), context.Event()
+        queue = context.Queue()
+
+        def upload():
+            # another worker, with its own StagingArea on the same directory
+            staging = StagingArea(self.tmp_dir.name, quota=2500, min_age=0)
+            with staging.staged('uploading') as path:
+                with open(path, 'wb') as f:
+                    f.write(b'x' * 2000)
+                queue.put(path)
+                ready.set()
+                done.wait(30)
+
+        worker = context.Process(target=upload)
+        worker.start()
+        try:
+            self.assertTrue(ready.wait(30))
+            path = queue.get()
+            self.write('other', 1000)
+            self.staging.cleanup()
+            self.assertTrue(os.path.exists(path))
+        finally:
+            done.set()
+            worker.join(30)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_pinned_files_are_kept_while_their_owner_is_alive(self):
+        class Reader:
+            pass
+
+        path = self.write('lazy', 2000)
+        reader = Reader()
+        self.staging.pin(path, reader)
+        self.write('other', 1000)
+        self.staging.cleanup()
+        self.assertTrue(os.path.exists(path))
+        del reader
+        gc.collect()
+        self.staging.cleanup()
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_upload_checkpoints(self):
+        checkpoints = UploadCheckpoints(self.staging)
+        key = ['s3', 'bucket', 'name', 1024]
+        self.assertIsNone(checkpoints.load(key))
+        checkpoints.save(key, {'upload_id': 'abc', 'parts': {'1': 'etag'}})
+        self.assertEqual(UploadCheckpoints(self.staging).load(key)['parts'], {'1': 'etag'})
+        self.assertEqual(list(checkpoints), [(key, {'upload_id': 'abc', 'parts': {'1': 'etag'}})])
+        # Checkpoints are neither evicted nor counted as staged files.
+        self.staging.cleanup()
+        self.assertEqual(self.staging.usage(), 0)
+        checkpoints.remove(key)
+        self.assertIsNone(checkpoints.load(key))
+
+
+if __name__ == '__main__':
+    unittest.main()
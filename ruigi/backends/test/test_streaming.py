@@ -0,0 +1,58 @@
+import os
+import threading
+import unittest
+from ..streaming import BoundedPipe, stream_upload
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_reads_are_full_and_memory_is_bounded(self):
+        pipe = BoundedPipe(capacity=1000)
+        data = os.urandom(10000)
+        buffered = []
+
+        def write():
+            for i in range(0, len(data), 3000):
+                pipe.writer.write(data[i:i + 3000])
+                buffered.append(pipe._buffered)
+            pipe._finish()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        parts = []
+        while True:
+            part = pipe.reader.read(4096)
+            if not part:
+                break
+            parts.append(part)
+        writer.join()
+        self.assertEqual(b''.join(parts), data)
+        self.assertEqual([len(p) for p in parts], [4096, 4096, 1808])
+        self.assertTrue(all(b <= 1000 for b in buffered))
+
+    def test_serialization_error_reaches_upload(self):
+        uploaded = []
+
+        def upload(stream):
+            uploaded.append(stream.read())
+
+        with self.assertRaises(ValueError):
+            stream_upload('not a DataFrame', 'parquet', upload)
+        self.assertEqual(uploaded, [])
+
+    def test_upload_error_unblocks_serializer(self):
+        def upload(stream):
+            stream.read(10)
+            raise OSError("connection reset")
+
+        with self.assertRaises(OSError):
+            stream_upload(os.urandom(2 ** 20), 'joblib', upload, capacity=1024)
+
+    def test_unread(self):
+        result = stream_upload(b'abc' * 1000, 'joblib', lambda stream: (
+            stream.unread(stream.read(100)), stream.read())[1])
+        self.assertGreater(len(result), 3000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from .utils import StorageTest
+from ..local import LocalStorage
+from ..memory import MemoryStorage
+from ..tiered import TieredStorage, ReplicationError
+
+
+class FlakyStorage(MemoryStorage):
+    """ MemoryStorage failing the first `failures` saves."""
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+
+    def save(self, name, obj, format='pickle', chunk_size=None):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("injected failure")
+        super().save(name, obj, format=format, chunk_size=chunk_size)
+
+
+class TestTieredStorage(StorageTest, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.remote = FlakyStorage()
+        self.stg = self.make_storage(self.remote)
+
+    def make_storage(self, remote, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return TieredStorage(LocalStorage(self.tmp_dir.name), remote, **kwargs)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_base_test_path(self):
+        return 'test'
+
+    def get_storage(self):
+        return self.stg
+
+    def test_flush_replicates(self):
+        self.stg.save('test/a', {'a': 1}, format='joblib')
+        self.assertEqual(self.stg.local.load('test/a', format='joblib'), {'a': 1})
+        self.stg.flush()
+        self.assertEqual(self.remote.load('test/a', format='joblib'), {'a': 1})
+        self.assertEqual(self.stg.pending(), [])
+
+    def test_failed_copies_are_retried(self):
+        self.remote.failures = 2
+        self.stg.save('test/a', 1, format='joblib')
+        self.stg.flush()
+        self.assertEqual(self.remote.load('test/a', format='joblib'), 1)
+
+    def test_flush_raises_when_attempts_are_exhausted(self):
+        stg = self.make_storage(FlakyStorage(failures=10), max_attempts=2)
+        stg.save('test/a', 1, format='joblib')
+        with self.assertRaises(ReplicationError) as cm:
+            stg.flush()
+        self.assertEqual(cm.exception.names, ['test/a'])
+        self.assertEqual(stg.pending(), ['test/a'])
+        self.assertEqual(stg.load('test/a', format='joblib'), 1)
+
+    def test_queue_survives_restart(self):
+        stg = self.make_storage(FlakyStorage(failures=10), max_attempts=1)
+        stg.save('test/a', 1, format='joblib')
+        with self.assertRaises(ReplicationError):
+            stg.flush()
+        restarted = self.make_storage(self.remote)
+        restarted.flush()
+        self.assertEqual(self.remote.load('test/a', format='joblib'), 1)
+        self.assertEqual(restarted.pending(), [])
+
+    def test_local_objects_are_uploaded_without_a_copy(self):
+        with mock.patch.object(self.stg.local, 'load', side_effect=AssertionError("copied")):
+            self.stg.save('test/a', {'a': 1}, format='joblib')
+            self.stg.flush()
+        self.assertEqual(self.remote.load('test/a', format='joblib'), {'a': 1})
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir.name, '.ruigi-tmp')), [])
+
+    def test_reads_fall_back_to_remote(self):
+        self.remote.save('test/remote_only', 2, format='joblib')
+        self.assertTrue(self.stg.exists('test/remote_only'))
+        self.assertEqual(self.stg.load('test/remote_only', format='joblib'), 2)
+
+    def test_delete_removes_both_tiers(self):
+        self.stg.save('test/a', 1, format='joblib')
+        self.stg.flush()
+        self.stg.delete('test/a')
+        self.assertFalse(self.stg.exists('test/a'))
+        self.assertFalse(self.remote.exists('test/a'))
+        self.assertEqual(os.listdir(self.tmp_dir.name).count('.ruigi-replication.sqlite'), 1)
+        self.assertEqual(list(self.stg.list()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
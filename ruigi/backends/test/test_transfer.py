@@ -0,0 +1,33 @@
+import os
+import unittest
+from io import BytesIO
+from ..transfer import TransferSettings, parallel_download
+
+
+class TestTransfer(unittest.TestCase):
+
+    def test_parts(self):
+        settings = TransferSettings(part_size=10, multipart_threshold=10)
+        self.assertEqual(settings.parts(25), [(0, 10), (10, 20), (20, 25)])
+        self.assertTrue(settings.is_multipart(10))
+        self.assertFalse(settings.is_multipart(9))
+        self.assertFalse(TransferSettings(max_concurrency=1).is_multipart(2 ** 40))
+
+    def test_parallel_download(self):
+        data = os.urandom(1000)
+        requests = []
+
+        def read_range(start, end):
+            requests.append((start, end))
+            return data[start:end]
+
+        buffer = BytesIO(b'header')
+        buffer.seek(0, os.SEEK_END)
+        settings = TransferSettings(part_size=64, max_concurrency=4)
+        self.assertEqual(parallel_download(read_range, len(data), buffer, settings), 1000)
+        self.assertEqual(buffer.getvalue(), b'header' + data)
+        self.assertEqual(len(requests), 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
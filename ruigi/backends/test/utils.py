@@ -1,7 +1,55 @@
 import unittest
 import os
-from .. import adls_gen1
-from pandas.util import testing as pd_test
+import time
+import random
+import threading
+import numpy as np
+import pandas as pd
+from pandas import testing as pd_test
+from ..memory import MemoryStorage
+
+
+def make_dataframe(rows=30):
+    """ DataFrame of random floats with a string index."""
+    return pd.DataFrame(np.random.randn(rows, 4), columns=list('ABCD'),
+                        index=[f'row_{i}' for i in range(rows)])
+
+
+class FaultyStorage(MemoryStorage):
+    """ MemoryStorage injecting network faults below the retry layer.
+
+    Every request to the underlying dict fails with `ConnectionError` with
+    probability `failure_rate`, and takes `slow_latency` seconds instead of
+    `latency` with probability `slow_rate`.
+    """
+
+    def __init__(self, failure_rate=0., latency=0., slow_rate=0., slow_latency=0.,
+                 seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def _fault(self):
+        with self._random_lock:
+            self.requests += 1
+            fail = self._random.random() < self.failure_rate
+            slow = self._random.random() < self.slow_rate
+        time.sleep(self.slow_latency if slow else self.latency)
+        if fail:
+            raise ConnectionError("injected failure")
+
+    def _get(self, name):
+        self._fault()
+        return super()._get(name)
+
+    def _put(self, name, data):
+        self._fault()
+        super()._put(name, data)
 
 
 class StorageTest():
@@ -29,7 +77,7 @@ class StorageTest():
     def test_upload_and_download_pickle(self):
         remote_file_path = self.get_base_test_path() + '/TEST_REMOTE_FILE'
 
-        df = pd_test.makeDataFrame()
+        df = make_dataframe()
         stg = self.get_storage()
         try:
             stg.save(remote_file_path, df, format='pickle')
@@ -42,7 +90,7 @@ class StorageTest():
     def test_upload_and_download_parquet(self):
         remote_file_path = self.get_base_test_path() + '/TEST_REMOTE_FILE'
 
-        df = pd_test.makeDataFrame()
+        df = make_dataframe()
         stg = self.get_storage()
         try:
             stg.save(remote_file_path, df, format='parquet')
@@ -53,6 +101,65 @@ class StorageTest():
         finally:
             stg.delete(remote_file_path)
 
+    def test_upload_writer_and_download_file(self):
+        remote_file_path = self.get_base_test_path() + '/TEST_REMOTE_FILE'
+
+        data = os.urandom(1000)
+        stg = self.get_storage()
+        try:
+            stg.save(remote_file_path, lambda f: f.write(data), format='writer')
+            local_file_path = stg.load(remote_file_path, format='file')
+            with open(local_file_path, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            os.remove(local_file_path)
+        finally:
+            stg.delete(remote_file_path)
+
+    def test_list(self):
+        base = self.get_base_test_path() + '/TEST_LIST/'
+        names = [base + 'a/1', base + 'a/2', base + 'b/1']
+        stg = self.get_storage()
+        try:
+            for name in names:
+                stg.save(name, name, format='joblib')
+            self.assertEqual(sorted(stg.list(base + 'a/')), names[:2])
+            self.assertEqual(sorted(stg.list(base)), names)
+            self.assertEqual(list(stg.list(base + 'c/')), [])
+        finally:
+            stg.delete_many(names)
+
+    def test_read_range(self):
+        remote_file_path = self.get_base_test_path() + '/TEST_RANGE'
+        data = bytes(range(256))
+        local_file_path = 'TEST_RANGE_FILE'
+        stg = self.get_storage()
+        try:
+            with open(local_file_path, 'wb') as fp:
+                fp.write(data)
+            stg.save(remote_file_path, local_file_path, format='file')
+            self.assertEqual(stg.size(remote_file_path), 256)
+            self.assertEqual(stg.read_range(remote_file_path, 10, 20), data[10:20])
+        finally:
+            os.remove(local_file_path)
+            stg.delete(remote_file_path)
+
+    def test_batch_operations(self):
+        base = self.get_base_test_path() + '/TEST_BATCH_'
+        items = {base + str(i): {'i': i} for i in range(5)}
+        stg = self.get_storage()
+        try:
+            results = stg.save_many(items, format='joblib')
+            self.assertTrue(all(r.error is None for r in results))
+            results = stg.exists_many(list(items) + [base + 'missing'])
+            self.assertEqual([r.value for r in results], [True] * 5 + [False])
+            results = stg.load_many(list(items) + [base + 'missing'], format='joblib')
+            self.assertEqual([r.value for r in results[:5]], list(items.values()))
+            self.assertIsNotNone(results[5].error)
+        finally:
+            results = stg.delete_many(list(items))
+        self.assertTrue(all(r.error is None for r in results))
+        self.assertFalse(any(r.value for r in stg.exists_many(list(items))))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,280 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait
+from .batch import BatchMixin
+from .local import LocalStorage
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS replication (
+    name TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    owner INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL
+);
+"""
+
+
+class ReplicationError(IOError):
+    """ Raised by :py:meth:`TieredStorage.flush` when objects could not be
+    copied to the remote tier. `names` lists them."""
+
+    def __init__(self, message, names):
+        super().__init__(message)
+        self.names = names
+
+
+class TieredStorage(BatchMixin):
+    """ Storage writing to a fast local tier and replicating to a remote one.
+
+    `save` returns as soon as the object is in the local tier, so targets are
+    complete and loadable on this machine right away. Objects are then copied
+    to the remote tier by background threads. Pending copies are kept in a
+    SQLite queue next to the local data, so they survive crashes and are
+    resumed by the next :py:meth:`flush`, from any process using the same
+    local tier.
+
+    Reads prefer the local tier and fall back to the remote one, which is what
+    other machines see. Call :py:meth:`flush` before relying on the remote
+    tier, e.g. at the end of a pipeline; `Pipe.run` does it.
+
+    Args:
+        local: `obj`
+            Local storage, usually a :py:class:`ruigi.backends.local.LocalStorage`.
+        remote: `obj`
+            Any ruigi storage, e.g. a :py:class:`ruigi.backends.aws.S3Storage`.
+        queue_path: `str` default `None`
+            Path of the SQLite queue. Defaults to `<local.root>/.ruigi-replication.sqlite`.
+        replication_workers: `int` default 4
+            Number of concurrent copies to the remote tier.
+        max_attempts: `int` default 5
+            Attempts per object before giving up until the next `flush`.
+        backoff: `float` default 1
+            Seconds to wait after the first failed attempt, doubled on every retry.
+    """
+
+    def __init__(self, local, remote, queue_path=None, replication_workers=4,
+                 max_attempts=5, backoff=1.):
+        self.local = local
+        self.remote = remote
+        if queue_path is None:
+            queue_path = os.path.join(local.root, '.ruigi-replication.sqlite')
+        self.queue_path = queue_path
+        self.replication_workers = replication_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.queue_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _state(self):
+        # Threads and in-flight copies belong to the process that started them.
+        pid = os.getpid()
+        state = self.__dict__.get('_replication_state')
+        if state is None or state['pid'] != pid:
+            state = {'pid': pid,
+                     'pool': ThreadPoolExecutor(self.replication_workers,
+                                                thread_name_prefix='ruigi-replication'),
+                     'futures': {},
+                     'locks': {},
+                     'lock': threading.Lock()}
+            self._replication_state = state
+        return state
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('_replication_state', '_batch_pool', '_batch_pool_pid'):
+            state.pop(key, None)
+        return state
+
+    def _enqueue(self, name):
+        pid = os.getpid()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO replication (name, seq, owner, attempts, updated_at) "
+                "VALUES (?, 1, ?, 0, ?) ON CONFLICT(name) DO UPDATE SET "
+                "seq = seq + 1, owner = excluded.owner, attempts = 0, error = NULL, "
+                "updated_at = excluded.updated_at", (name, pid, time.time()))
+            seq, = conn.execute("SELECT seq FROM replication WHERE name = ?",
+                                (name,)).fetchone()
+        self._submit(name, seq)
+
+    def _submit(self, name, seq):
+        state = self._state()
+        with state['lock']:
+            future = state['pool'].submit(self._replicate, name, seq)
+            state['futures'][(name, seq)] = future
+        future.add_done_callback(lambda _: state['futures'].pop((name, seq), None))
+
+    def _name_lock(self, name):
+        state = self._state()
+        with state['lock']:
+            return state['locks'].setdefault(name, threading.Lock())
+
+    @contextmanager
+    def _local_file(self, name):
+        # A LocalStorage object is uploaded from its own file rather than
+        # copied to the staging area first.
+        if isinstance(self.local, LocalStorage):
+            with self.local.linked(name) as local_file_name:
+                yield local_file_name
+            return
+        local_file_name = self.local.load(name, format='file')
+        try:
+            yield local_file_name
+        finally:
+            os.remove(local_file_name)
+
+    def _replicate(self, name, seq):
+        # Copies of the same name are serialized, so an older copy can never
+        # overwrite a newer one in the remote tier.
+        with self._name_lock(name):
+            for attempt in range(self.max_attempts):
+                with self._connect() as conn:
+                    row = conn.execute("SELECT seq FROM replication WHERE name = ?",
+                                       (name,)).fetchone()
+                if row is None or row[0] != seq:
+                    return  # deleted or superseded by a newer save
+                try:
+                    with self._local_file(name) as local_file_name:
+                        self.remote.save(name, local_file_name, format='file')
+                except Exception as e:
+                    logger.warning(f"Replication of {name} failed "
+                                   f"(attempt {attempt + 1}/{self.max_attempts}): {e}")
+                    with self._connect() as conn:
+                        conn.execute("UPDATE replication SET attempts = attempts + 1, "
+                                     "error = ?, updated_at = ? WHERE name = ? AND seq = ?",
+                                     (repr(e), time.time(), name, seq))
+                    if attempt + 1 < self.max_attempts:
+                        time.sleep(self.backoff * 2 ** attempt)
+                else:
+                    with self._connect() as conn:
+                        conn.execute("DELETE FROM replication WHERE name = ? AND seq = ?",
+                                     (name, seq))
+                    return
+
+    def _resume(self, retry_failed=False):
+        """ Submit queued objects no live process is replicating, e.g. left
+        by a crashed run or by a luigi worker process that already exited."""
+        pid = os.getpid()
+        in_flight = set(self._state()['futures'])
+        with self._connect() as conn:
+            rows = conn.execute("SELECT name, seq, owner, attempts FROM replication").fetchall()
+        for name, seq, owner, attempts in rows:
+            if (name, seq) in in_flight:
+                continue
+            if owner != pid and owner is not None and _is_alive(owner):
+                continue
+            if attempts >= self.max_attempts and not retry_failed:
+                continue
+            with self._connect() as conn:
+                claimed = conn.execute(
+                    "UPDATE replication SET owner = ?, attempts = 0 "
+                    "WHERE name = ? AND seq = ? AND owner IS ?",
+                    (pid, name, seq, owner)).rowcount
+            if claimed:
+                self._submit(name, seq)
+
+    def pending(self):
+        """ Returns the names of objects not yet copied to the remote tier."""
+        with self._connect() as conn:
+            return [name for name, in conn.execute("SELECT name FROM replication")]
+
+    def flush(self, timeout=None):
+        """ Block until every queued object is in the remote tier.
+
+        Objects left by other processes that are no longer running, and
+        objects that failed all their attempts, are retried.
+
+        Raises:
+            ReplicationError: if some objects could not be replicated.
+            TimeoutError: if `timeout` seconds passed first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._resume(retry_failed=True)
+        while True:
+            futures = list(self._state()['futures'].values())
+            if not futures:
+                break
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            _, not_done = wait(futures, timeout=remaining)
+            if not_done:
+                raise TimeoutError(f"{len(not_done)} objects still replicating")
+        with self._connect() as conn:
+            failed = conn.execute("SELECT name, error FROM replication WHERE owner = ? "
+                                  "AND attempts >= ?",
+                                  (os.getpid(), self.max_attempts)).fetchall()
+        if failed:
+            names = [name for name, _ in failed]
+            raise ReplicationError(f"{len(failed)} objects could not be replicated, "
+                                   f"e.g. {failed[0][0]}: {failed[0][1]}", names)
+
+    def save(self, name, obj, format='pickle', chunk_size=None):
+        """ Save `obj` to the local tier and queue its copy to the remote tier.
+        See the storage `save` methods for the arguments."""
+        self.local.save(name, obj, format=format, chunk_size=chunk_size)
+        self._enqueue(name)
+
+    def load(self, name, format='pickle', columns=None, chunk_size=None):
+        """ Load from the local tier if the object is there, otherwise from
+        the remote tier."""
+        try:
+            return self.local.load(name, format=format, columns=columns, chunk_size=chunk_size)
+        except FileNotFoundError:
+            return self.remote.load(name, format=format, columns=columns, chunk_size=chunk_size)
+
+    def size(self, name):
+        try:
+            return self.local.size(name)
+        except FileNotFoundError:
+            return self.remote.size(name)
+
+    def read_range(self, name, start, end):
+        if self.local.exists(name):
+            return self.local.read_range(name, start, end)
+        return self.remote.read_range(name, start, end)
+
+    def list(self, prefix=''):
+        """ Yields the names of files starting with `prefix` in either tier."""
+        seen = set()
+        for name in self.local.list(prefix):
+            seen.add(name)
+            yield name
+        for name in self.remote.list(prefix):
+            if name not in seen:
+                yield name
+
+    def exists(self, name):
+        return self.local.exists(name) or self.remote.exists(name)
+
+    def delete(self, name):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM replication WHERE name = ?", (name,))
+        with self._name_lock(name):
+            self.local.delete(name)
+            self.remote.delete(name)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics
+
+MB = 2 ** 20
+
+
+class TransferSettings:
+    """ Chunked, parallel transfer settings shared by all storages.
+
+    Objects at least `multipart_threshold` bytes long are transferred in parts
+    of `part_size` bytes, with up to `max_concurrency` parts in flight.
+
+    Args:
+        part_size: `int` default 64 MB
+            Size in bytes of each part. GCS and S3 require at least 5 MB.
+        max_concurrency: `int` default 8
+            Maximum number of parts transferred at the same time.
+        multipart_threshold: `int` default 64 MB
+            Objects smaller than this are transferred in a single request.
+        stream_parts: `int` default 2
+            Maximum number of parts kept in memory by uploads of objects
+            serialized while they are uploaded. It bounds their memory to
+            `stream_parts * part_size` bytes, whatever the object size.
+    """
+
+    def __init__(self, part_size=64 * MB, max_concurrency=8, multipart_threshold=64 * MB,
+                 stream_parts=2):
+        if part_size <= 0 or max_concurrency <= 0 or stream_parts <= 0:
+            raise ValueError("part_size, max_concurrency and stream_parts must be positive")
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.multipart_threshold = multipart_threshold
+        self.stream_parts = stream_parts
+
+    def is_multipart(self, size):
+        return size is not None and size >= self.multipart_threshold and self.max_concurrency > 1
+
+    def parts(self, size):
+        """ Returns the list of (start, end) byte ranges of an object of `size` bytes."""
+        return [(start, min(start + self.part_size, size))
+                for start in range(0, size, self.part_size)]
+
+    def __repr__(self):
+        return (f"TransferSettings(part_size={self.part_size}, "
+                f"max_concurrency={self.max_concurrency}, "
+                f"multipart_threshold={self.multipart_threshold}, "
+                f"stream_parts={self.stream_parts})")
+
+
+def parallel_download(read_range, size, fileobj, settings):
+    """ Download an object into `fileobj` with concurrent range requests.
+
+    Args:
+        read_range: `function`
+            read_range(start, end) returns the bytes [start, end) of the object.
+        size: `int`
+            Size of the object in bytes.
+        fileobj: seekable binary file object opened for writing.
+        settings: :py:class:`TransferSettings`
+
+    Returns: `int`
+        Number of bytes written.
+    """
+    parts = settings.parts(size)
+    base = fileobj.tell()
+    # Retries of the parts count against the operation downloading them.
+    read_range = metrics.bind(read_range)
+    with ThreadPoolExecutor(max_workers=min(settings.max_concurrency, len(parts) or 1)) as pool:
+        # Parts are written in order while the next ones are being fetched.
+        # At most max_concurrency parts are kept in memory.
+        pending = []
+        for start, end in parts:
+            pending.append((start, pool.submit(read_range, start, end)))
+            if len(pending) >= settings.max_concurrency:
+                _write_part(fileobj, base, *pending.pop(0))
+        for start, future in pending:
+            _write_part(fileobj, base, start, future)
+    fileobj.seek(base + size)
+    return size
+
+
+def _write_part(fileobj, base, start, future):
+    fileobj.seek(base + start)
+    fileobj.write(future.result())
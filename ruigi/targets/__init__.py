@@ -1,6 +1,7 @@
 from .targets import (
     PickleTarget,
     DummyTarget,
+    DuckDBTarget,
     CloudTarget,
     FileTarget,
     JsonTarget,
@@ -8,4 +9,7 @@ from .targets import (
     LocalTarget,
     ParquetTarget,
     PytorchTarget,
+    TensorArchiveTarget,
 )
+
+from .manifest import TargetManifest
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+
+def compact_dataframe(df, float_tolerance=None, category_ratio=0.5):
+    """ Returns a copy of `df` using the smallest dtypes that keep its values.
+
+    1. Integer columns are downcast to the smallest signed integer type
+       holding them. Unsigned types are avoided, since arithmetic on them
+       silently wraps around, e.g. when taking differences.
+    2. float64 columns are cast to float32 only if `float_tolerance` is given
+       and every value is kept within this relative tolerance.
+    3. String columns whose ratio of unique values is at most `category_ratio`
+       become categorical, i.e. dictionary encoded.
+
+    Args:
+        df: `pd.DataFrame`
+        float_tolerance: `float` default `None`
+            Maximum relative error accepted when casting floats. Floats are not
+            changed if None.
+        category_ratio: `float` default `0.5`
+            Maximum number of unique values over number of rows for a string
+            column to become categorical. Use 0 to disable.
+
+    Returns: (`pd.DataFrame`, `dict`)
+        The compacted DataFrame and a report with the applied schema
+        {column: [old dtype, new dtype]} and the in-memory size in bytes
+        before and after, as given by `DataFrame.memory_usage(deep=True)`.
+        The size of the serialized file is not measured: it depends on the
+        format and its compression.
+    """
+    bytes_before = int(df.memory_usage(deep=True).sum())
+    columns = {}
+    schema = {}
+    for name, col in df.items():
+        new_col = _compact_column(col, float_tolerance, category_ratio)
+        if new_col.dtype != col.dtype:
+            schema[name] = [str(col.dtype), str(new_col.dtype)]
+        columns[name] = new_col
+    compacted = pd.DataFrame(columns, index=df.index)
+    compacted.columns = df.columns
+    bytes_after = int(compacted.memory_usage(deep=True).sum())
+    report = dict(schema=schema, bytes_before=bytes_before,
+                  bytes_after=bytes_after, bytes_saved=bytes_before - bytes_after)
+    return compacted, report
+
+
+def _compact_column(col, float_tolerance, category_ratio):
+    if pd.api.types.is_bool_dtype(col) or isinstance(col.dtype, pd.CategoricalDtype):
+        return col
+    if pd.api.types.is_integer_dtype(col) and col.dtype.kind in 'iu':
+        return pd.to_numeric(col, downcast='integer') if len(col) else col
+    if col.dtype == np.float64 and float_tolerance is not None:
+        casted = col.astype(np.float32)
+        with np.errstate(over='ignore', invalid='ignore'):
+            kept = np.allclose(col.to_numpy(), casted.to_numpy(dtype=np.float64),
+                               rtol=float_tolerance, atol=0, equal_nan=True)
+        return casted if kept else col
+    if _is_string_column(col) and category_ratio > 0 and len(col):
+        if col.nunique(dropna=True) / len(col) <= category_ratio:
+            return col.astype('category')
+    return col
+
+
+def _is_string_column(col):
+    if col.dtype == object:
+        return pd.api.types.infer_dtype(col, skipna=True) == 'string'
+    return pd.api.types.is_string_dtype(col)
@@ -0,0 +1,61 @@
+""" Content digests of dumped targets, used to skip uploads of unchanged content.
+
+xxhash is used when installed, since it hashes several GB/s; otherwise
+blake2b from the standard library. Digests are prefixed with the algorithm
+name, so digests computed with different algorithms never match.
+"""
+import hashlib
+
+CHUNK_SIZE = 2 ** 20
+
+
+def new_hasher():
+    """ Returns a (name, hasher) tuple with the fastest available algorithm."""
+    try:
+        import xxhash
+        return 'xxh3_128', xxhash.xxh3_128()
+    except ImportError:
+        return 'blake2b', hashlib.blake2b(digest_size=16)
+
+
+class HashingWriter:
+    """ Binary file object wrapper hashing everything written through it.
+
+    Args:
+        fileobj: binary file object opened for writing, or None to only
+            compute the digest of the data.
+    """
+
+    def __init__(self, fileobj=None):
+        self.fileobj = fileobj
+        self.algorithm, self._hasher = new_hasher()
+        self._size = 0
+
+    def write(self, data):
+        self._hasher.update(data)
+        self._size += len(data)
+        if self.fileobj is None:
+            return len(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        if self.fileobj is not None:
+            self.fileobj.flush()
+
+    def tell(self):
+        if self.fileobj is None:
+            return self._size
+        return self.fileobj.tell()
+
+    def digest(self):
+        """ Returns the digest of the bytes written so far, e.g. `blake2b:<hex>`."""
+        return f"{self.algorithm}:{self._hasher.hexdigest()}"
+
+
+def file_digest(path):
+    """ Returns the digest of a local file, in the format of :py:meth:`HashingWriter.digest`."""
+    algorithm, hasher = new_hasher()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return f"{algorithm}:{hasher.hexdigest()}"
@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+from contextlib import contextmanager
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (
+    path TEXT PRIMARY KEY,
+    task_id TEXT,
+    task_family TEXT,
+    hash_version TEXT,
+    version TEXT,
+    metadata BLOB,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS ix_targets_task_family ON targets (task_family);
+CREATE INDEX IF NOT EXISTS ix_targets_hash_version ON targets (hash_version);
+CREATE TABLE IF NOT EXISTS target_params (
+    path TEXT,
+    name TEXT,
+    value TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE INDEX IF NOT EXISTS ix_target_params_name_value ON target_params (name, value);
+"""
+
+
+def _encode_value(value):
+    """Canonical text representation of a parameter value, used for indexing."""
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+class TargetManifest:
+    """ Single index holding the metadata of all targets of a pipeline.
+
+    Metadata is kept in a local SQLite file, with indexes by task family,
+    hash_version and parameter values. If a storage is given, the whole
+    manifest is synced with it as a single object using :py:meth:`pull` and
+    :py:meth:`push`, instead of one `.metadata` object per target.
+
+    Both merge the local and remote manifests entry by entry, keeping the most
+    recently updated one, so pipelines sharing a manifest do not drop each
+    other's entries. Removed targets are kept as entries without metadata for
+    the same reason. Two pushes at the same time can still lose the entries
+    of one of them until it pushes again.
+
+    To enable it for all tasks, assign it to `Task._manifest`, in the same way
+    as `Task._storage`.
+
+    Args:
+        path: `str` default `None`
+            Local path of the SQLite file. Defaults to `<TARGET_DIR>/ruigi.manifest.sqlite`.
+        storage: `obj` default `None`
+            Any ruigi storage. If given, the manifest can be synced with it.
+        remote_name: `str` default `ruigi.manifest.sqlite`
+            Object name of the manifest in `storage`.
+    """
+
+    DEFAULT_NAME = 'ruigi.manifest.sqlite'
+
+    def __init__(self, path=None, storage=None, remote_name=None):
+        if path is None:
+            from ruigi.task import Task
+            path = os.path.join(Task.TARGET_DIR, self.DEFAULT_NAME)
+        self.path = path
+        self.storage = storage
+        self.remote_name = remote_name or self.DEFAULT_NAME
+        self._init_db()
+
+    def _init_db(self):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # One connection per operation keeps the manifest safe to use from
+        # forked luigi workers.
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record(self, path, metadata: dict, task_id=None, task_family=None):
+        """ Insert or replace the metadata of the target saved at `path`."""
+        assert isinstance(metadata, dict)
+        params = metadata.get('params') or {}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, task_id, task_family,
+                 _none_or_str(metadata.get('hash_version')),
+                 _none_or_str(metadata.get('version')),
+                 pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL),
+                 time.time()))
+            conn.execute("DELETE FROM target_params WHERE path = ?", (path,))
+            conn.executemany(
+                "INSERT INTO target_params VALUES (?, ?, ?)",
+                [(path, k, _encode_value(v)) for k, v in params.items()])
+
+    def get(self, path):
+        """ Returns the metadata of the target at `path` or None if not recorded."""
+        return self.get_many([path]).get(path)
+
+    def get_many(self, paths):
+        """ Returns a dict {path: metadata} for all recorded targets in `paths`."""
+        paths = list(paths)
+        result = {}
+        # Keep below SQLite's maximum number of host parameters.
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT path, metadata FROM targets "
+                    "WHERE metadata IS NOT NULL AND path IN ({})".format(
+                        ','.join('?' * len(chunk))),
+                    chunk).fetchall()
+            result.update({p: pickle.loads(m) for p, m in rows})
+        return result
+
+    def query(self, task_family=None, hash_version=None, version=None, params=None):
+        """ Returns a dict {path: metadata} of targets matching all given filters.
+
+        Args:
+            task_family: `str` default `None`
+            hash_version: `int` default `None`
+            version: `str` default `None`
+            params: `dict` default `None`
+                Parameters values that targets must match.
+        """
+        clauses, args = ["t.metadata IS NOT NULL"], []
+        for column, value in (('task_family', task_family),
+                              ('hash_version', hash_version),
+                              ('version', version)):
+            if value is not None:
+                clauses.append(f"t.{column} = ?")
+                args.append(str(value))
+        for name, value in (params or {}).items():
+            clauses.append("t.path IN (SELECT path FROM target_params "
+                           "WHERE name = ? AND value = ?)")
+            args.extend([name, _encode_value(value)])
+
+        sql = "SELECT t.path, t.metadata FROM targets t WHERE " + " AND ".join(clauses)
+        with self._connect() as conn:
+            rows = conn.execute(sql, args).fetchall()
+        return {p: pickle.loads(m) for p, m in rows}
+
+    def remove(self, path):
+        """ Forget the metadata of the target at `path`. The entry is kept
+        without metadata, so that merges do not bring it back."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO targets (path, updated_at) VALUES (?, ?)",
+                (path, time.time()))
+            conn.execute("DELETE FROM target_params WHERE path = ?", (path,))
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM targets WHERE metadata IS NOT NULL").fetchone()[0]
+
+    def merge(self, path):
+        """ Merge the manifest saved at `path` into this one. For targets
+        recorded in both, the most recently updated entry is kept."""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("ATTACH DATABASE ? AS other", (path,))
+            conn.executescript("""
+                BEGIN;
+                CREATE TEMP TABLE newer AS
+                    SELECT o.path FROM other.targets o
+                    LEFT JOIN main.targets t ON t.path = o.path
+                    WHERE t.path IS NULL OR o.updated_at > t.updated_at;
+                INSERT OR REPLACE INTO main.targets
+                    SELECT * FROM other.targets WHERE path IN newer;
+                DELETE FROM main.target_params WHERE path IN newer;
+                INSERT INTO main.target_params
+                    SELECT * FROM other.target_params WHERE path IN newer;
+                DROP TABLE newer;
+                COMMIT;
+                """)
+            conn.execute("DETACH DATABASE other")
+        finally:
+            conn.close()
+
+    def pull(self):
+        """ Merge the manifest found in storage, if any, into the local one."""
+        assert self.storage is not None, "Manifest has no storage to pull from."
+        if not self.storage.exists(self.remote_name):
+            return False
+        local_copy = self.storage.load(self.remote_name, format='file')
+        try:
+            self.merge(local_copy)
+        finally:
+            os.remove(local_copy)
+        return True
+
+    def push(self):
+        """ Merge the manifest found in storage into the local one, then
+        upload the result as a single object."""
+        assert self.storage is not None, "Manifest has no storage to push to."
+        self.pull()
+        self.storage.save(self.remote_name, self.path, format='file')
+
+
+def _none_or_str(value):
+    return None if value is None else str(value)
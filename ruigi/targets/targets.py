@@ -3,7 +3,11 @@ import os
 import pandas as pd
 import joblib
 import warnings
+from contextlib import contextmanager
 from luigi.task import flatten
+from .tensor_archive import TensorArchive, write_archive
+from .compaction import compact_dataframe
+from .digest import HashingWriter, file_digest
 
 
 class LocalTarget(luigi.LocalTarget):
@@ -15,6 +19,9 @@ class LocalTarget(luigi.LocalTarget):
         namespace = task.get_task_namespace()
         self.task = task  # keeping task object in target object will make
         # load_inputs_params easiers
+        self.manifest = getattr(task, '_manifest', None)
+        # information gathered while dumping, to be kept in the target metadata
+        self.dump_info = {}
         if path is None:
             file_id = task._file_id()
             ext = '.' + self.FILE_EXT
@@ -24,15 +31,29 @@ class LocalTarget(luigi.LocalTarget):
         super().__init__(path=path, *args, **kwargs)
 
     def dump_metadata(self, metadata: dict,  *args, **kwargs):
-        warnings.warn("dump_metadata not implemented in LocalTarget")
+        if self.manifest is not None:
+            self._record_manifest(metadata)
+        else:
+            warnings.warn("dump_metadata not implemented in LocalTarget")
 
     def load_metadata(self, *args, **kwargs):
         """Should return a dict."""
+        if self.manifest is not None:
+            metadata = self.manifest.get(self.path)
+            if metadata is not None:
+                return metadata
         warnings.warn("load_metadata not implemented in LocalTarget")
         return {}
 
     def remove_metadata(self, *args, **kwargs):
-        warnings.warn("remove_metadata not implemented in LocalTarget")
+        if self.manifest is not None:
+            self.manifest.remove(self.path)
+        else:
+            warnings.warn("remove_metadata not implemented in LocalTarget")
+
+    def _record_manifest(self, metadata: dict):
+        self.manifest.record(self.path, metadata, task_id=self.task.task_id,
+                             task_family=self.task.get_task_family())
 
     def get_metadata_path(self, *args, **kwargs):
         return f"{self.path}.metadata"
@@ -41,7 +62,25 @@ class LocalTarget(luigi.LocalTarget):
 class CloudTarget(LocalTarget):
     """ A target that works both locally and on any storage defined in Task._storage
 
+    DataFrame targets (pickle and parquet) can compact DataFrames before
+    dumping them by setting `compact = True` in a subclass. See
+    :py:func:`ruigi.targets.compaction.compact_dataframe` for the meaning of
+    `compact_float_tolerance` and `compact_category_ratio`. The applied schema
+    and the in-memory bytes saved are kept in the target metadata under
+    `target.compaction`. :py:class:`JsonTarget` ignores `compact`, since JSON
+    does not keep dtypes.
+
+    When dumping to a storage, a digest of the serialized content is kept in
+    the target metadata under `target.digest`. If a rerun produces the same
+    content, and the object is still in the storage, the upload is skipped and
+    only the metadata is written again. Set `skip_unchanged = False` in a
+    subclass to always upload. It is disabled by default for
+    :py:class:`PickleTarget`.
     """
+    compact = False
+    skip_unchanged = True
+    compact_float_tolerance = None
+    compact_category_ratio = 0.5
 
     def __init__(self, task, *args, **kwargs):
         super().__init__(task, *args, **kwargs)
@@ -67,12 +106,19 @@ class CloudTarget(LocalTarget):
             assert isinstance(metadata, dict)
             self.storage.save(self.get_metadata_path(),
                               metadata, format='joblib',)
+            if self.manifest is not None:
+                self._record_manifest(metadata)
         else:
             super().dump_metadata(metadata, *args, **kwargs)
 
     def load_metadata(self, *args, **kwargs):
         """Should return a dict."""
         if self.has_storage:
+            if self.manifest is not None:
+                # Avoid a remote round trip when the manifest knows this target.
+                metadata = self.manifest.get(self.path)
+                if metadata is not None:
+                    return metadata
             metadata = self.storage.load(
                 self.get_metadata_path(), format='joblib',)
             assert isinstance(
@@ -84,8 +130,10 @@ class CloudTarget(LocalTarget):
     def remove_metadata(self, *args, **kwargs):
         if self.has_storage:
             self.storage.delete(self.get_metadata_path())
+            if self.manifest is not None:
+                self.manifest.remove(self.path)
         else:
-            return super().load_metadata(*args, **kwargs)
+            return super().remove_metadata(*args, **kwargs)
 
     def load(self, *args, **kwargs):
         if self.has_storage:
@@ -122,9 +170,55 @@ class CloudTarget(LocalTarget):
     def remove_storage(self, *args, **kwargs):
         self.storage.delete(self.path)
 
+    def _compact(self, obj):
+        """ Returns obj compacted if compaction is enabled and obj is a DataFrame."""
+        if not self.compact or not isinstance(obj, pd.DataFrame):
+            return obj
+        obj, report = compact_dataframe(
+            obj, float_tolerance=self.compact_float_tolerance,
+            category_ratio=self.compact_category_ratio)
+        self.dump_info['compaction'] = report
+        return obj
+
     def exists_storage(self, *args, **kwargs):
         return self.storage.exists(self.path)
 
+    def _stored_digest(self):
+        """ Returns the digest recorded by the last dump, or None."""
+        try:
+            metadata = self.load_metadata()
+        except Exception:
+            # Missing or unreadable metadata: the content is uploaded.
+            return None
+        return (metadata.get('target') or {}).get('digest')
+
+    def _skip_upload(self, digest):
+        """ Returns True if the storage already holds the content of `digest`.
+        Otherwise the digest recorded by the last dump is dropped before the
+        upload: the metadata is written after it, so an interrupted dump must
+        not leave a digest that does not match the stored object."""
+        self.dump_info.pop('upload_skipped', None)
+        self.dump_info['digest'] = digest
+        stored_digest = self._stored_digest()
+        if digest == stored_digest and self.storage.exists(self.path):
+            self.dump_info['upload_skipped'] = True
+            from ruigi.backends import metrics
+            metrics.increment(self.storage, 'save', 'skipped_uploads')
+            return True
+        if stored_digest is not None:
+            try:
+                self.remove_metadata()
+            except FileNotFoundError:
+                pass
+        return False
+
+    def _save_file(self, local_path, digest=None):
+        """ Upload a local file to `self.path`, unless the storage already
+        holds the same content. `digest` is computed if not given."""
+        if self.skip_unchanged and self._skip_upload(digest or file_digest(local_path)):
+            return
+        self.storage.save(self.path, local_path, format='file')
+
 
 class FileTarget(CloudTarget):
     """
@@ -142,42 +236,146 @@ class FileTarget(CloudTarget):
         return self.storage.load(self.path, format='file')
 
     def dump_storage(self, tempfile_path):
-        self.storage.save(self.path, tempfile_path, format='file',)
+        self._save_file(tempfile_path)
         os.remove(tempfile_path)
 
 
 class PickleTarget(CloudTarget):
+    """
+    Pickles objects with joblib. Objects are uploaded to the storage as they
+    are serialized, without a local copy. Skipping unchanged uploads is opt-in
+    (`skip_unchanged = True` in a subclass), since it serializes every object
+    twice: once to compute its digest, once to upload it.
+    """
     FILE_EXT = 'pkl'
+    skip_unchanged = False
 
     def load_storage(self):
         return self.storage.load(self.path, format='joblib')
 
     def dump_storage(self, function_output):
+        function_output = self._compact(function_output)
+        if self.skip_unchanged:
+            # Serialized once more, to a digest only: objects are still
+            # uploaded without a local copy.
+            writer = HashingWriter()
+            joblib.dump(function_output, writer)
+            if self._skip_upload(writer.digest()):
+                return
         self.storage.save(self.path, function_output, format='joblib')
 
     def load_local(self):
         return joblib.load(self.path)
 
     def dump_local(self, function_output):
+        function_output = self._compact(function_output)
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
         joblib.dump(function_output, self.path)
 
 
 class ParquetTarget(CloudTarget):
+    """
+    Saves a DataFrame as parquet. On dump, a row-group index (row offsets,
+    byte ranges and min/max statistics per row group) is kept in the target
+    metadata under `target.row_groups`.
+
+    Besides the `read_parquet` keyword arguments, `load` accepts `rows`, a
+    slice of row numbers, or `row_groups`, a list of row group numbers. In
+    these cases only the needed row groups are read, with byte-range requests
+    when the storage supports them. Set `row_group_size` to control how many
+    rows each row group holds.
+
+    Dumps to a storage are staged in a local file rather than streamed: the
+    digest used to skip unchanged uploads and the row-group index are read
+    from that file before the upload, so they match the uploaded bytes.
+    """
     FILE_EXT = 'parquet'
+    row_group_size = None
+
+    def load(self, rows=None, row_groups=None, **kwargs):
+        if rows is None and row_groups is None:
+            return super().load(**kwargs)
+        if self.has_storage and hasattr(self.storage, 'read_range'):
+            from ruigi.backends.rangefile import RangeFile
+            source = RangeFile(self.storage, self.path)
+        elif self.has_storage:
+            # No range reads available: fetch the whole object once.
+            source = self.storage.load(self.path, format='file')
+        else:
+            source = self.path
+        return _read_parquet_rows(source, rows=rows, row_groups=row_groups, **kwargs)
 
     def load_storage(self, **kwargs):
         return self.storage.load(self.path, format='parquet', **kwargs)
 
     def dump_storage(self, function_output):
-        self.storage.save(self.path, function_output, format='parquet',)
+        with _staging_file(self.FILE_EXT, self.storage) as local_path:
+            self._write(function_output, local_path)
+            self._save_file(local_path)
 
     def load_local(self, **kwargs):
         return pd.read_parquet(self.path, **kwargs)
 
     def dump_local(self, function_output):
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        function_output.to_parquet(self.path)
+        self._write(function_output, self.path)
+
+    def _write(self, df, path):
+        if not isinstance(df, pd.DataFrame):
+            raise ValueError(f"Object to be saved as parquet must be a "
+                             f"DataFrame. Received a {type(df)}")
+        df = self._compact(df)
+        df.to_parquet(path, row_group_size=self.row_group_size)
+        self.dump_info['row_groups'] = row_group_index(path)
+
+    def row_group_index(self):
+        """ Returns the row-group index recorded on dump, or reads it from the
+        parquet footer if it is not in the metadata."""
+        index = self.load_metadata().get('target', {}).get('row_groups')
+        if index is not None:
+            return index
+        if self.has_storage and hasattr(self.storage, 'read_range'):
+            from ruigi.backends.rangefile import RangeFile
+            return row_group_index(RangeFile(self.storage, self.path))
+        return row_group_index(self.path)
+
+
+class DuckDBTarget(CloudTarget):
+    """
+    Saves a DataFrame or a duckdb relation as parquet and loads it back as a
+    lazy duckdb relation. Downstream tasks can compose filters, joins and
+    aggregations on the inputs, e.g. `inputs[0].filter('a > 1').aggregate(...)`,
+    and nothing is read until the result is materialized with `.df()` or
+    returned from `easy_run`. Projections and predicates are pushed down into
+    the parquet file, and returning a relation writes it in a streaming
+    fashion, without holding all rows in memory.
+
+    All relations of a process share one connection, so inputs from different
+    targets can be joined together. Remote files are fetched once to a local
+    file, which is then scanned lazily. That file is kept in the staging area
+    while the loaded relation is alive; keep a reference to it while relations
+    derived from it are used.
+    """
+    FILE_EXT = 'parquet'
+
+    def load_storage(self):
+        local_path = self.storage.load(self.path, format='file')
+        return _pin_staged(self.storage, local_path,
+                           duckdb_connection().read_parquet(local_path))
+
+    def dump_storage(self, function_output):
+        with _staging_file(self.FILE_EXT, self.storage) as local_path:
+            _write_relation(function_output, local_path)
+            self._save_file(local_path)
+
+    def load_local(self):
+        return duckdb_connection().read_parquet(self.path)
+
+    def dump_local(self, function_output):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        _write_relation(function_output, tmp_path)
+        os.replace(tmp_path, self.path)
 
 
 class KerasTarget(CloudTarget):
@@ -189,9 +387,9 @@ class KerasTarget(CloudTarget):
         return load_model(local_path)
 
     def dump_storage(self, model):
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        model.save(self.path)
-        self.storage.save(self.path, self.path, format='file')
+        with _staging_file(self.FILE_EXT, self.storage) as local_path:
+            model.save(local_path)
+            self._save_file(local_path)
 
     def load_local(self):
         from keras.models import load_model
@@ -212,9 +410,9 @@ class PytorchTarget(CloudTarget):
 
     def dump_storage(self, model_state_dict):
         import torch
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        torch.save(model_state_dict, self.path)
-        self.storage.save(self.path, self.path, format='file')
+        with _staging_file(self.FILE_EXT, self.storage) as local_path:
+            torch.save(model_state_dict, local_path)
+            self._save_file(local_path)
 
     def load_local(self):
         import torch
@@ -226,6 +424,60 @@ class PytorchTarget(CloudTarget):
         torch.save(model_state_dict, self.path)
 
 
+class TensorArchiveTarget(CloudTarget):
+    """
+    This target saves a dict of tensors, like a pytorch `state_dict`, as a
+    tensor archive (safetensors layout). Tensors are written one by one from
+    their own buffers, without serializing the whole model in memory, and
+    streamed to the storage without a local copy.
+    Loading returns a lazy :py:class:`ruigi.targets.tensor_archive.TensorArchive`
+    whose tensors are memory mapped on access. Use `modules` to load only some
+    sub-modules and `as_torch` to receive torch tensors, e.g. in
+    `load_input_params`.
+
+    With a storage, the whole archive is first downloaded to the staging area
+    and memory mapped from there: `modules` saves memory, not transfer. The
+    staged file is kept while the returned archive is alive.
+    """
+    FILE_EXT = 'tensors'
+
+    def _open(self, path, modules=None, as_torch=False):
+        archive = TensorArchive(path)
+        if modules is None and not as_torch:
+            return archive
+        return archive.to_dict(modules=modules, as_torch=as_torch)
+
+    def load_storage(self, modules=None, as_torch=False):
+        local_path = self.storage.load(self.path, format='file')
+        loaded = self._open(local_path, modules=modules, as_torch=as_torch)
+        if isinstance(loaded, TensorArchive):
+            # Tensors are memory mapped on access.
+            _pin_staged(self.storage, local_path, loaded)
+        return loaded
+
+    def dump_storage(self, tensors):
+        def write(fileobj):
+            write_archive(fileobj, tensors)
+
+        if self.skip_unchanged:
+            # Hashing reads the tensors once more, without a local copy.
+            writer = HashingWriter()
+            write(writer)
+            if self._skip_upload(writer.digest()):
+                return
+        self.storage.save(self.path, write, format='writer')
+
+    def load_local(self, modules=None, as_torch=False):
+        return self._open(self.path, modules=modules, as_torch=as_torch)
+
+    def dump_local(self, tensors):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            write_archive(f, tensors)
+        os.replace(tmp_path, self.path)
+
+
 class DummyTarget:
 
     def __init__(self, fixed_output=None, *args, **kwargs):
@@ -250,6 +502,15 @@ class DummyTarget:
 class JsonTarget(CloudTarget):
     FILE_EXT = 'json'
 
+    def load_storage(self):
+        local_path = self.storage.load(self.path, format='file')
+        return pd.read_json(local_path)
+
+    def dump_storage(self, function_output):
+        with _staging_file(self.FILE_EXT, self.storage) as local_path:
+            function_output.to_json(local_path)
+            self._save_file(local_path)
+
     def load_local(self):
         return pd.read_json(self.path)
 
@@ -257,3 +518,172 @@ class JsonTarget(CloudTarget):
         # TODO: json only works for dataframe
         os.makedirs(os.path.dirname(self.path), exist_ok=True)
         function_output.to_json(self.path)
+
+
+_DUCKDB_CONNECTIONS = {}
+
+
+def duckdb_connection():
+    """ Returns the duckdb connection of the current process. Connections are
+    not shared with forked luigi workers."""
+    import duckdb
+    pid = os.getpid()
+    if pid not in _DUCKDB_CONNECTIONS:
+        _DUCKDB_CONNECTIONS.clear()
+        _DUCKDB_CONNECTIONS[pid] = duckdb.connect()
+    return _DUCKDB_CONNECTIONS[pid]
+
+
+def _write_relation(obj, path):
+    """ Writes a pandas DataFrame or a duckdb relation to a parquet file."""
+    if isinstance(obj, pd.DataFrame):
+        obj.to_parquet(path)
+    elif hasattr(obj, 'write_parquet'):
+        # duckdb relations are executed and written in a streaming fashion.
+        obj.write_parquet(path)
+    else:
+        raise ValueError(f"Object to be saved must be a DataFrame or a duckdb "
+                         f"relation. Received a {type(obj)}")
+
+
+@contextmanager
+def _staging_file(ext, storage=None):
+    """Yields a unique local path, in the staging area of `storage`, to stage a
+    file before uploading it. The file is removed on exit."""
+    from ruigi.backends.staging import default_staging
+    staging = getattr(storage, 'staging', None) or default_staging()
+    with staging.staged(suffix='.' + ext) as path:
+        yield path
+
+
+def _pin_staged(storage, local_path, owner):
+    """ Keeps `local_path`, staged by `storage`, from being evicted while
+    `owner` is alive. Returns `owner`."""
+    from ruigi.backends.staging import default_staging
+    staging = getattr(storage, 'staging', None) or default_staging()
+    staging.pin(local_path, owner)
+    return owner
+
+
+def row_group_index(source) -> list:
+    """ Returns a list with one dict per row group of a parquet file, with
+    its row offset, number of rows, byte range and per column min/max.
+
+    Args:
+        source: local path or seekable file object of a parquet file.
+    """
+    import pyarrow.parquet as pq
+    return _row_group_index(pq.ParquetFile(source).metadata)
+
+
+def _row_group_index(metadata) -> list:
+    index = []
+    row_offset = 0
+    for i in range(metadata.num_row_groups):
+        rg = metadata.row_group(i)
+        byte_start, byte_end, statistics = None, None, {}
+        for j in range(rg.num_columns):
+            col = rg.column(j)
+            start = col.dictionary_page_offset if col.has_dictionary_page \
+                else col.data_page_offset
+            end = start + col.total_compressed_size
+            byte_start = start if byte_start is None else min(byte_start, start)
+            byte_end = end if byte_end is None else max(byte_end, end)
+            if col.is_stats_set and col.statistics.has_min_max:
+                statistics[col.path_in_schema] = (col.statistics.min,
+                                                  col.statistics.max)
+        index.append(dict(row_group=i, row_offset=row_offset,
+                          num_rows=rg.num_rows, byte_start=byte_start,
+                          byte_end=byte_end, statistics=statistics))
+        row_offset += rg.num_rows
+    return index
+
+
+def _read_parquet_rows(source, rows=None, row_groups=None, columns=None):
+    """ Reads only the row groups needed to answer `rows` or `row_groups`."""
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(source)
+    metadata = parquet_file.metadata
+    offsets = [0]
+    for i in range(metadata.num_row_groups):
+        offsets.append(offsets[-1] + metadata.row_group(i).num_rows)
+
+    step = None
+    if rows is not None:
+        if row_groups is not None:
+            raise ValueError("Use either rows or row_groups, not both.")
+        start, stop, step = rows.indices(metadata.num_rows)
+        if step < 0:
+            raise ValueError("Negative steps are not supported in rows.")
+        row_groups = [i for i in range(metadata.num_row_groups)
+                      if offsets[i] < stop and offsets[i + 1] > start]
+    else:
+        row_groups = sorted(row_groups)
+        start = offsets[row_groups[0]] if row_groups else 0
+
+    if hasattr(source, 'prefetch'):
+        # One range request per row group instead of one per column chunk.
+        source.prefetch(_column_chunk_ranges(parquet_file, row_groups, columns))
+
+    if row_groups:
+        try:
+            table = parquet_file.read_row_groups(row_groups, columns=columns,
+                                                 use_pandas_metadata=True)
+        finally:
+            if hasattr(source, 'release'):
+                source.release()
+    else:
+        table = parquet_file.schema_arrow.empty_table()
+        if columns is not None:
+            table = table.select([c for c in table.column_names if c in columns])
+    first_row = offsets[row_groups[0]] if row_groups else 0
+    if rows is not None:
+        table = table.slice(start - first_row, max(stop - start, 0))
+        first_row = start
+    df = table.to_pandas()
+    df = _restore_range_index(df, table.schema.pandas_metadata, first_row)
+    if step is not None and step > 1:
+        df = df.iloc[::step]
+    return df
+
+
+def _column_chunk_ranges(parquet_file, row_groups, columns=None) -> list:
+    """ Returns the (start, end) byte ranges of the column chunks read from
+    `row_groups`: the chunks of `columns` and of the pandas index, or all
+    chunks if `columns` is None. Adjacent chunks are merged, so reading all
+    columns of a row group is a single range."""
+    metadata = parquet_file.metadata
+    if columns is not None:
+        pandas_metadata = parquet_file.schema_arrow.pandas_metadata or {}
+        columns = set(columns) | {c for c in pandas_metadata.get('index_columns', [])
+                                  if isinstance(c, str)}
+    ranges = []
+    for i in row_groups:
+        rg = metadata.row_group(i)
+        chunks = []
+        for j in range(rg.num_columns):
+            col = rg.column(j)
+            if columns is not None and col.path_in_schema.split('.')[0] not in columns:
+                continue
+            start = col.dictionary_page_offset if col.has_dictionary_page \
+                else col.data_page_offset
+            chunks.append([start, start + col.total_compressed_size])
+        chunks.sort()
+        for chunk in chunks:
+            if ranges and ranges[-1][0] <= chunk[0] <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], chunk[1])
+            else:
+                ranges.append(chunk)
+    return [tuple(r) for r in ranges]
+
+
+def _restore_range_index(df, pandas_metadata, first_row):
+    """ pandas keeps RangeIndex only as metadata; rebuild it for a subset of rows."""
+    index_columns = (pandas_metadata or {}).get('index_columns', [])
+    if len(index_columns) == 1 and isinstance(index_columns[0], dict) \
+            and index_columns[0].get('kind') == 'range':
+        range_index = index_columns[0]
+        start = range_index['start'] + first_row * range_index['step']
+        df.index = pd.RangeIndex(start, start + len(df) * range_index['step'],
+                                 range_index['step'], name=range_index['name'])
+    return df
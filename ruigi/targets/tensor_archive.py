@@ -0,0 +1,170 @@
+"""
+Reader and writer of tensor archives, using the safetensors layout:
+
+    [8 bytes: header size N, little endian u64]
+    [N bytes: JSON header {name: {dtype, shape, data_offsets}, "__metadata__": {}}]
+    [tensors raw bytes]
+
+Tensors are written one at a time straight from their buffers and are read
+back lazily through memory maps, so only the tensors actually used are paged in.
+
+numpy has no bfloat16 type: BF16 tensors are written from torch tensors or
+`ml_dtypes.bfloat16` arrays, and read back as `ml_dtypes.bfloat16` arrays
+when ml_dtypes is installed, otherwise as their raw bits in uint16 arrays.
+"""
+import json
+import struct
+from collections.abc import Mapping
+import numpy as np
+
+_HEADER_SIZE_FORMAT = '<Q'
+_ALIGNMENT = 8
+
+_DTYPES = {
+    'F64': np.float64, 'F32': np.float32, 'F16': np.float16,
+    'I64': np.int64, 'I32': np.int32, 'I16': np.int16, 'I8': np.int8,
+    'U64': np.uint64, 'U32': np.uint32, 'U16': np.uint16, 'U8': np.uint8,
+    'BOOL': np.bool_,
+}
+_DTYPE_CODES = {np.dtype(v): k for k, v in _DTYPES.items()}
+
+
+def _bfloat16():
+    """Returns the numpy bfloat16 type of ml_dtypes, or uint16 to handle the
+    raw bits if ml_dtypes is not installed."""
+    try:
+        import ml_dtypes
+        return ml_dtypes.bfloat16
+    except ImportError:
+        return np.uint16
+
+
+def _to_numpy(tensor):
+    """Returns (C-contiguous numpy array, dtype code) from a numpy array or a
+    torch tensor."""
+    if hasattr(tensor, 'detach'):  # torch.Tensor
+        import torch
+        tensor = tensor.detach().cpu()
+        if tensor.dtype == torch.bfloat16:
+            return np.ascontiguousarray(tensor.view(torch.int16).numpy()), 'BF16'
+        tensor = tensor.numpy()
+    arr = np.ascontiguousarray(tensor)
+    if arr.dtype.name == 'bfloat16':
+        return arr, 'BF16'
+    return arr, _DTYPE_CODES.get(arr.dtype)
+
+
+def write_archive(fileobj, tensors: dict, metadata: dict = None):
+    """ Write `tensors` to a binary file object in the tensor archive layout.
+
+    Args:
+        fileobj: binary file object opened for writing.
+        tensors: `dict`
+            Mapping of names to numpy arrays or torch tensors (e.g. a `state_dict`).
+        metadata: `dict` default `None`
+            Extra string to string metadata to be kept in the header.
+
+    Returns: `int`
+        Number of bytes written.
+    """
+    arrays = {}
+    header = {}
+    offset = 0
+    for name, tensor in tensors.items():
+        arr, code = _to_numpy(tensor)
+        if code is None:
+            raise ValueError(f"Tensor {name} has unsupported dtype {arr.dtype}")
+        arrays[name] = arr
+        header[name] = {
+            'dtype': code,
+            'shape': list(arr.shape),
+            'data_offsets': [offset, offset + arr.nbytes],
+        }
+        offset += arr.nbytes
+    if metadata:
+        header['__metadata__'] = {str(k): str(v) for k, v in metadata.items()}
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    # Pad so that the data section is aligned, as safetensors does.
+    header_bytes += b' ' * (-(len(header_bytes) + 8) % _ALIGNMENT)
+    fileobj.write(struct.pack(_HEADER_SIZE_FORMAT, len(header_bytes)))
+    fileobj.write(header_bytes)
+    for arr in arrays.values():
+        if arr.nbytes:
+            fileobj.write(memoryview(arr.reshape(-1).view(np.uint8)))
+    return 8 + len(header_bytes) + offset
+
+
+def read_header(fileobj):
+    """ Returns (header, data_start) read from a binary file object."""
+    header_size, = struct.unpack(_HEADER_SIZE_FORMAT, fileobj.read(8))
+    header = json.loads(fileobj.read(header_size).decode('utf-8'))
+    return header, 8 + header_size
+
+
+class TensorArchive(Mapping):
+    """ Read-only, lazy mapping over a tensor archive file.
+
+    Each item is a read-only numpy memmap created on access, so opening an
+    archive only reads its header.
+
+    Args:
+        path: `str`
+            Local path of the archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header, self._data_start = read_header(f)
+        self.metadata = header.pop('__metadata__', {})
+        self._header = header
+
+    def __getitem__(self, name):
+        info = self._header[name]
+        begin, end = info['data_offsets']
+        shape = tuple(info['shape'])
+        dtype = _bfloat16() if info['dtype'] == 'BF16' else _DTYPES[info['dtype']]
+        if end == begin:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r',
+                         offset=self._data_start + begin, shape=shape)
+
+    def __iter__(self):
+        return iter(self._header)
+
+    def __len__(self):
+        return len(self._header)
+
+    def select(self, modules):
+        """ Returns the names of tensors that belong to any of the given
+        sub-modules, e.g. `['encoder']` matches `encoder.layer.0.weight`."""
+        if isinstance(modules, str):
+            modules = [modules]
+        return [name for name in self._header
+                if any(name == m or name.startswith(m + '.') for m in modules)]
+
+    def to_dict(self, modules=None, as_torch=False):
+        """ Returns a dict of tensors, optionally restricted to `modules`.
+
+        Args:
+            modules: `list` default `None`
+                Sub-modules to load. All tensors are loaded if None.
+            as_torch: `bool` default `False`
+                If True, returns torch tensors sharing memory with the memmaps.
+        """
+        names = list(self) if modules is None else self.select(modules)
+        tensors = {name: self[name] for name in names}
+        if as_torch:
+            import warnings
+            with warnings.catch_warnings():
+                # memmaps are read-only, torch warns about it.
+                warnings.simplefilter('ignore', UserWarning)
+                tensors = {k: self._to_torch(k, v) for k, v in tensors.items()}
+        return tensors
+
+    def _to_torch(self, name, array):
+        import torch
+        if self._header[name]['dtype'] == 'BF16':
+            return torch.from_numpy(array.view(np.int16)).view(torch.bfloat16)
+        return torch.from_numpy(array)
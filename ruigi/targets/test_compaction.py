@@ -0,0 +1,67 @@
+import tempfile
+from unittest import TestCase
+import numpy as np
+import pandas as pd
+from ..task import Task
+from .compaction import compact_dataframe
+from .targets import JsonTarget, ParquetTarget
+
+
+class TestCompaction(TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'small_int': np.arange(100, dtype=np.int64),
+            'negative_int': -np.arange(100, dtype=np.int64),
+            'halves': np.arange(100) / 2,
+            'precise': np.arange(100) + 1e-12,
+            'label': pd.Series(['a', 'b'] * 50, dtype=object),
+            'unique': pd.Series([str(i) for i in range(100)], dtype=object),
+        })
+
+    def test_compact_dataframe(self):
+        compacted, report = compact_dataframe(self.df, float_tolerance=1e-9)
+        self.assertEqual(compacted['small_int'].dtype, np.int8)
+        self.assertEqual(compacted['negative_int'].dtype, np.int8)
+        self.assertEqual(compacted['halves'].dtype, np.float32)
+        self.assertEqual(compacted['precise'].dtype, np.float64)
+        self.assertIsInstance(compacted['label'].dtype, pd.CategoricalDtype)
+        self.assertEqual(compacted['unique'].dtype, self.df['unique'].dtype)
+        self.assertEqual(set(report['schema']),
+                         {'small_int', 'negative_int', 'halves', 'label'})
+        self.assertGreater(report['bytes_saved'], 0)
+        pd.testing.assert_frame_equal(compacted, self.df, check_dtype=False,
+                                      check_categorical=False)
+
+    def test_floats_are_kept_without_tolerance(self):
+        compacted, _ = compact_dataframe(self.df)
+        self.assertEqual(compacted['halves'].dtype, np.float64)
+
+    def test_parquet_target_compaction(self):
+        with tempfile.TemporaryDirectory() as target_dir:
+            class CompactParquetTarget(ParquetTarget):
+                compact = True
+
+            class CompactTask(Task):
+                TARGET_DIR = target_dir
+                _target = CompactParquetTarget
+
+            target = CompactTask().output()
+            target.dump(self.df)
+            self.assertIn('small_int', target.dump_info['compaction']['schema'])
+            loaded = target.load()
+            self.assertEqual(loaded['small_int'].dtype, np.int8)
+            self.assertIsInstance(loaded['label'].dtype, pd.CategoricalDtype)
+
+    def test_json_target_ignores_compaction(self):
+        with tempfile.TemporaryDirectory() as target_dir:
+            class CompactJsonTarget(JsonTarget):
+                compact = True
+
+            class CompactTask(Task):
+                TARGET_DIR = target_dir
+                _target = CompactJsonTarget
+
+            target = CompactTask().output()
+            target.dump(self.df)
+            self.assertNotIn('compaction', target.dump_info)
@@ -0,0 +1,109 @@
+import tempfile
+from unittest import TestCase
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from ..task import Task
+from ..backends.memory import MemoryStorage
+from ..backends.staging import StagingArea
+from .targets import PickleTarget, ParquetTarget
+from .digest import file_digest, HashingWriter
+
+
+class CountingStorage(MemoryStorage):
+    """MemoryStorage counting the saves of each object."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.saves = {}
+
+    def save(self, name, obj, format='pickle', chunk_size=None):
+        self.saves[name] = self.saves.get(name, 0) + 1
+        return super().save(name, obj, format=format, chunk_size=chunk_size)
+
+
+class SkippingPickleTarget(PickleTarget):
+    skip_unchanged = True
+
+
+class TestSkipUnchanged(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = CountingStorage(staging=StagingArea(self.tmp_dir.name))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _task(self, target, value):
+        class DigestTask(Task):
+            TARGET_DIR = self.tmp_dir.name
+            _target = target
+            _storage = self.storage
+
+        task = DigestTask()
+        task.output_object = value
+        return task
+
+    def _check_skips(self, target, first, second):
+        task = self._task(target, first)
+        path = task.output().path
+        task.save()
+        digest = task.load_metadata()['target']['digest']
+
+        task = self._task(target, first)
+        task.save()
+        self.assertEqual(self.storage.saves[path], 1)
+        metadata = task.load_metadata()
+        self.assertEqual(metadata['target']['digest'], digest)
+        self.assertTrue(metadata['target']['upload_skipped'])
+
+        task = self._task(target, second)
+        task.save()
+        self.assertEqual(self.storage.saves[path], 2)
+        self.assertNotEqual(task.load_metadata()['target']['digest'], digest)
+        self.assertNotIn('upload_skipped', task.load_metadata()['target'])
+        return task
+
+    def test_pickle_target(self):
+        task = self._check_skips(SkippingPickleTarget, {'a': 1}, {'a': 2})
+        self.assertEqual(task.load(), {'a': 2})
+
+    def test_parquet_target(self):
+        df = pd.DataFrame({'a': range(10)})
+        task = self._check_skips(ParquetTarget, df, df + 1)
+        assert_frame_equal(task.load(), df + 1)
+
+    def test_missing_object_is_uploaded(self):
+        task = self._task(SkippingPickleTarget, {'a': 1})
+        task.save()
+        self.storage.delete(task.output().path)
+        self._task(SkippingPickleTarget, {'a': 1}).save()
+        self.assertEqual(self.storage.saves[task.output().path], 2)
+        self.assertEqual(task.load(), {'a': 1})
+
+    def test_interrupted_dump_is_uploaded_again(self):
+        df = pd.DataFrame({'a': range(10)})
+        task = self._task(ParquetTarget, df)
+        path = task.output().path
+        task.save()
+        # content changed, then the dump stopped before writing the metadata
+        task.output().dump(df + 1)
+        self._task(ParquetTarget, df).save()
+        self.assertEqual(self.storage.saves[path], 3)
+        assert_frame_equal(task.load(), df)
+
+    def test_disabled_for_pickles_by_default(self):
+        for _ in range(2):
+            task = self._task(PickleTarget, {'a': 1})
+            task.save()
+        self.assertEqual(self.storage.saves[task.output().path], 2)
+        self.assertNotIn('target', task.load_metadata())
+
+    def test_writer_matches_file_digest(self):
+        path = self.tmp_dir.name + '/data.bin'
+        with open(path, 'wb') as f:
+            writer = HashingWriter(f)
+            writer.write(b'abc' * 1000)
+        self.assertEqual(writer.digest(), file_digest(path))
+        digest_only = HashingWriter()
+        digest_only.write(b'abc' * 1000)
+        self.assertEqual(digest_only.digest(), writer.digest())
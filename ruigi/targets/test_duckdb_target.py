@@ -0,0 +1,69 @@
+import os
+import gc
+import tempfile
+import unittest
+from unittest import TestCase
+import pandas as pd
+from ..task import Task, inherit_list
+from ..backends.memory import MemoryStorage
+from ..backends.staging import StagingArea
+from .targets import DuckDBTarget
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+
+@unittest.skipIf(duckdb is None, "duckdb is not installed")
+class TestDuckDBTarget(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lazy_relation_between_tasks(self):
+        target_dir = self.tmp_dir.name
+
+        class Source(Task):
+            TARGET_DIR = target_dir
+            _target = DuckDBTarget
+
+            def easy_run(self, inputs):
+                return pd.DataFrame({'a': range(10), 'b': list('ab') * 5})
+
+        @inherit_list(Source)
+        class Aggregate(Task):
+            TARGET_DIR = target_dir
+            _target = DuckDBTarget
+
+            def easy_run(self, inputs):
+                relation = inputs[0]
+                assert isinstance(relation, duckdb.DuckDBPyRelation)
+                return relation.filter('a >= 4').aggregate('b, sum(a) AS s', 'b')
+
+        Aggregate().buildme()
+        result = Aggregate().load().order('b').df()
+        self.assertEqual(result['b'].tolist(), ['a', 'b'])
+        self.assertEqual(result['s'].tolist(), [4 + 6 + 8, 5 + 7 + 9])
+
+    def test_staged_file_is_kept_while_relation_is_alive(self):
+        staging = StagingArea(os.path.join(self.tmp_dir.name, 'staging'),
+                              quota=0, min_age=0)
+
+        class Stored(Task):
+            TARGET_DIR = self.tmp_dir.name
+            _target = DuckDBTarget
+            _storage = MemoryStorage(staging=staging)
+
+        target = Stored().output()
+        target.dump(pd.DataFrame({'a': range(10)}))
+        relation = target.load()
+        staging.cleanup()
+        self.assertEqual(relation.filter('a > 4').aggregate('count(*)').fetchone(), (5,))
+        del relation
+        gc.collect()
+        staging.cleanup()
+        self.assertEqual(staging.usage(), 0)
@@ -0,0 +1,64 @@
+import os
+import tempfile
+from unittest import TestCase
+from .manifest import TargetManifest
+
+
+class TestTargetManifest(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manifest = TargetManifest(
+            path=os.path.join(self.tmp_dir.name, 'manifest.sqlite'))
+        self.manifest.record('a.pkl', dict(hash_version=1, version='0.0.1',
+                                           params=dict(x=1, y='a')),
+                             task_id='A_1', task_family='A')
+        self.manifest.record('b.pkl', dict(hash_version=2, version='0.0.1',
+                                           params=dict(x=2, y='a')),
+                             task_id='B_2', task_family='B')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        self.assertEqual(self.manifest.get('a.pkl')['params'], dict(x=1, y='a'))
+        self.assertIsNone(self.manifest.get('missing.pkl'))
+        self.assertEqual(set(self.manifest.get_many(['a.pkl', 'b.pkl'])),
+                         {'a.pkl', 'b.pkl'})
+
+    def test_query(self):
+        self.assertEqual(set(self.manifest.query(task_family='A')), {'a.pkl'})
+        self.assertEqual(set(self.manifest.query(hash_version=2)), {'b.pkl'})
+        self.assertEqual(set(self.manifest.query(params=dict(y='a'))),
+                         {'a.pkl', 'b.pkl'})
+        self.assertEqual(set(self.manifest.query(version='0.0.1',
+                                                 params=dict(x=2))), {'b.pkl'})
+
+    def test_record_replaces_and_remove(self):
+        self.manifest.record('a.pkl', dict(hash_version=3, params=dict(x=5)))
+        self.assertEqual(len(self.manifest), 2)
+        self.assertEqual(set(self.manifest.query(params=dict(x=1))), set())
+        self.manifest.remove('a.pkl')
+        self.assertIsNone(self.manifest.get('a.pkl'))
+        self.assertEqual(len(self.manifest), 1)
+
+    def test_push_merges_with_remote(self):
+        from ruigi.backends.memory import MemoryStorage
+        storage = MemoryStorage()
+        self.manifest.storage = storage
+        self.manifest.push()
+        other = TargetManifest(
+            path=os.path.join(self.tmp_dir.name, 'other.sqlite'), storage=storage)
+        other.record('c.pkl', dict(hash_version=1, params=dict(x=3)))
+        other.remove('a.pkl')
+        other.push()
+        # the first manifest's entries survive the second push
+        self.assertEqual(set(other.get_many(['a.pkl', 'b.pkl', 'c.pkl'])),
+                         {'b.pkl', 'c.pkl'})
+        self.manifest.record('d.pkl', dict(hash_version=1))
+        self.manifest.push()
+        self.assertIsNone(self.manifest.get('a.pkl'))
+        self.assertEqual(set(self.manifest.query()), {'b.pkl', 'c.pkl', 'd.pkl'})
+        self.assertEqual(set(self.manifest.query(params=dict(x=3))), {'c.pkl'})
+        other.pull()
+        self.assertEqual(len(other), 3)
@@ -0,0 +1,81 @@
+import tempfile
+from unittest import TestCase
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from ..task import Task
+from ..backends.rangefile import RangeFile
+from .targets import ParquetTarget, row_group_index, _read_parquet_rows
+
+
+class BytesStorage:
+    """Minimal storage serving range reads from memory and counting them."""
+    def __init__(self, data):
+        self.data = data
+        self.bytes_read = 0
+
+    def size(self, name):
+        return len(self.data)
+
+    def read_range(self, name, start, end):
+        self.bytes_read += end - start
+        return self.data[start:end]
+
+
+class TestParquetRowGroups(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+        class RowGroupTask(Task):
+            TARGET_DIR = self.tmp_dir.name
+            _target = ParquetTarget
+
+        ParquetTarget.row_group_size = 10
+        self.df = pd.DataFrame({'a': range(100), 'b': [str(i) for i in range(100)]})
+        self.target = RowGroupTask().output()
+        self.target.dump(self.df)
+
+    def tearDown(self):
+        ParquetTarget.row_group_size = None
+        self.tmp_dir.cleanup()
+
+    def test_index_is_recorded_on_dump(self):
+        index = self.target.dump_info['row_groups']
+        self.assertEqual(len(index), 10)
+        self.assertEqual(index[3]['row_offset'], 30)
+        self.assertEqual(index[3]['statistics']['a'], (30, 39))
+        self.assertEqual(index, row_group_index(self.target.path))
+
+    def test_load_rows(self):
+        assert_frame_equal(self.target.load(rows=slice(25, 47)), self.df.iloc[25:47])
+        assert_frame_equal(self.target.load(rows=slice(-5, None)), self.df.iloc[-5:])
+        assert_frame_equal(self.target.load(rows=slice(0, 30, 4), columns=['a']),
+                           self.df[['a']].iloc[0:30:4])
+
+    def test_load_row_groups(self):
+        assert_frame_equal(self.target.load(row_groups=[2]), self.df.iloc[20:30])
+        assert_frame_equal(self.target.load(), self.df)
+
+    def test_range_reads_fetch_only_needed_row_groups(self):
+        df = pd.DataFrame({'a': range(200000), 'b': [i * 0.5 for i in range(200000)]})
+        path = self.tmp_dir.name + '/large.parquet'
+        df.to_parquet(path, row_group_size=20000)
+        with open(path, 'rb') as f:
+            storage = BytesStorage(f.read())
+        loaded = _read_parquet_rows(RangeFile(storage, 'x'), rows=slice(50000, 50010))
+        assert_frame_equal(loaded, df.iloc[50000:50010])
+        self.assertLess(storage.bytes_read, len(storage.data) / 2)
+
+    def test_range_reads_fetch_only_selected_columns(self):
+        df = pd.DataFrame({'a': range(100000), 'b': [i * 0.5 for i in range(100000)],
+                           'c': [str(i) for i in range(100000)]})
+        path = self.tmp_dir.name + '/columns.parquet'
+        df.to_parquet(path, row_group_size=20000)
+        with open(path, 'rb') as f:
+            data = f.read()
+        all_columns, only_a = BytesStorage(data), BytesStorage(data)
+        rows = slice(30000, 50000)
+        _read_parquet_rows(RangeFile(all_columns, 'x'), rows=rows)
+        loaded = _read_parquet_rows(RangeFile(only_a, 'x'), rows=rows, columns=['a'])
+        assert_frame_equal(loaded, df[['a']].iloc[rows])
+        self.assertLess(only_a.bytes_read, all_columns.bytes_read / 2)
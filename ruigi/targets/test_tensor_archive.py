@@ -0,0 +1,168 @@
+import os
+import gc
+import json
+import struct
+import tempfile
+from unittest import TestCase, skipUnless
+import numpy as np
+from ..task import Task
+from ..backends.memory import MemoryStorage
+from ..backends.staging import StagingArea
+from .targets import TensorArchiveTarget, PytorchTarget, KerasTarget
+from .tensor_archive import TensorArchive, write_archive
+
+
+def _installed(module):
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+class TestTensorArchive(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'model.tensors')
+        self.tensors = {
+            'encoder.weight': np.arange(12, dtype=np.float32).reshape(3, 4),
+            'encoder.bias': np.ones(3, dtype=np.float16),
+            'decoder.weight': np.arange(6, dtype=np.int64).reshape(2, 3),
+            'decoder.mask': np.array([True, False]),
+            'empty': np.zeros((0, 2), dtype=np.float64),
+        }
+        with open(self.path, 'wb') as f:
+            write_archive(f, self.tensors, metadata={'format': 'pt'})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        archive = TensorArchive(self.path)
+        self.assertEqual(set(archive), set(self.tensors))
+        self.assertEqual(archive.metadata, {'format': 'pt'})
+        for name, tensor in self.tensors.items():
+            np.testing.assert_array_equal(archive[name], tensor)
+            self.assertEqual(archive[name].dtype, tensor.dtype)
+
+    def test_data_is_aligned_and_memory_mapped(self):
+        archive = TensorArchive(self.path)
+        self.assertEqual(archive._data_start % 8, 0)
+        self.assertIsInstance(archive['encoder.weight'], np.memmap)
+
+    def test_bf16_is_read_from_raw_bits(self):
+        bits = np.array([0x3F80, 0xC000], dtype=np.uint16)  # 1.0, -2.0
+        header = json.dumps({'w': {'dtype': 'BF16', 'shape': [2],
+                                   'data_offsets': [0, 4]}}).encode()
+        header += b' ' * (-(len(header) + 8) % 8)
+        with open(self.path, 'wb') as f:
+            f.write(struct.pack('<Q', len(header)) + header + bits.tobytes())
+        tensor = TensorArchive(self.path)['w']
+        np.testing.assert_array_equal(tensor.view(np.uint16), bits)
+        if _installed('ml_dtypes'):
+            self.assertEqual(tensor.astype(np.float32).tolist(), [1.0, -2.0])
+
+    @skipUnless(_installed('ml_dtypes'), "ml_dtypes is not installed")
+    def test_bf16_round_trip(self):
+        import ml_dtypes
+        weight = np.array([[1.5, -2.0], [0.25, 3.0]], dtype=ml_dtypes.bfloat16)
+        with open(self.path, 'wb') as f:
+            write_archive(f, {'weight': weight})
+        loaded = TensorArchive(self.path)['weight']
+        self.assertEqual(loaded.dtype, weight.dtype)
+        np.testing.assert_array_equal(loaded, weight)
+
+    @skipUnless(_installed('torch'), "torch is not installed")
+    def test_torch_bf16_round_trip(self):
+        import torch
+        weight = torch.tensor([[1.5, -2.0], [0.25, 3.0]], dtype=torch.bfloat16)
+        with open(self.path, 'wb') as f:
+            write_archive(f, {'weight': weight})
+        loaded = TensorArchive(self.path).to_dict(as_torch=True)['weight']
+        self.assertEqual(loaded.dtype, torch.bfloat16)
+        self.assertTrue(torch.equal(loaded, weight))
+
+    def test_select_modules(self):
+        archive = TensorArchive(self.path)
+        self.assertEqual(set(archive.to_dict(modules=['encoder'])),
+                         {'encoder.weight', 'encoder.bias'})
+        self.assertEqual(archive.select('decoder.weight'), ['decoder.weight'])
+
+
+class TestTensorArchiveTarget(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.staging_dir = os.path.join(self.tmp_dir.name, 'staging')
+        self.tensors = {
+            'encoder.weight': np.arange(12, dtype=np.float32).reshape(3, 4),
+            'decoder.weight': np.arange(6, dtype=np.int64).reshape(2, 3),
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _target(self, target=TensorArchiveTarget, storage=None):
+        class ModelTask(Task):
+            TARGET_DIR = os.path.join(self.tmp_dir.name, 'targets')
+            _target = target
+            _storage = storage
+
+        return ModelTask().output()
+
+    def _check_round_trip(self, target):
+        target.dump(self.tensors)
+        archive = target.load()
+        self.assertIsInstance(archive, TensorArchive)
+        for name, tensor in self.tensors.items():
+            np.testing.assert_array_equal(archive[name], tensor)
+        self.assertEqual(set(target.load(modules=['encoder'])), {'encoder.weight'})
+
+    def test_local_round_trip(self):
+        self._check_round_trip(self._target())
+
+    def test_storage_round_trip(self):
+        storage = MemoryStorage(staging=StagingArea(self.staging_dir))
+        target = self._target(storage=storage)
+        target.dump(self.tensors)
+        # streamed to the storage, without a staged copy
+        self.assertEqual(os.listdir(self.staging_dir), [])
+        self._check_round_trip(target)
+        self.assertTrue(storage.exists(target.path))
+        self.assertFalse(os.path.exists(target.path))
+
+    def test_staged_archive_is_kept_while_archive_is_alive(self):
+        staging = StagingArea(self.staging_dir, quota=0, min_age=0)
+        target = self._target(storage=MemoryStorage(staging=staging))
+        target.dump(self.tensors)
+        archive = target.load()
+        staging.cleanup()
+        np.testing.assert_array_equal(archive['decoder.weight'], self.tensors['decoder.weight'])
+        del archive
+        gc.collect()
+        staging.cleanup()
+        self.assertEqual(staging.usage(), 0)
+
+    def _check_staged_dump(self, target_class, model, load):
+        storage = MemoryStorage(staging=StagingArea(self.staging_dir))
+        target = self._target(target_class, storage)
+        target.dump(model)
+        # the staged file is removed once uploaded
+        self.assertEqual(os.listdir(self.staging_dir), [])
+        self.assertFalse(os.path.exists(target.path))
+        return load(target.load())
+
+    @skipUnless(_installed('torch'), "torch is not installed")
+    def test_pytorch_target_stages_dumps(self):
+        import torch
+        state_dict = {'weight': torch.arange(4.)}
+        loaded = self._check_staged_dump(PytorchTarget, state_dict, lambda s: s)
+        self.assertTrue(torch.equal(loaded['weight'], state_dict['weight']))
+
+    @skipUnless(_installed('keras') and _installed('h5py'), "keras is not installed")
+    def test_keras_target_stages_dumps(self):
+        import keras
+        model = keras.Sequential([keras.Input((2,)), keras.layers.Dense(1)])
+        loaded = self._check_staged_dump(KerasTarget, model, lambda m: m)
+        self.assertEqual(len(loaded.get_weights()), len(model.get_weights()))
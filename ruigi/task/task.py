@@ -11,6 +11,7 @@ from ruigi.targets import PickleTarget
 import logging
 import warnings
 import types
+import time
 
 
 logger = logging.getLogger('luigi-interface')
@@ -45,6 +46,7 @@ class Task(luigi.Task):
     TARGET_DIR = './TARGETS/'
     _target = PickleTarget
     _storage = None
+    _manifest = None
     requires_list = []
     requires_dict = {}
 
@@ -105,17 +107,27 @@ class Task(luigi.Task):
         self.output().remove_metadata()
 
     def save(self):
-        self.output().dump(self.output_object)
-        self.output().dump_metadata(self.metadata())
+        target = self.output()
+        target.dump(self.output_object)
+        metadata = self.metadata()
+        dump_info = getattr(target, 'dump_info', None)
+        if dump_info:
+            metadata['target'] = dump_info
+        target.dump_metadata(metadata)
 
     def metadata(self):
         metadata = dict()
         metadata['hash_version'] = self.hash_version()
         metadata['version'] = self.version
         metadata['params'] = self.get_execution_params(only_significant=False, only_public=True)
+        started = getattr(self, '_run_started', None)
+        if started is not None:
+            # used by Pipe.plan to estimate the duration of future runs
+            metadata['run_seconds'] = time.time() - started
         return metadata
 
     def run(self):
+        self._run_started = time.time()
         if self.easy_run:
             inputs = self.function_inputs()
             self.output_object = self.easy_run(inputs)
@@ -1,15 +1,26 @@
+import os
+import heapq
+import shutil
+import tempfile
 import luigi
 import copy
+import statistics
 from ruigi import Task
 from ruigi.utils import (
     build_dag,
     breadth_first_search,
+    cached_property,
     get_reverse_dag,
-    find_root_in_dag,
+    topological_sort,
 )
 
+from ruigi.backends import metrics
+from ruigi.backends.batch import BatchMixin, raise_first_error
+
 from luigi.task import flatten
 from collections import defaultdict
+from collections.abc import Mapping
+from contextlib import contextmanager
 
 
 class Pipe(object):
@@ -17,7 +28,19 @@ class Pipe(object):
     This class should be used to compose a pipeline given a list of tasks. It
     contains many methods to interact with the pipeline as a whole.
     """
-    def __init__(self, tasks: list, params:dict):
+    def __init__(self, tasks: list, params:dict, lazy=False):
+        """
+        Args:
+            tasks: `list`
+                Task classes whose outputs are the outputs of the pipeline.
+            params: `dict`
+                Parameters used to instantiate the tasks.
+            lazy: `bool` default `False`
+                If True, requirements of a task are computed the first time
+                the DAG is accessed at that task, instead of building the
+                whole DAG here. Methods that need every task, like
+                `remove_all`, still expand it completely.
+        """
         assert isinstance(tasks,list)
         assert params is None or isinstance(params,dict)
         assert _tasks_are_class(tasks)
@@ -26,60 +49,157 @@ class Pipe(object):
 
         self.params = copy.deepcopy(params)
         self.top_nodes = tasks # top nodes are root nodes
-        #self.dag = _get_dag_from_task(tasks)
         self.top_nodes = [t(**self.params) for t in self.top_nodes]
-        self.dag = _get_dag_(defaultdict(set), self.top_nodes)
-        self.dag = {i: list(j) for i,j in self.dag.items()}
-        #self.dag = _get_instances_from_classes(self.dag, self.params)
-        self.rev_dag = get_reverse_dag(self.dag)
-        self.leaf_nodes = find_root_in_dag(self.rev_dag) #  leaf nodes are root nodes of rev dag
-        self.all_tasks = [k for k in self.dag]
-        
+        self.dag = LazyDAG(self.top_nodes) if lazy else _get_dag(self.top_nodes)
+
+    @cached_property
+    def rev_dag(self):
+        return get_reverse_dag(self.dag)
+
+    @cached_property
+    def leaf_nodes(self):
+        """ Tasks without requirements."""
+        return [t for t, sons in self.dag.items() if not sons]
+
+    @cached_property
+    def all_tasks(self):
+        return list(self.dag)
 
     def remove_all(self):
         """Remove all targets related to this pipeline."""
-        for t in self.all_tasks:
-            try:
-                t.remove()
-            except FileNotFoundError:
-                pass
+        _remove_tasks(self.all_tasks)
 
     def remove_upstream(self, tasks:list):
         """Remove all targets in this pipeline that depend on the given tasks."""
         assert isinstance(tasks,list)
         traverse_dag_generator = breadth_first_search( self.rev_dag,tasks)
-        for task_list in traverse_dag_generator:
-            for t in task_list:
-                try:
-                    t.remove()
-                except FileNotFoundError:
-                    pass
+        _remove_tasks({t for task_list in traverse_dag_generator for t in task_list})
     
     def remove_orphans(self):
         """Remove all targets for which respective downstream targets are not complete"""
 
+        self.update_all_complete_status()
         downstream_complete_dict = {}
-        _downstream_complete(self.dag, self.top_nodes, downstream_complete_dict)
-
-        for t, is_downstream_complete in downstream_complete_dict.items():
-            if  not is_downstream_complete:
-                try:
-                    t.remove()
-                except FileNotFoundError:
-                    pass
-
-    def remove_obsolete(self):
-        """Remove all targets whose hash_versions do not match to current version"""
-        return
+        _downstream_complete(self.dag, self.top_nodes, downstream_complete_dict,
+                             self.all_complete_status.get)
+
+        _remove_tasks([t for t, is_downstream_complete in
+                       downstream_complete_dict.items() if not is_downstream_complete])
+
+    def remove_obsolete(self, dry_run=False):
+        """Remove all targets whose hash_versions do not match to current version,
+        and the targets of every task that depends on them.
+
+        Metadata are read with :py:meth:`load_all_metadata`, i.e. from the
+        manifests or concurrently from storages supporting batch operations,
+        and targets are deleted concurrently in the same way. Targets whose
+        metadata do not record a hash_version or a version are kept, unless
+        they depend on an obsolete task: downstream targets are removed if
+        they exist, with or without metadata.
+
+        Args:
+            dry_run: `bool` default `False`
+                If True, only report what would be removed.
+
+        Returns: dict
+            {task: reason} of the removed tasks, where reason is
+            `hash_version` or `version` if the code of the task changed, or
+            `downstream` if it depends on an obsolete task.
+        """
+        metadata = self.load_all_metadata()
+        current_hash = {}  # hash_version depends on the task class only
+        removed = {}
+        for t, m in metadata.items():
+            if not m:
+                continue
+            if type(t) not in current_hash:
+                current_hash[type(t)] = t.hash_version()
+            if 'hash_version' in m and m['hash_version'] != current_hash[type(t)]:
+                removed[t] = 'hash_version'
+            elif 'version' in m and m['version'] != t.version:
+                removed[t] = 'version'
+
+        stack = list(removed)
+        visited = set(stack)
+        downstream = []
+        while stack:
+            for t in self.rev_dag[stack.pop()]:
+                if t not in visited:
+                    visited.add(t)
+                    stack.append(t)
+                    downstream.append(t)
+        # Decided by existence, not metadata: local targets have none.
+        for t, exists in _bulk_complete(downstream).items():
+            if exists:
+                removed[t] = 'downstream'
+
+        if not dry_run:
+            _remove_tasks(list(removed))
+        return removed
 
     def update_all_complete_status(self):
         """ Updates a dictionary whose keys are task objects and values are
-        True if target was found."""
-        from pycarol import Carol, Storage
-        st = Storage(Carol())
-        target_files = st.files_storage_list(prefix='pipeline/')
-        self.all_complete_status = {t: t.output().path in target_files for t in
-                self.all_tasks}
+        True if target was found.
+        Targets in a storage that supports listing are checked with one
+        listing per target folder, instead of one request per target."""
+        self.all_complete_status = _bulk_complete(self.all_tasks)
+
+    def plan(self, workers=1, durations=None, default_duration=60., history_size=20):
+        """ Returns the :py:class:`ExecutionPlan` of a run of this pipeline,
+        without running anything.
+
+        Completeness is checked in bulk, as in `update_all_complete_status`.
+        As luigi does, a task runs if it is incomplete and is a top node or
+        a requirement of a task that runs. The duration of each task is
+        estimated with the median `run_seconds` recorded in the metadata of
+        up to `history_size` complete tasks of the same family.
+
+        Args:
+            workers: `int` default 1
+                Number of workers of the run to estimate.
+            durations: `dict` default `None`
+                {task family or task class: seconds}, overriding estimates.
+            default_duration: `float` default 60
+                Seconds estimated for tasks of families without history.
+            history_size: `int` default 20
+                Maximum number of metadata read per task family.
+        """
+        self.update_all_complete_status()
+        complete = self.all_complete_status
+
+        to_run = {}
+        stack = [t for t in self.top_nodes if not complete[t]]
+        while stack:
+            t = stack.pop()
+            if t in to_run:
+                continue
+            to_run[t] = None
+            stack.extend(r for r in self.dag[t] if not complete[r] and r not in to_run)
+        tasks = topological_sort(self.dag, list(to_run))
+
+        estimates = {}
+        for key, seconds in (durations or {}).items():
+            estimates[key if isinstance(key, str) else key.get_task_family()] = seconds
+        families = {t.get_task_family() for t in tasks} - set(estimates)
+        history = []
+        for family in families:
+            history += [t for t in self.find_tasks(task_family=family) if complete[t]][:history_size]
+        run_seconds = defaultdict(list)
+        for t, metadata in _load_metadata(history).items():
+            if metadata and 'run_seconds' in metadata:
+                run_seconds[t.get_task_family()].append(metadata['run_seconds'])
+        for family in families:
+            estimates[family] = statistics.median(run_seconds[family]) \
+                if run_seconds[family] else default_duration
+
+        task_durations = {t: estimates[t.get_task_family()] for t in tasks}
+        return ExecutionPlan(
+            tasks=tasks,
+            complete=dict(complete),
+            durations=task_durations,
+            workers=workers,
+            estimated_seconds=_simulate_run(self.dag, tasks, task_durations, workers),
+            critical_path_seconds=_critical_path(self.dag, tasks, task_durations))
 
     def get_task_complete(self,task):
         """ Returns True if task is complete accordingly to
@@ -89,37 +209,189 @@ class Pipe(object):
         assert task in self.all_tasks, f"Task {task} not found in this pipeline"
         return self.all_complete_status[task]
 
-    def run(self, local_scheduler=True, workers=1, detailed_summary=False):
-        """Run the whole pipeline"""
+    def load_all_metadata(self):
+        """ Returns a dictionary whose keys are task objects and values are
+        the metadata stored in their targets, or None if there is none.
+        Tasks whose targets are indexed in a manifest are read with a single
+        bulk query; remaining tasks fall back to one load per target."""
+        return _load_metadata(self.all_tasks)
+
+    def query_metadata(self, task_family=None, hash_version=None,
+                       version=None, **params):
+        """ Returns a dictionary {task: metadata} of the tasks in this
+        pipeline whose manifest entries match all given filters. Only tasks
+        with a manifest are considered."""
+        result = {}
+        for manifest, tasks in _group_by_manifest(self.all_tasks).items():
+            if manifest is None:
+                continue
+            found = manifest.query(task_family=task_family,
+                                   hash_version=hash_version,
+                                   version=version, params=params)
+            for t in tasks:
+                path = t.output().path
+                if path in found:
+                    result[t] = found[path]
+        return result
+
+    def pull_manifest(self):
+        """ Merge into every manifest used by this pipeline its copy in storage."""
+        for manifest in _group_by_manifest(self.all_tasks):
+            if manifest is not None and manifest.storage is not None:
+                manifest.pull()
+
+    def sync_manifest(self):
+        """ Push every manifest used by this pipeline to its storage, merged
+        with the copy already there."""
+        for manifest in _group_by_manifest(self.all_tasks):
+            if manifest is not None and manifest.storage is not None:
+                manifest.push()
+
+    def flush_storages(self):
+        """ Wait until storages replicating in background, like
+        :py:class:`ruigi.backends.tiered.TieredStorage`, finished every copy."""
+        storages = {getattr(t, '_storage', None) for t in self.all_tasks}
+        storages.update(manifest.storage for manifest in _group_by_manifest(self.all_tasks)
+                        if manifest is not None)
+        for storage in storages:
+            if hasattr(storage, 'flush'):
+                storage.flush()
+
+    def run(self, local_scheduler=True, workers=1, detailed_summary=False,
+            metrics_path=None, plan=None):
+        """Run the whole pipeline
+
+        Args:
+            plan: :py:class:`ExecutionPlan` default `None`
+                Plan returned by :py:meth:`plan`. Tasks it found complete are
+                not checked again by luigi. Incomplete ones are, since they
+                complete during the run.
+            metrics_path: `str` default `None`
+                If given, storage metrics are written to this path at the end
+                of the run: as Prometheus text if it ends with `.prom`,
+                otherwise as JSON. When `workers > 1`, the metrics of the
+                worker processes are merged into those of this process.
+        """
         tasks = [t for t in self.top_nodes]
-        return luigi.build(tasks, local_scheduler=local_scheduler,
-                           workers=workers, detailed_summary=detailed_summary)
+        self.pull_manifest()
+        spool = None
+        if metrics_path is not None and workers > 1:
+            spool = tempfile.mkdtemp(prefix='ruigi-metrics-')
+            metrics.spool_to(spool)
+        try:
+            with _known_complete(plan.complete if plan is not None else {}):
+                result = luigi.build(tasks, local_scheduler=local_scheduler,
+                                     workers=workers, detailed_summary=detailed_summary)
+        finally:
+            if spool is not None:
+                metrics.spool_to(None)
+        self.sync_manifest()
+        self.flush_storages()
+        if metrics_path is not None:
+            registry = metrics.default_registry()
+            if spool is not None:
+                metrics.collect(spool, registry)
+                shutil.rmtree(spool, ignore_errors=True)
+            if metrics_path.endswith('.prom'):
+                registry.to_prometheus(metrics_path)
+            else:
+                registry.to_json(metrics_path)
+        return result
 
     def get_dag(self):
         return self.dag
 
+    @cached_property
+    def _task_position(self):
+        """ {task: position in all_tasks}, to sort lookups in pipeline order."""
+        return {t: i for i, t in enumerate(self.all_tasks)}
+
+    @cached_property
+    def _tasks_by_id(self):
+        return {t.task_id: t for t in self.all_tasks}
+
+    @cached_property
+    def _tasks_by_class(self):
+        by_class = defaultdict(list)
+        for t in self.all_tasks:
+            by_class[type(t)].append(t)
+        return dict(by_class)
+
+    @cached_property
+    def _tasks_by_param(self):
+        """ {(task_family, param_name, serialized value): [tasks]}. Values are
+        serialized as in task ids, so unhashable values can be indexed too."""
+        by_param = defaultdict(list)
+        for t in self.all_tasks:
+            family = t.get_task_family()
+            for name, value in t.to_str_params().items():
+                by_param[(family, name, value)].append(t)
+        return dict(by_param)
+
     def get_task_by_id(self,task_id):
         """
         Returns the task object given a string task_id.
         This method should be used to implement run_task command line script,
         which will be used in docker tasks and related architectures.
         """
-        for t in self.all_tasks:
-            if task_id == t.task_id:
-                return t
-        else:
-            raise KeyError(f"{task_id} not found in this pipeline.")
+        try:
+            return self._tasks_by_id[task_id]
+        except KeyError:
+            raise KeyError(f"{task_id} not found in this pipeline.") from None
 
     def get_matching_tasks(self,task):
         """
         Given a non instantiated task, retrieves all instantiated tasks in this pipeline.
         It is used in manual assert in notebook tasks.
         """
-        matching_tasks = [isinstance(t, task) for t in self.all_tasks]
-        matching_tasks = [t for i, t in enumerate(self.all_tasks) if
-                          matching_tasks[i]]
+        classes = [c for c in self._tasks_by_class if issubclass(c, task)]
+        matching_tasks = [t for c in classes for t in self._tasks_by_class[c]]
+        if len(classes) > 1:
+            matching_tasks.sort(key=self._task_position.get)
         return matching_tasks
 
+    def find_tasks(self, task=None, task_family=None, **params):
+        """
+        Returns the tasks of this pipeline matching all given filters, in
+        the order of `all_tasks`.
+
+        Args:
+            task: `type` default `None`
+                Task class. Instances of its subclasses match too.
+            task_family: `str` default `None`
+                Task family, e.g. `T1`.
+            params:
+                Parameter values, e.g. `find_tasks(T1, date='2020-01-01')`.
+                Values are compared serialized, as in task ids. Strings are
+                parsed first, e.g. as dates for a `luigi.DateParameter`.
+        """
+        by_class = self._tasks_by_class
+        if task_family is not None:
+            families = [task_family]
+        elif task is not None:
+            families = {c.get_task_family() for c in by_class if issubclass(c, task)}
+        else:
+            families = {c.get_task_family() for c in by_class}
+
+        result = []
+        for family in families:
+            classes = [c for c in by_class if c.get_task_family() == family]
+            if params:
+                keys = [_serialize_param(classes, name, value) for name, value in params.items()]
+                if None in keys:
+                    continue  # a parameter the tasks of this family do not have
+                lists = sorted((self._tasks_by_param.get((family, name, key), [])
+                                for name, key in zip(params, keys)), key=len)
+                others = [set(tasks) for tasks in lists[1:]]
+                candidates = [t for t in lists[0] if all(t in other for other in others)]
+            else:
+                candidates = [t for c in classes for t in by_class[c]]
+                if len(classes) > 1:
+                    candidates.sort(key=self._task_position.get)
+            result.extend(t for t in candidates if task is None or isinstance(t, task))
+        if len(families) > 1:
+            result.sort(key=self._task_position.get)
+        return result
 
     def assert_task_is_unique(self,task):
         """
@@ -145,36 +417,153 @@ class Pipe(object):
 
 
 
+class ExecutionPlan(object):
+    """
+    Tasks a run of a pipeline would execute, returned by :py:meth:`Pipe.plan`
+    and accepted by :py:meth:`Pipe.run`.
+
+    Attributes:
+        tasks: `list`
+            Tasks to run, in topological order: requirements first.
+        complete: `dict`
+            {task: complete} of every task in the pipeline, when planned.
+        durations: `dict`
+            {task: estimated seconds} of the tasks to run.
+        workers: `int`
+            Number of workers the estimate is for.
+        estimated_seconds: `float`
+            Estimated wall time of the run with `workers` workers.
+        critical_path_seconds: `float`
+            Estimated wall time of the run with unlimited workers.
+    """
+    def __init__(self, tasks, complete, durations, workers, estimated_seconds,
+                 critical_path_seconds):
+        self.tasks = tasks
+        self.complete = complete
+        self.durations = durations
+        self.workers = workers
+        self.estimated_seconds = estimated_seconds
+        self.critical_path_seconds = critical_path_seconds
+
+    @property
+    def total_seconds(self):
+        """ Estimated time of the run with a single worker."""
+        return sum(self.durations.values())
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    def summary(self) -> str:
+        """ Returns a text table of the tasks to run by family, with the estimates."""
+        families = defaultdict(list)
+        for t in self.tasks:
+            families[t.get_task_family()].append(self.durations[t])
+        lines = [f"{'task family':<40} {'tasks':>7} {'seconds':>10}"]
+        lines += [f"{family:<40} {len(d):>7} {sum(d):>10.1f}"
+                  for family, d in families.items()]
+        lines.append(f"{len(self.tasks)} tasks to run, {len(self.complete) - len(self.tasks)} "
+                     f"skipped. Estimated wall time {self.estimated_seconds:.1f}s with "
+                     f"{self.workers} worker(s), {self.critical_path_seconds:.1f}s critical path.")
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return (f"ExecutionPlan(tasks={len(self.tasks)}, workers={self.workers}, "
+                f"estimated_seconds={self.estimated_seconds:.1f})")
+
+
 ### Auxiliary functions ###
 
 
-def _get_dag_(dag, tasks) -> dict:
+class LazyDAG(Mapping):
     """
-    Compute the DAQ of a pipeline.
+    DAG of a pipeline {task: [requirements]}, whose nodes are expanded on
+    first access.
 
+    Each task calls `requires()` once at most. Traversing the DAG from the
+    top nodes, e.g. with :py:func:`ruigi.utils.breadth_first_search`, only
+    expands the visited sub-DAG; iterating over it or its length expand it
+    completely, without recursion.
+
+    Args:
+        top_nodes: `list`
+            Instantiated tasks the DAG starts from.
+    """
+    def __init__(self, top_nodes: list):
+        self._dag = {}
+        self._pending = dict.fromkeys(top_nodes)  # known, not yet expanded
+
+    def _expand(self, task):
+        sons = self._dag[task] = _requirements(task)
+        for t in sons:
+            if t not in self._dag:
+                self._pending[t] = None
+        return sons
+
+    def expand_all(self) -> dict:
+        """ Expand every node. Returns the DAG as a dict."""
+        while self._pending:
+            task, _ = self._pending.popitem()
+            self._expand(task)
+        return self._dag
+
+    @property
+    def expanded(self) -> int:
+        """ Number of nodes expanded so far."""
+        return len(self._dag)
+
+    def __getitem__(self, task):
+        if task in self._dag:
+            return self._dag[task]
+        if task in self._pending:
+            del self._pending[task]
+            return self._expand(task)
+        return self.expand_all()[task]
+
+    def __contains__(self, task):
+        return task in self._dag or task in self._pending or task in self.expand_all()
+
+    def __iter__(self):
+        return iter(self.expand_all())
+
+    def __len__(self):
+        return len(self.expand_all())
+
+
+def _serialize_param(classes, name, value):
+    """ Returns value serialized as the parameter `name` of the first task
+    class having it, or None. Strings are parsed first, so that e.g.
+    `date='2020-01-01'` matches a `luigi.DateParameter`."""
+    for c in classes:
+        param = dict(c.get_params()).get(name)
+        if param is not None:
+            if isinstance(value, str):
+                value = param.parse(value)
+            return param.serialize(param.normalize(value))
+    return None
+
+
+def _requirements(task) -> list:
+    """ Returns the requirements of a task, without duplicates."""
+    #flatten handles dicts and lists.
+    return list(dict.fromkeys(flatten(task.requires())))
+
+
+def _get_dag(tasks) -> dict:
+    """
+    Compute the DAG of a pipeline, iteratively.
 
     Args:
-        dag: `collections.defaultdict(set)`
-            A defaultdict of a set. This will hold the dict with the result {task : requirements_set}
         tasks: `list`
-            List of taks to find the dependencies.
+            List of tasks to find the dependencies.
 
-    Returns: collections.defaultdict(set)
-        the daq as a collections.defaultdict(set)
+    Returns: dict
+        the DAG as a dict {task: requirements_list}
 
     """
-    for task in tasks:
-        if task in dag:
-            continue
-        #flatten handles dicts and lists.
-        reqs = flatten(task.requires())
-        dag[task].update(set(reqs))
-        if len(reqs) > 0:
-            dag = _get_dag_(dag, reqs)
-        else:
-            continue
-
-    return dag
+    return LazyDAG(tasks).expand_all()
 
 
 def _luigi_get_sons(task) -> list:
@@ -226,21 +615,174 @@ def _get_instances_from_classes(dag:dict, params:dict):
         instances_dag[k(**params)] = task_list
     return instances_dag
 
-def _downstream_complete(dag, top_nodes, downstream_complete_dict):
-    """Recursively traverses dag starting from top_nodes to update downstream_complet_dict"""
-    #TODO: reimplement using breadth_first_search
-    for task in top_nodes:
+def _downstream_complete(dag, top_nodes, downstream_complete_dict, is_complete=None):
+    """Traverses dag starting from top_nodes to update downstream_complete_dict.
+    A task is downstream complete if it and all its requirements are."""
+    if is_complete is None:
+        is_complete = lambda task: task.complete()
+    # depth first post-order, without recursion: a task is resolved after its sons
+    stack = [(task, False) for task in top_nodes]
+    while stack:
+        task, sons_done = stack.pop()
         if task in downstream_complete_dict:
             continue
         sons = dag[task]
-        if sons: # recursion step
-            downstream_complete_dict[task] = task.complete() and \
-                all([
-                    _downstream_complete(dag, [t], downstream_complete_dict)
-                    for t in sons
-                    ])
-        else: # stop recursion step
-            downstream_complete_dict[task] = task.complete()
+        if sons_done:
+            downstream_complete_dict[task] = is_complete(task) and \
+                all(downstream_complete_dict[t] for t in sons)
+        else:
+            stack.append((task, True))
+            stack.extend((t, False) for t in sons if t not in downstream_complete_dict)
+    return all(downstream_complete_dict[t] for t in top_nodes)
+
+def _simulate_run(dag, tasks, durations, workers) -> float:
+    """ Returns the wall time of running tasks, given in topological order,
+    with `workers` workers starting ready tasks in that order."""
+    selected = set(tasks)
+    n_sons = {t: sum(1 for r in dag[t] if r in selected) for t in tasks}
+    fathers = defaultdict(list)
+    for t in tasks:
+        for r in dag[t]:
+            if r in selected:
+                fathers[r].append(t)
+    position = {t: i for i, t in enumerate(tasks)}
+    ready = [(position[t], t) for t in tasks if not n_sons[t]]
+    heapq.heapify(ready)
+    running = []  # heap of (end time, position, task)
+    now = 0.
+    while ready or running:
+        while ready and len(running) < max(workers, 1):
+            i, t = heapq.heappop(ready)
+            heapq.heappush(running, (now + durations[t], i, t))
+        now, _, t = heapq.heappop(running)
+        for f in fathers[t]:
+            n_sons[f] -= 1
+            if not n_sons[f]:
+                heapq.heappush(ready, (position[f], f))
+    return now
+
+def _critical_path(dag, tasks, durations) -> float:
+    """ Returns the duration of the longest chain of tasks, given in topological order."""
+    end = {}
+    for t in tasks:
+        end[t] = durations[t] + max((end[r] for r in dag[t] if r in end), default=0.)
+    return max(end.values(), default=0.)
+
+def _always_complete():
+    return True
+
+@contextmanager
+def _known_complete(status):
+    """ Within the block, complete() of tasks with status True returns True
+    without checking their targets."""
+    tasks = [t for t, complete in status.items() if complete]
+    for t in tasks:
+        t.complete = _always_complete
+    try:
+        yield
+    finally:
+        for t in tasks:
+            t.__dict__.pop('complete', None)
+
+def _bulk_complete(tasks) -> dict:
+    """ Returns a dict {task: complete}. Targets whose storage implements
+    `list` are checked with a single listing per target folder; other tasks
+    fall back to task.complete()."""
+    status = {}
+    listed = defaultdict(list)  # storage: [(task, path)]
+    for t in tasks:
+        target = t.output()
+        storage = getattr(target, 'storage', None)
+        if getattr(target, 'has_storage', False) and hasattr(storage, 'list'):
+            listed[storage].append((t, target.path))
+        else:
+            status[t] = t.complete()
+
+    for storage, task_paths in listed.items():
+        prefixes = {os.path.join(os.path.dirname(path), '') for _, path in task_paths}
+        found = set()
+        for prefix in prefixes:
+            found.update(os.path.normpath(name) for name in storage.list(prefix))
+        for t, path in task_paths:
+            status[t] = os.path.normpath(path) in found
+    return status
+
+def _group_by_manifest(tasks) -> dict:
+    """Returns a dict {manifest: [tasks]}. Tasks without manifest are under None."""
+    groups = defaultdict(list)
+    for t in tasks:
+        groups[getattr(t, '_manifest', None)].append(t)
+    return groups
+
+def _load_metadata(tasks) -> dict:
+    """ Returns {task: metadata or None}, reading manifests in bulk and other
+    targets concurrently when their storage supports batch operations."""
+    metadata = {}
+    missing = []
+    for manifest, group in _group_by_manifest(tasks).items():
+        if manifest is None:
+            missing.extend(group)
+            continue
+        paths = {t: t.output().path for t in group}
+        found = manifest.get_many(paths.values())
+        for t, path in paths.items():
+            if path in found:
+                metadata[t] = found[path]
+            else:
+                missing.append(t)
+    metadata.update(_load_metadata_many(missing))
+    return metadata
+
+def _load_metadata_or_none(task):
+    try:
+        return task.load_metadata()
+    except (FileNotFoundError, AttributeError):
+        return None
+
+def _group_by_batch_storage(tasks):
+    """ Returns ({storage: [(task, target)]}, [other tasks]) where storages
+    support batch operations."""
+    batched = defaultdict(list)
+    others = []
+    for t in tasks:
+        target = t.output()
+        storage = getattr(target, 'storage', None)
+        if getattr(target, 'has_storage', False) and isinstance(storage, BatchMixin):
+            batched[storage].append((t, target))
+        else:
+            others.append(t)
+    return batched, others
+
+def _load_metadata_many(tasks) -> dict:
+    """ Returns {task: metadata or None}, loading metadata concurrently when
+    the storage supports batch operations. Metadata not found are None; other
+    errors, e.g. throttling or permissions, are raised."""
+    batched, others = _group_by_batch_storage(tasks)
+    metadata = {t: _load_metadata_or_none(t) for t in others}
+    for storage, task_targets in batched.items():
+        results = storage.load_many(
+            [target.get_metadata_path() for _, target in task_targets], format='joblib')
+        raise_first_error(results, ignore=(FileNotFoundError,))
+        for (t, _), result in zip(task_targets, results):
+            metadata[t] = result.value if result.error is None else None
+    return metadata
+
+def _remove_tasks(tasks):
+    """ Remove the targets and metadata of the given tasks. Objects in storages
+    supporting batch operations are deleted concurrently."""
+    batched, others = _group_by_batch_storage(tasks)
+    for t in others:
+        try:
+            t.remove()
+        except FileNotFoundError:
+            pass
+    for storage, task_targets in batched.items():
+        names = [name for _, target in task_targets
+                 for name in (target.path, target.get_metadata_path())]
+        raise_first_error(storage.delete_many(names), ignore=(FileNotFoundError,))
+        for _, target in task_targets:
+            if target.manifest is not None:
+                target.manifest.remove(target.path)
 
 def _tasks_are_class(tasks):
     for t in tasks:
@@ -0,0 +1,92 @@
+"""
+Construction benchmark of :py:class:`ruigi.tools.Pipe` on synthetic pipelines.
+
+    python -m ruigi.tools.benchmark --nodes 100000 --shapes chain,layered,tree
+
+Every shape builds a pipeline of `--nodes` tasks of a single task class,
+:py:class:`ruigi.tools.test_utils.SyntheticTask`, told apart by an
+index parameter:
+
+    chain    each task requires the next one, so the DAG is as deep as it is large.
+    layered  a top task requiring a layer of `--width` tasks, each requiring
+             `--fan-in` tasks of the next layer.
+    tree     each task requires two children, as a binary heap.
+
+For each shape, the pipeline is built eagerly, then lazily and traversed
+through `all_tasks`, then lazily with only the top node accessed. The report
+has the construction time, the number of expanded tasks and the peak memory
+allocated, traced with tracemalloc in a separate run so that tracing does not
+inflate the time. Results can be written with `--output`.
+"""
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from luigi.task_register import Register
+from . import Pipe
+from .test_utils import SyntheticTask
+
+SHAPES = ('chain', 'layered', 'tree')
+MODES = ('eager', 'lazy_all', 'lazy_top')
+
+
+def build(mode, params):
+    """ Returns (pipe, number of expanded tasks)."""
+    pipe = Pipe([SyntheticTask], params, lazy=mode != 'eager')
+    if mode == 'lazy_all':
+        pipe.all_tasks
+    elif mode == 'lazy_top':
+        pipe.dag[pipe.top_nodes[0]]
+    expanded = len(pipe.dag) if mode == 'eager' else pipe.dag.expanded
+    return pipe, expanded
+
+
+def bench_case(shape, mode, nodes, width=1000, fan_in=3):
+    """ Returns a dict with the construction time and peak traced memory."""
+    params = dict(nodes=nodes, shape=shape, width=width, fan_in=fan_in)
+    # luigi caches task instances: every run starts from an empty cache
+    Register.clear_instance_cache()
+    start = time.perf_counter()
+    _, expanded = build(mode, params)
+    seconds = time.perf_counter() - start
+
+    Register.clear_instance_cache()
+    tracemalloc.start()
+    try:
+        build(mode, params)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    Register.clear_instance_cache()
+    return dict(shape=shape, mode=mode, nodes=nodes, expanded=expanded,
+                seconds=seconds, peak_mb=peak / 2 ** 20)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1].strip())
+    parser.add_argument('--nodes', type=int, default=100000)
+    parser.add_argument('--shapes', default=','.join(SHAPES))
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--fan-in', type=int, default=3)
+    parser.add_argument('--output', help="Write the results as JSON to this path.")
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'shape':<8} {'mode':<9} {'nodes':>8} {'expanded':>9} {'seconds':>8} {'peak MB':>8}")
+    for shape in args.shapes.split(','):
+        for mode in args.modes.split(','):
+            r = bench_case(shape, mode, args.nodes, width=args.width, fan_in=args.fan_in)
+            print(f"{shape:<8} {mode:<9} {r['nodes']:>8} {r['expanded']:>9} "
+                  f"{r['seconds']:>8.2f} {r['peak_mb']:>8.1f}")
+            sys.stdout.flush()
+            results.append(r)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
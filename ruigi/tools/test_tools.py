@@ -73,8 +73,6 @@ def test_get_task_by_id_raises():
     raise Exception("Key error waas not triggered")
 
 
-# def test_remove_obsolete():
-#     # need to implement metadata in targets
 # test hard to automate
 def test_tasks_are_instance():
     from ._tools import _tasks_are_instance
@@ -86,4 +84,358 @@ def test_tasks_are_class():
     from ._tools import _tasks_are_class
     assert _tasks_are_class([T1,T2])
     params = {}
-    assert not _tasks_are_class([T1(**params),T2(**params)])
\ No newline at end of file
+    assert not _tasks_are_class([T1(**params),T2(**params)])
+
+def test_load_all_metadata_from_manifest(tmp_path, monkeypatch):
+    from ruigi import Task, TargetManifest
+    from ruigi.backends.memory import MemoryStorage
+    params = {}
+    monkeypatch.setattr(Task, 'TARGET_DIR', str(tmp_path))
+    storage = MemoryStorage()
+    Task._manifest = TargetManifest(path=str(tmp_path / 'manifest.sqlite'),
+                                    storage=storage)
+    try:
+        pipe = Pipe([T3], params)
+        pipe.remove_all()
+        pipe.run()
+        metadata = pipe.load_all_metadata()
+        assert set(metadata) == set(pipe.all_tasks)
+        assert all(m['version'] == '0.0.0' for m in metadata.values())
+        t1 = T1(**params)
+        assert list(pipe.query_metadata(task_family=t1.get_task_family())) == [t1]
+        # a pipeline starting from an empty manifest pulls the pushed one
+        Task._manifest = TargetManifest(path=str(tmp_path / 'other.sqlite'),
+                                        storage=storage)
+        pipe = Pipe([T3], params)
+        pipe.pull_manifest()
+        assert len(Task._manifest) == len(pipe.all_tasks)
+    finally:
+        Task._manifest = None
+
+def test_update_all_complete_status():
+    params = {}
+    pipe = Pipe([T3],params)
+    pipe.remove_all()
+    pipe.run()
+    T1(**params).remove()
+    pipe.update_all_complete_status()
+    assert not pipe.get_task_complete(T1(**params))
+    assert pipe.get_task_complete(T2(**params))
+    assert pipe.get_task_complete(T3(**params))
+
+def test_update_all_complete_status_with_listing():
+    import boto3
+    from unittest.mock import patch
+    from ruigi import Task
+    from ruigi.backends.aws import S3Storage
+    try:
+        from moto import mock_aws
+    except ImportError:
+        return
+    params = {}
+    with mock_aws():
+        boto3.resource('s3', region_name='us-east-1').create_bucket(Bucket='ruigi')
+        Task._storage = S3Storage('ruigi')
+        try:
+            pipe = Pipe([T3],params)
+            pipe.run()
+            T2(**params).remove()
+            with patch.object(S3Storage, 'exists') as exists:
+                pipe.update_all_complete_status()
+            exists.assert_not_called()
+            assert pipe.get_task_complete(T1(**params))
+            assert not pipe.get_task_complete(T2(**params))
+            assert pipe.get_task_complete(T3(**params))
+        finally:
+            Task._storage = None
+
+def test_run_flushes_tiered_storage(tmp_path):
+    from ruigi import Task
+    from ruigi.backends.local import LocalStorage
+    from ruigi.backends.memory import MemoryStorage
+    from ruigi.backends.tiered import TieredStorage
+    params = {}
+    remote = MemoryStorage()
+    Task._storage = TieredStorage(LocalStorage(str(tmp_path)), remote)
+    try:
+        pipe = Pipe([T3],params)
+        pipe.run()
+        assert Task._storage.pending() == []
+        assert remote.exists(T3(**params).output().path)
+    finally:
+        Task._storage = None
+
+def test_run_writes_storage_metrics(tmp_path):
+    import json
+    from ruigi import Task
+    from ruigi.backends import metrics
+    from ruigi.backends.memory import MemoryStorage
+    params = {}
+    metrics.default_registry().reset()
+    Task._storage = MemoryStorage()
+    try:
+        pipe = Pipe([T3],params)
+        pipe.remove_all()
+        pipe.run(metrics_path=str(tmp_path / 'metrics.json'))
+        pipe.run(metrics_path=str(tmp_path / 'metrics.prom'))
+    finally:
+        Task._storage = None
+    snapshot = json.loads((tmp_path / 'metrics.json').read_text())
+    saves = [op for op in snapshot['operations']
+             if op['storage'] == 'MemoryStorage' and op['operation'] == 'save']
+    assert sum(op['count'] for op in saves) >= 3
+    assert sum(op['bytes'] for op in saves) > 0
+    assert 'ruigi_storage_latency_seconds_bucket{storage="MemoryStorage"' \
+        in (tmp_path / 'metrics.prom').read_text()
+
+def test_run_merges_metrics_of_worker_processes(tmp_path):
+    import json
+    from ruigi import Task
+    from ruigi.backends import metrics
+    from ruigi.backends.local import LocalStorage
+    params = {}
+    metrics.default_registry().reset()
+    Task._storage = LocalStorage(str(tmp_path / 'store'))
+    try:
+        pipe = Pipe([T3],params)
+        pipe.remove_all()
+        pipe.run(workers=2, metrics_path=str(tmp_path / 'metrics.json'))
+    finally:
+        Task._storage = None
+    snapshot = json.loads((tmp_path / 'metrics.json').read_text())
+    # The outputs are saved in the worker processes.
+    saves = [op for op in snapshot['operations']
+             if op['storage'] == 'LocalStorage' and op['operation'] == 'save']
+    assert sum(op['count'] for op in saves) >= 3
+
+def test_deep_pipe_is_built_without_recursion():
+    import sys
+    from .test_utils import SyntheticTask
+    nodes = sys.getrecursionlimit() + 500
+    pipe = Pipe([SyntheticTask], dict(nodes=nodes, shape='chain'))
+    assert len(pipe.all_tasks) == nodes
+    assert pipe.leaf_nodes == [SyntheticTask(nodes=nodes, index=nodes - 1)]
+    assert pipe.rev_dag[pipe.top_nodes[0]] == []
+
+def test_lazy_pipe():
+    from .test_utils import SyntheticTask
+    params = dict(nodes=15, shape='tree')
+    eager = Pipe([SyntheticTask], params)
+    pipe = Pipe([SyntheticTask], params, lazy=True)
+    assert pipe.dag.expanded == 0
+    top = pipe.top_nodes[0]
+    assert pipe.dag[top] == [top.clone(index=1), top.clone(index=2)]
+    assert pipe.dag.expanded == 1
+    # traversing a sub-DAG only expands it
+    from ruigi.utils import breadth_first_search
+    list(breadth_first_search(pipe.dag, [top.clone(index=1)]))
+    assert pipe.dag.expanded == 1 + 7
+    assert set(pipe.all_tasks) == set(eager.all_tasks)
+    assert pipe.dag.expanded == 15
+    assert dict(pipe.dag.items()) == eager.dag
+
+def test_downstream_complete_deep_dag():
+    from ._tools import _downstream_complete
+    dag = {i: [i + 1] for i in range(5000)}
+    dag[5000] = []
+    status = {}
+    assert not _downstream_complete(dag, [0], status, lambda i: i != 4000)
+    assert all(status[i] for i in range(4001, 5001))
+    assert not any(status[i] for i in range(4001))
+
+def test_task_indexes():
+    from .test_utils import SyntheticTask
+
+    class SubTask(SyntheticTask):
+        def requires(self):
+            return []
+
+    class Top(SyntheticTask):
+        def requires(self):
+            return [SyntheticTask(nodes=7, shape='tree'), SubTask(nodes=7, index=100)]
+
+    pipe = Pipe([Top], dict(nodes=7, index=50))
+    assert len(pipe.all_tasks) == 1 + 7 + 1
+    sub = SubTask(nodes=7, index=100)
+    assert pipe.get_task_by_id(sub.task_id) is sub
+    assert pipe.get_matching_tasks(SubTask) == [sub]
+    assert pipe.get_task_instance(SubTask) is sub
+    matching = pipe.get_matching_tasks(SyntheticTask)
+    assert len(matching) == 9
+    assert matching == [t for t in pipe.all_tasks if t in set(matching)]
+
+    assert pipe.find_tasks(SyntheticTask, index=3) == [SyntheticTask(nodes=7, index=3, shape='tree')]
+    assert pipe.find_tasks(SyntheticTask, index=100) == [sub]
+    assert pipe.find_tasks(task_family='SyntheticTask', shape='tree', index=100) == []
+    assert len(pipe.find_tasks(task_family='SyntheticTask', shape='tree')) == 7
+    assert len(pipe.find_tasks(nodes=7)) == 9
+    assert pipe.find_tasks(T1) == []
+
+def test_remove_obsolete():
+    from unittest.mock import patch
+    from ruigi import Task
+    from ruigi.backends.memory import MemoryStorage
+    params = {}
+    Task._storage = MemoryStorage()
+    try:
+        pipe = Pipe([T3],params)
+        pipe.run()
+        assert pipe.remove_obsolete() == {}
+
+        t1, t2, t3 = T1(**params), T2(**params), T3(**params)
+        with patch.object(T1, 'version', '0.0.1'):
+            assert pipe.remove_obsolete(dry_run=True) == {t1: 'version', t3: 'downstream'}
+            assert t1.output().exists()
+            assert pipe.remove_obsolete() == {t1: 'version', t3: 'downstream'}
+        assert not t1.output().exists()
+        assert t2.output().exists()
+        assert not t3.output().exists()
+
+        pipe.run()
+        metadata = t2.load_metadata()
+        metadata['hash_version'] = 'previous'
+        t2.output().dump_metadata(metadata)
+        assert pipe.remove_obsolete() == {t2: 'hash_version', t3: 'downstream'}
+        assert t1.output().exists()
+        assert not t2.output().exists()
+    finally:
+        Task._storage = None
+
+def test_plan():
+    from unittest.mock import patch
+    from ruigi import Task
+    from ruigi.backends.memory import MemoryStorage
+    params = {}
+    Task._storage = MemoryStorage()
+    try:
+        pipe = Pipe([T3],params)
+        t1, t2, t3 = T1(**params), T2(**params), T3(**params)
+        plan = pipe.plan(workers=2, durations={T3: 5.}, default_duration=10.)
+        assert set(plan.tasks[:2]) == {t1, t2} and plan.tasks[2] == t3
+        assert plan.durations == {t1: 10., t2: 10., t3: 5.}
+        assert plan.estimated_seconds == 15.
+        assert plan.critical_path_seconds == 15.
+        assert plan.total_seconds == 25.
+        assert pipe.plan(workers=1, durations={T3: 5.}, default_duration=10.).estimated_seconds == 25.
+        assert '3 tasks to run' in plan.summary()
+        pipe.run(plan=plan)
+        assert len(pipe.plan()) == 0
+
+        # only the tasks needed by incomplete tasks run
+        t3.remove()
+        plan = pipe.plan()
+        assert plan.tasks == [t3]
+        with patch.object(T1, 'complete') as complete:
+            assert pipe.run(plan=plan)
+        complete.assert_not_called()
+        assert t3.output().exists()
+        assert not any('complete' in t.__dict__ for t in pipe.all_tasks)
+    finally:
+        Task._storage = None
+
+def test_plan_uses_recorded_durations():
+    import luigi
+    from ruigi import Task, inherit_list
+    from ruigi.backends.memory import MemoryStorage
+
+    def part(**params):
+        return params['i']
+
+    def whole(x, y, **params):
+        return x + y
+
+    class Part(Task):
+        i = luigi.IntParameter(default=0)
+        task_function = part
+
+    @inherit_list((Part, {'i': 1}), (Part, {'i': 2}))
+    class Whole(Task):
+        task_function = whole
+
+    Task._storage = MemoryStorage()
+    try:
+        pipe = Pipe([Whole], {})
+        pipe.run()
+        part1, part2 = Part(i=1), Part(i=2)
+        run_seconds = part1.load_metadata()['run_seconds']
+        assert run_seconds >= 0
+        part2.remove()
+        pipe.top_nodes[0].remove()
+        plan = pipe.plan(default_duration=100.)
+        assert plan.tasks == [part2, pipe.top_nodes[0]]
+        assert plan.durations[part2] == run_seconds
+        assert plan.estimated_seconds == run_seconds + 100.
+    finally:
+        Task._storage = None
+
+def test_topological_sort_and_estimates():
+    from ruigi.utils import topological_sort
+    from ._tools import _simulate_run, _critical_path
+    dag = {'a': ['b', 'c'], 'b': ['d'], 'c': ['d'], 'd': [], 'e': ['d']}
+    order = topological_sort(dag)
+    assert order[0] == 'd' and order.index('a') > max(order.index('b'), order.index('c'))
+    assert topological_sort(dag, ['a', 'b']) == ['b', 'a']
+    durations = dict(a=1., b=2., c=3., d=4., e=5.)
+    assert _critical_path(dag, order, durations) == 9.
+    assert _simulate_run(dag, order, durations, workers=1) == 15.
+    assert _simulate_run(dag, order, durations, workers=3) == 9.
+
+def test_find_tasks_with_unhashable_params():
+    import datetime
+    import luigi
+    from ruigi import Task
+
+    class WithDict(Task):
+        options = luigi.Parameter()
+        day = luigi.DateParameter()
+
+    pipe = Pipe([WithDict], {'options': {'a': [1, 2]}, 'day': datetime.date(2020, 1, 2)})
+    task = pipe.top_nodes[0]
+    assert pipe.find_tasks(options={'a': [1, 2]}) == [task]
+    assert pipe.find_tasks(WithDict, options={'a': [1, 2]}, day='2020-01-02') == [task]
+    assert pipe.find_tasks(WithDict, day=datetime.date(2020, 1, 2)) == [task]
+    assert pipe.find_tasks(WithDict, day='2020-01-03') == []
+    assert pipe.find_tasks(WithDict, unknown=1) == []
+    assert pipe.plan(default_duration=1.).tasks == [task]
+
+def test_metadata_errors_are_not_missing_metadata():
+    from ruigi import Task
+    from ruigi.backends.memory import MemoryStorage
+
+    class Forbidden(MemoryStorage):
+        def load(self, name, **kwargs):
+            if name.endswith('.metadata'):
+                raise PermissionError(name)
+            return super().load(name, **kwargs)
+
+    params = {}
+    Task._storage = Forbidden()
+    try:
+        pipe = Pipe([T3],params)
+        pipe.run()
+        try:
+            pipe.remove_obsolete()
+        except PermissionError:
+            pass
+        else:
+            raise AssertionError("PermissionError was not raised")
+        assert T3(**params).output().exists()
+    finally:
+        Task._storage = None
+
+def test_remove_obsolete_removes_downstream_without_metadata():
+    from unittest.mock import patch
+    from ruigi import Task
+    from ruigi.backends.memory import MemoryStorage
+    params = {}
+    Task._storage = MemoryStorage()
+    try:
+        pipe = Pipe([T3],params)
+        pipe.run()
+        t1, t3 = T1(**params), T3(**params)
+        t3.output().remove_metadata()
+        with patch.object(T1, 'version', '0.0.1'):
+            assert pipe.remove_obsolete() == {t1: 'version', t3: 'downstream'}
+        assert not t3.output().exists()
+    finally:
+        Task._storage = None
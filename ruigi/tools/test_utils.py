@@ -0,0 +1,32 @@
+"""
+Tasks shared by the tests of :py:mod:`ruigi.tools` and its construction
+benchmark.
+"""
+import luigi
+from ruigi.task import Task
+
+
+class SyntheticTask(Task):
+    """ Task `index` of a synthetic pipeline of `nodes` tasks, shaped as
+    described in :py:mod:`ruigi.tools.benchmark`."""
+    index = luigi.IntParameter(default=0)
+    nodes = luigi.IntParameter()
+    shape = luigi.Parameter(default='chain')
+    width = luigi.IntParameter(default=1000)
+    fan_in = luigi.IntParameter(default=3)
+
+    def requires(self):
+        i, n = self.index, self.nodes
+        if self.shape == 'chain':
+            sons = [i + 1]
+        elif self.shape == 'tree':
+            sons = [2 * i + 1, 2 * i + 2]
+        elif self.shape == 'layered':
+            if i == 0:
+                sons = range(1, self.width + 1)
+            else:
+                first = ((i - 1) // self.width + 1) * self.width + 1
+                sons = [first + (i + k) % self.width for k in range(self.fan_in)]
+        else:
+            raise ValueError(f"Unknown shape {self.shape}")
+        return [self.clone(index=j) for j in sons if j < n]
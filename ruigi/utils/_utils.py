@@ -1,4 +1,5 @@
 
+from collections import deque
 import builtins
 
 def int_to_bytes(i: int) -> bytes:
@@ -44,28 +45,15 @@ def build_dag(top_nodes: list, get_sons: 'function' = None) -> dict:
     """
     assert isinstance(top_nodes,list)
     dag = {}
-
-    def build_tree(task_list):
-        # breadth first search
-        nonlocal dag, get_sons
-
-        # add new nodes
-        for t in task_list:
+    # breadth first search, level by level, without recursion
+    level = list(top_nodes)
+    while level:
+        sons_list = []
+        for t in level:
             if t not in dag:
                 dag[t] = get_sons(t)
-
-        # get all nodes of this level
-        sons_list = []
-        for k,v in dag.items():
-            for vi in v:
-                if vi not in dag:
-                    sons_list.append(vi)
-
-        # recursion level wise
-        if sons_list:
-            build_tree(sons_list)
-
-    build_tree(top_nodes)
+                sons_list.extend(vi for vi in dag[t] if vi not in dag)
+        level = sons_list
     return dag
 
 
@@ -78,12 +66,8 @@ def find_root_in_dag(dag: dict) -> list:
     Returns:
         root_nodes: list of root nodes
     """
-    candidates = [k for k in dag]
-    for k, sons_list in dag.items():
-        for it in sons_list:
-            if it in candidates:
-                candidates.remove(it)
-    root_nodes = candidates
+    sons = {it for sons_list in dag.values() for it in sons_list}
+    root_nodes = [k for k in dag if k not in sons]
     return root_nodes
 
 def find_leaf_in_dag(dag: dict) -> list:
@@ -149,14 +133,48 @@ def breadth_first_search(dag: dict, starting_nodes = [], f: 'function'=None,
             for n in starting_nodes:
                 f(n, *args, **kwargs)
 
-        # get all nodes of this level
-        sons_list = [n for k in starting_nodes for n in dag[k]]
+        # get all nodes of this level, once each, so that shared
+        # dependencies do not multiply on every level
+        sons_list = list(dict.fromkeys(n for k in starting_nodes for n in dag[k]))
 
         yield sons_list
 
         starting_nodes = sons_list
 
 
+def topological_sort(dag: dict, nodes: list = None) -> list:
+    """
+    Returns nodes ordered so that every node comes after its sons.
+    Args:
+        dag: dict encoding a DAG
+        nodes: list of nodes to sort. if None all nodes are used. Edges to
+        nodes out of this list are ignored.
+
+    Returns:
+        sorted_nodes: list of nodes
+    """
+    nodes = list(dag) if nodes is None else list(nodes)
+    selected = set(nodes)
+    n_sons = {}
+    fathers = {n: [] for n in nodes}
+    for n in nodes:
+        sons = [s for s in dict.fromkeys(dag[n]) if s in selected]
+        n_sons[n] = len(sons)
+        for s in sons:
+            fathers[s].append(n)
+    ready = deque(n for n in nodes if not n_sons[n])
+    sorted_nodes = []
+    while ready:
+        n = ready.popleft()
+        sorted_nodes.append(n)
+        for f in fathers[n]:
+            n_sons[f] -= 1
+            if not n_sons[f]:
+                ready.append(f)
+    assert len(sorted_nodes) == len(nodes), "graph has a cycle"
+    return sorted_nodes
+
+
 def get_reverse_dag(dag: dict) -> dict:
     """
     Returns a DAG with the same nodes as the original one, but with edges
@@ -205,4 +223,19 @@ def test_isbuiltin():
 
 def enumerate_with_context(instructions):
     for ix, inst in enumerate(instructions):
-        yield (ix,inst,instructions)
\ No newline at end of file
+        yield (ix,inst,instructions)
+
+class cached_property:
+    """Property computed once per instance, then stored in the instance
+    `__dict__`. Deleting the attribute resets it. Same as
+    `functools.cached_property`, which requires python 3.8."""
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        self.name = func.__name__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
@@ -30,3 +30,31 @@ def test_get_reverse_dag():
     print(get_reverse_dag(dag))
     print(get_reverse_dag(get_reverse_dag(dag)))
     assert dag == get_reverse_dag(get_reverse_dag(dag))
+
+
+def test_find_root_in_dag():
+    assert find_root_in_dag(dag) == [0]
+    assert find_leaf_in_dag(dag) == [4]
+
+
+def test_build_deep_dag():
+    n = 5000
+    chain = build_dag([0], lambda i: [i + 1] if i < n else [])
+    assert len(chain) == n + 1
+    assert find_root_in_dag(chain) == [0]
+
+
+def test_cached_property():
+    calls = []
+
+    class A:
+        @cached_property
+        def value(self):
+            calls.append(1)
+            return len(calls)
+
+    a = A()
+    assert a.value == 1 and a.value == 1
+    del a.value
+    assert a.value == 2
+    assert A().value == 3
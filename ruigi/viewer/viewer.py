@@ -11,7 +11,7 @@ def load_pipeline():
     from importlib import reload
     app_pipeline = reload(app.pipeline)
 
-    from pycarol.pipeline.tools import Pipe
+    from ruigi.tools import Pipe
 
     try:
         pipeline = app_pipeline.pipeline
@@ -21,8 +21,8 @@ def load_pipeline():
         raise e
     except AssertionError as e:
         print(
-            "pipeline object in app/pipeline.py should be an instance of from "
-            "pycarol.pipeline.tools.Pipe class")
+            "pipeline object in app/pipeline.py should be an instance of "
+            "ruigi.tools.Pipe class")
         raise e
 
     return pipeline
@@ -30,7 +30,7 @@ def load_pipeline():
 
 def show_pipeline():
     pipeline = load_pipeline()
-    from pycarol.pipeline.viewer.dash_plot import get_app_from_pipeline
+    from ruigi.viewer.dash_plot import get_app_from_pipeline
     app = get_app_from_pipeline(pipeline)
 
     import jupyterlab_dash
@@ -8,12 +8,13 @@ here = os.path.abspath(os.path.dirname(__file__))
 
 
 min_requires = [
-    'luigi', "retry", 'joblib', 'pandas', 'pyarrow'
+    'luigi', 'joblib', 'pandas', 'pyarrow'
 ]
 
 extras_require = {
     "dev": ['pytest', 'bumpversion', "sphinx-rtd-theme", "sphinx"],
-    "azure": ['azure-datalake-store', 'adlfs']
+    "azure": ['azure-datalake-store', 'adlfs'],
+    "duckdb": ['duckdb'],
 }
 
 extras_require["complete"] = sorted(